@@ -0,0 +1,190 @@
+"""Benchmarks for the performance critical parts of the model."""
+import sys
+import time
+from collections import deque
+from types import MappingProxyType
+import numpy as np
+
+from model.microgrid_relations import can_send_to
+from model.microgrid_topology import get_circuits
+from model.microgrid_plan import StepPlan
+from model.microgrid_simulation import Simulation, RetentionPolicy
+from model.microgrid_montecarlo import iter_monte_carlo
+
+def make_random_conn(num_actors: int, degree: float=3., seed: int=0)-> np.ndarray:
+    """Returns a random connectivity matrix where each actor sends power
+    to ``degree`` other actors on average."""
+    rng = np.random.default_rng(seed)
+    prob = min(1., degree / max(1, num_actors))
+    conn = (rng.random((num_actors, num_actors)) < prob).astype(float)
+    return conn
+
+def get_circuits_pairwise(conn: list, names: list)->list:
+    """The previous form of ``get_circuits``, which searches for a path
+    between every ordered pair of actors. Kept as a reference."""
+    circuits, n = [], len(conn)
+    conns = {src : {sink for sink in range(n)
+                    if can_send_to(src, sink, conn)} for src in range(n)}
+
+    for src, sinks in conns.items():
+        if len(sinks) == 0:
+            continue
+        for suppliers, demanders in circuits:
+            if all([d in sinks for d in demanders]):
+                suppliers.add(src)
+        if sinks not in [c[1] for c in circuits]:
+            circuits.append(({src}, sinks))
+
+    circuits = [tuple([names[a] for a in s] for s in c) for c in circuits]
+    return circuits
+
+def time_call(func, *args, repeats: int=3)-> float:
+    """Returns the shortest time (in seconds) of calling the function."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def benchmark_circuits(sizes: list=(12, 25, 50, 100, 250, 500, 1000),
+                       degree: float=3., repeats: int=3,
+                       max_pairwise: int=50, to_print: bool=True)-> list:
+    """Times circuit detection on random grids of each size, comparing
+    against the pairwise search for grids of up to ``max_pairwise``
+    actors (after which it takes minutes per call).
+
+    Returns a list of dicts with the number of actors, the time for each
+    method, and whether the circuits found by each method match.
+    """
+    if to_print:
+        print(f'{"actors":>8}{"closure (ms)":>15}{"pairwise (ms)":>15}{"match":>8}')
+    results = []
+    for n in sizes:
+        conn = make_random_conn(n, degree, seed=n)
+        names = [f'actor{i}' for i in range(n)]
+        result = dict(actors=n, closure=time_call(get_circuits, conn, names,
+                                                  repeats=repeats))
+        if n <= max_pairwise:
+            result['pairwise'] = time_call(get_circuits_pairwise, conn, names,
+                                           repeats=1)
+            result['match'] = get_circuits(conn, names) == get_circuits_pairwise(conn, names)
+        results.append(result)
+
+        if to_print:
+            pairwise = f'{1e3 * result["pairwise"]:15.2f}' if 'pairwise' in result else f'{"-":>15}'
+            print(f'{n:>8}{1e3 * result["closure"]:15.2f}{pairwise}{str(result.get("match", "-")):>8}')
+    return results
+
+def benchmark_plan(hg, target, inputs: dict, num_steps: int=1000,
+                   solve_steps: int=30, search_depth: int=500000,
+                   to_print: bool=True)-> dict:
+    """Compares the step throughput of a compiled ``StepPlan`` against 
+    ``Hypergraph.solve`` for the target, returning a dict of the steps
+    per second of each along with the number of mismatches between the
+    two over ``solve_steps``."""
+    start = time.perf_counter()
+    hg.solve(target, inputs=inputs, min_index=solve_steps, search_depth=search_depth)
+    solve_rate = solve_steps / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    plan = StepPlan(hg, [target], inputs)
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for index, frame in plan.iter_steps(inputs):
+        if index >= num_steps:
+            break
+    plan_rate = num_steps / (time.perf_counter() - start)
+
+    mismatches = plan.verify(inputs, solve_steps, search_depth)
+    result = dict(solve=solve_rate, plan=plan_rate, compile=compile_time,
+                  mismatches=len(mismatches))
+    if to_print:
+        print(f'solve: {solve_rate:.1f} steps/s, plan: {plan_rate:.1f} steps/s '
+              f'(compiled in {compile_time:.2f} s), mismatches: {len(mismatches)}')
+    return result
+
+def get_deep_size(obj, seen: set=None)-> int:
+    """Returns the number of bytes held by the object and everything it
+    contains, counting shared objects once. Memory-mapped arrays are 
+    counted without the file they map."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, np.memmap):
+        return size
+    if isinstance(obj, np.ndarray):
+        return size if obj.base is None else size + obj.nbytes
+    if isinstance(obj, (dict, MappingProxyType)):
+        size += sum(get_deep_size(k, seen) + get_deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(get_deep_size(item, seen) for item in obj)
+    return size
+
+def benchmark_retention(hg, inputs: dict, horizons: list=(168, 8760), 
+                        nodes: list=None, solve_horizon: int=168, 
+                        search_depth: int=500000, to_print: bool=True)-> list:
+    """Compares the memory kept by each retention policy of a simulation
+    for each horizon, along with the values kept by ``Hypergraph.solve``
+    for the ``solve_horizon`` (if given).
+
+    Returns a list of dicts with the policy, horizon, kilobytes kept in
+    the history and buffers, and the time taken.
+    """
+    policies = {
+        'keep all': RetentionPolicy(keep_all=True),
+        'selected': RetentionPolicy(),
+        'buffers only': RetentionPolicy(history=[]),
+    }
+    if to_print:
+        print(f'{"policy":>14}{"steps":>8}{"history (kB)":>15}{"buffers (kB)":>15}{"time (s)":>10}')
+    results = []
+    if solve_horizon is not None:
+        start = time.perf_counter()
+        t = hg.solve('state_vector', inputs=inputs, min_index=solve_horizon,
+                     search_depth=search_depth)
+        results.append(dict(policy='solve', steps=solve_horizon, 
+                            history=get_deep_size(t.values) / 1e3, buffers=0.,
+                            time=time.perf_counter() - start))
+        if to_print:
+            r = results[-1]
+            print(f'{r["policy"]:>14}{r["steps"]:>8}{r["history"]:15.1f}{r["buffers"]:15.1f}{r["time"]:10.2f}')
+
+    for num_steps in horizons:
+        for name, policy in policies.items():
+            sim = Simulation(hg, inputs, nodes=nodes, retention=policy)
+            start = time.perf_counter()
+            history = sim.run(num_steps)
+            results.append(dict(policy=name, steps=num_steps,
+                                history=get_deep_size(history) / 1e3,
+                                buffers=get_deep_size(sim.store.buffers) / 1e3,
+                                time=time.perf_counter() - start))
+            if to_print:
+                r = results[-1]
+                print(f'{r["policy"]:>14}{r["steps"]:>8}{r["history"]:15.1f}{r["buffers"]:15.1f}{r["time"]:10.2f}')
+    return results
+
+def benchmark_monte_carlo(num_runs: int=32, worker_counts: list=(1, 2, 4),
+                          inputs: dict=None, num_steps: int=336,
+                          to_print: bool=True)-> list:
+    """Times a Monte Carlo study with each number of worker processes,
+    returning a list of dicts with the number of workers, the runs per
+    second, and the speedup over a single worker. The time includes 
+    starting the workers and compiling the model in each."""
+    if to_print:
+        print(f'{"workers":>8}{"runs/s":>10}{"speedup":>10}')
+    results = []
+    for max_workers in worker_counts:
+        start = time.perf_counter()
+        for result in iter_monte_carlo(num_runs, inputs, num_steps, 
+                                       max_workers=max_workers):
+            pass
+        rate = num_runs / (time.perf_counter() - start)
+        speedup = rate / results[0]['rate'] if len(results) > 0 else 1.
+        results.append(dict(workers=max_workers, rate=rate, speedup=speedup))
+        if to_print:
+            print(f'{max_workers:>8}{rate:10.2f}{speedup:10.2f}')
+    return results
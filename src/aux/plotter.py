@@ -3,42 +3,33 @@ import matplotlib.pyplot as plt
 import constrainthg as chg
 from collections import defaultdict
 from itertools import zip_longest
+import warnings
+
+from model.microgrid_simulation import Simulation
+
+SIMULATION_KWARGS = ('nodes', 'retention', 'seed', 'trace_index', 'search_depth')
 
 plt.rcParams['font.family'] = 'times'
 plt.rcParams['font.size'] = 14
 plt.rcParams['font.weight'] = 'bold'
 
 def solve_and_plot(hg: chg.Hypergraph, nodes: list, inputs: dict, indices: list=None):
-    """Solves the graph for each of the nodes (at the given indices) and plots the results."""
-    found_values = {}
+    """Simulates the graph up to the largest of the indices and plots the
+    values of each of the nodes (up to its index)."""
     if indices is None:
         indices = [1 for n in nodes]
     else:
         indices = [1 if i is None else i for i in indices]
 
-    for node, min_index in zip(nodes, indices):
-        if len(found_values.get(node.label, [])) >= min_index:
-            continue
-        found_values = solve_and_append(hg, found_values, node, inputs, min_index, to_print=False)
-        if found_values is not None:
-            if len(found_values[node.label]) < min_index:
-                found_values[node.label] = [] #clear previous find
-                for index in range(min_index):
-                    found_values = solve_and_append(hg, found_values, node, inputs, index, to_print=False)
-
-    labels = [n.label for n in nodes if n.label in found_values]
-    plot_time_values(labels, found_values, 'time')
-
-def solve_and_append(hg: chg.Hypergraph, found_values: dict, node: chg.Node, inputs: dict, min_index: int, **kwargs):
-    """Solves the graph for the node at the given index and adds its value to the dict of found values."""
-    t = hg.solve(node, inputs, min_index=min_index, to_print=False)
-    if t is None:
-        return None
-    if node.label not in found_values:
-        found_values[node.label] = []
-    found_values[node.label].extend(t.values[node.label])
-    found_values =  t.values | found_values
-    return found_values
+    sim = Simulation(hg, inputs, nodes=nodes)
+    found_values = sim.run(max(indices))
+
+    labels = []
+    for label, min_index in zip(sim.nodes, indices):
+        found_values[label] = [v for v in found_values[label][:min_index] if v is not None]
+        if len(found_values[label]) > 0:
+            labels.append(label)
+    plot_time_values(labels, found_values, sim.time_label)
 
 def plot_time_values(labels: list, found_values: dict, time_step: float, 
                    title: str='Simulation', ylabel: str='Variables'):
@@ -87,23 +78,33 @@ def plot_time_values(labels: list, found_values: dict, time_step: float,
     plt.title(title)
     plt.show()
 
+def get_simulation_kwargs(kwargs: dict)-> dict:
+    """Returns the keyword arguments accepted by ``Simulation``, warning
+    that any others (such as those of ``Hypergraph.solve``) are ignored."""
+    ignored = [key for key in kwargs if key not in SIMULATION_KWARGS]
+    if len(ignored) > 0:
+        warnings.warn(f'Ignoring arguments not accepted by Simulation: {ignored}',
+                      stacklevel=3)
+    return {key: val for key, val in kwargs.items() if key in SIMULATION_KWARGS}
+
 def solve_and_plot_states(mg: chg.Hypergraph, inputs: dict, min_index: int=8,
                           state_vector: str='state_vector', time: str='time', 
                           **kwargs):
-    """Solves the Hypergraph for the `state_vector`, then plots the 
+    """Simulates the Hypergraph for the `state_vector`, then plots the 
     state of each actor on the grid."""
-    t = mg.solve(state_vector, inputs=inputs, min_index=min_index, **kwargs)
-    fv = t.values
-    names = fv.get('names', [mg.solve('names', inputs=inputs).value])[0]
+    sim = Simulation(mg, inputs, state_vector=state_vector, time=time, 
+                     **get_simulation_kwargs(kwargs))
+    names = sim.names
+    trajectories = sim.run(min_index)
     states = defaultdict(list)
-    states['time'] = fv['time']
-    for sv in fv[state_vector]:
+    states[sim.time_label] = trajectories[sim.time_label]
+    for sv in trajectories[sim.state_label]:
         for state_value, name in zip(sv, names):
             if 'bus' in name.lower():
                 continue
             states[name].append(state_value)
     outnames = [n for n in names if 'bus' not in n.lower()]
-    plot_time_values(outnames, states, time, 
+    plot_time_values(outnames, states, sim.time_label, 
                      title='States of Grid Actors', ylabel='Power (kW)')
     
 def plot_general_study(mg: chg.Hypergraph, **inputs: dict):
@@ -140,16 +141,15 @@ def plot_general_study(mg: chg.Hypergraph, **inputs: dict):
         if not inputs['island_mode']:
             plot_data.append(('UtilityGrid', 'Utility Grid', '#ff5555', '-'))
 
-        t = mg.solve('state_vector', inputs=inputs, min_index=168)
-        fv = t.values
-        times = [t/3600 for t in fv['time']]
-        names = fv['names'][0]
+        sim = Simulation(mg, inputs)
+        name_index = {name: i for i, name in enumerate(sim.names)}
 
-        states = {}
-        for actor_tuple in plot_data:
-            name = actor_tuple[0]
-            values = [sv[names.index(name)] for sv in fv['state_vector']]
-            states[name] = values
+        times, states = [], defaultdict(list)
+        for step in sim.iter_steps(168):
+            times.append(step.time / 3600)
+            for actor_tuple in plot_data:
+                name = actor_tuple[0]
+                states[name].append(step.state_vector[name_index[name]])
 
         lines = []
         for name, label, color, dash in plot_data:
@@ -175,13 +175,12 @@ def plot_general_study(mg: chg.Hypergraph, **inputs: dict):
     
 def plot_validation_study(sg: chg.Hypergraph, inputs: dict, min_index: int=2500,
                            **kwargs):
-    """Solves the validation microgrid and plots the validation study."""
-    t = sg.solve('state_vector', inputs=inputs, min_index=min_index, 
-                 search_depth=500000, **kwargs)
-    fv = t.values
-    names = fv['names'][0]
-    csvdata = fv['validation_data']
-    times = [t / 3600 for t in fv['time']]
+    """Simulates the validation microgrid and plots the validation study."""
+    kwargs = get_simulation_kwargs(kwargs)
+    kwargs.setdefault('search_depth', 500000)
+    nodes = ['validation_data'] + list(kwargs.pop('nodes', []))
+    sim = Simulation(sg, inputs, nodes=nodes, **kwargs)
+    names = sim.names
     labels = ['BESS', 'Generator', 'Photovoltaic Array', 'Test Load']
     # csv_tags = ['Battery Power (kW)', 'Generator power (kW)', 'Solar Power (kW)', 'Powerload (kW)']
     csv_tags = ['Battery Power', 'Generator power']
@@ -189,18 +188,20 @@ def plot_validation_study(sg: chg.Hypergraph, inputs: dict, min_index: int=2500,
     colors = ['#00bb55', '#8833bb', '#ddaa00', '#0055aa']
     styles = ['-', '-', '--', '--']
 
-    states = defaultdict(list)
-    for sv in fv['state_vector']:
-        for state_value, name in zip(sv, names):
+    times, states = [], defaultdict(list)
+    for step in sim.iter_steps(min_index):
+        times.append(step.time / 3600)
+        for state_value, name in zip(step.state_vector, names):
             if name not in labels:
                 continue
             states[name].append(state_value)
+    csvdata = step.values['validation_data']
 
     fig, ax = plt.subplots(figsize=(10,4))
 
     csv_lines = []
     for tag, color, label in zip(csv_tags, colors[:len(csv_tags)], csv_labels):
-        csvvalues = [float(d[tag]) for d in csvdata[0]]
+        csvvalues = csvdata[tag].tolist()
         csv_lines.append(ax.plot(times[:len(csvvalues)], csvvalues[:len(times)],
                 lw=5, color=color + '55', linestyle='-', label=label)[0])
 
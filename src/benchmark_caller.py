@@ -0,0 +1,26 @@
+from aux.benchmarks import *
+from model.microgrid import mg, state_vector
+
+# Inputs for the example microgrid
+inputs = {
+    'use_random_date': False,
+    'start_day': 100,
+    'start_year': 2005,
+    'start_hour': 6,
+    'has_random_failure': False,
+    'island_mode': True,
+    'time_step': 3600,
+}
+
+if __name__ == '__main__':
+    # Circuit detection on random grids from 12 to 1,000 actors
+    benchmark_circuits(sizes=(12, 25, 50, 100, 250, 500, 1000), degree=3.)
+
+    # Step throughput of the compiled plan against solve
+    benchmark_plan(mg, state_vector, inputs, num_steps=2000)
+
+    # Memory kept by each retention policy over a week and a year
+    benchmark_retention(mg, inputs, horizons=(168, 8760), nodes=['SOC_Battery1'])
+
+    # Monte Carlo throughput with the number of worker processes
+    benchmark_monte_carlo(num_runs=32, worker_counts=(1, 2, 4))
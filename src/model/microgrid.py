@@ -1,12 +1,9 @@
 from constrainthg import Node, Hypergraph
 import constrainthg.relations as R
-import random
 
 from model.microgrid_actors import *
 from model.microgrid_relations import *
 
-random.seed(3)
-
 mg = Hypergraph(no_weights=True)
 
 ## ----- Actors ----- ##
@@ -89,20 +86,14 @@ BUILDINGs = [
 ACTORS = GENs + BATTERYs + UGs + BUSs + PVs + LOADs + BUILDINGs + WINDs
 
 ### Connectivity
-#### Receivers (set which actors are wired to receive power from which other actors)
-for ACTOR in ACTORS: #Set default as not connected
-    for SRC in ACTORS:
-        ACTOR.add_source(SRC, SRC is ACTOR)
-
+#### Buses (set which buses each actor is wired to)
 bus0 = UGs + GENs + WINDs + [BUILDINGs[i] for i in [0, 3, 4]] + [BUSs[1]]
 bus1 = BATTERYs + PVs + [b for b in set(BUILDINGs).difference(bus0)] + [BUSs[0]]
 
 for SRC in bus0:
-    BUSs[0].add_source(SRC, True)
-    SRC.add_source(BUSs[0], True)
+    SRC.add_bus(BUSs[0])
 for SRC in bus1:
-    BUSs[1].add_source(SRC, True)
-    SRC.add_source(BUSs[1], True)
+    SRC.add_bus(BUSs[1])
 
 def make_demand_tuple_edge(ACTOR: GridActor, dynamic: list):
     """Convenience function for making the demand tuple edge.
@@ -135,16 +126,8 @@ def make_supply_tuple_edge(ACTOR: GridActor, dynamic: list):
                 index_via=lambda **kw : R.Rsame(*[kw[key] for key in dynamic]),
                 label='make_supply_tuple')
 
-#### Active receivers (initialize nodes for actors actively receiving power from other actors)
-for ACTOR in ACTORS:
-    for SRC in ACTORS:
-        ACTOR.add_active_source(SRC, None)
-
-
 ## ----- Nodes ----- ##
 ### Constants
-key_sep = Node('key_sep', KEY_SEP, 
-    description='A unique constant for seperating strings in paired keywords')
 days_in_year = Node('days_in_year', 365, description='number of days in a year')
 days_in_leapyear = Node('days_in_leapyear', description='number of days in a leapyear')
 hours_in_day = Node('hours_in_day', 24, description='number of hours in a day')
@@ -165,8 +148,12 @@ min_year = Node('min year', 2000, description='minimum year of simulation data')
 max_year = Node('max year', 2009, description='maximum year of simulation data')
 prob_daily_refueling = Node('prob of daily refueling', 0.25, 
     description='probability that the generators receive new fuel every day')
+rng = Node('rng', make_rng(3), 
+    description='random number generator for the stochastic relations')
 
 ### Grid
+bus_links = Node('bus links',
+    description='index pairs of each actor and a bus it is wired to')
 conn_matrix = Node('connectivity matrix', 
     description='cell ij indicates actor[i] receives power from actor[j]')
 state_vector = Node('state_vector', 
@@ -184,6 +171,8 @@ num_loads = Node('num loads',
     description='number of loads (buildings) on grid')
 names = Node('names', 
     description='ordered list of names of actors considered in the model')
+name_index = Node('name index',
+    description='index of each actor name in the state vector and connectivity matrix')
 
 ### Simulation
 time_step = Node('time_step', units='hr',
@@ -209,6 +198,10 @@ max_hour_index = Node('max_hour_index',
     description='maximum hour index for the year')
 is_leapyear = Node('is leapyear', 
     description='true if the current year is a leapyear')
+horizon = Node('horizon', 8784, units='hr',
+    description='number of hours initially precomputed by the calendar')
+calendar = Node('calendar',
+    description='precomputed calendar values for each elapsed hour of the simulation')
 tol = Node('tolerance', 0.001, description='float tolerance to be ignored')
 
 ### Components
@@ -239,8 +232,12 @@ cost_of_diesel = Node('cost of diesel', 3.50,
     units='$/L')
 next_refuel_hour = Node('next refuel hour', 0, 
     description='next hour generators will be refueled')
+refuel_schedule = Node('refuel_schedule',
+    description='presampled hours generators will be refueled')
 failing_actors = Node('failing_actors',
     description='list of failing components')
+failure_trajectories = Node('failure_trajectories',
+    description='presampled failures of each actor for each step')
 
 
 ## ----- Edges ----- ##
@@ -259,31 +256,26 @@ mg.add_edge({'days':days_in_leapyear,
             )
 mg.add_edge({'use_rand_date': use_random_date,
              'min_year': min_year,
-             'max_year': max_year},
+             'max_year': max_year,
+             'rng': rng},
             target=start_year, 
             rel=Rget_random_year,
             via=lambda use_rand_date, **kwargs : use_rand_date
             )
 mg.add_edge({'random': use_random_date,
-             'days_in_year': days_in_year},
+             'days_in_year': days_in_year,
+             'rng': rng},
             target=start_day, 
             rel=Rget_random_day,
             via=lambda random, **kw : random is True
             )
 mg.add_edge({'random': use_random_date,
-             'hours_in_day': hours_in_day},
+             'hours_in_day': hours_in_day,
+             'rng': rng},
             target=start_hour, 
             rel=Rget_random_hour,
             via=lambda random, **kw : random is True
             )
-mg.add_edge({'start_year': start_year,
-             'elapsed_hours': elapsed_hours, 
-             'hours_in_year': hours_in_year,
-             'hours_in_leapyear': hours_in_leapyear}, 
-            target=num_leapyears,
-            rel=Rcalc_num_leapyears,
-            label='calc_num_leapyears',
-            )
 mg.add_edge({'time': time, 
              'step': time_step}, 
             target=time,
@@ -307,52 +299,26 @@ mg.add_edge({'time': time,
             rel=Rcalc_elapsed_minutes,
             disposable=['time'],
             )
-mg.add_edge({'elapsed_hours': elapsed_hours,
-             'start_year': start_year, 
-             'num_leapyears': num_leapyears,
-             'start_day': start_day, 
-             'start_hour': start_hour,
-             'hours_in_day': hours_in_day, 
-             'hours_in_year': hours_in_year},
-            target=year,
-            rel=Rcalc_year,
-            disposable=['elapsed_hours', 'num_leapyears'],
-            index_via=lambda elapsed_hours, num_leapyears, **kw :
-                       R.Rsame(elapsed_hours, num_leapyears)
-            )
-mg.add_edge({'elapsed_hours': elapsed_hours,
-             'start_year': start_year, 
-             'year': year,
-             'num_leapyears': num_leapyears,
-             'start_day': start_day, 
+mg.add_edge({'start_year': start_year,
+             'start_day': start_day,
              'start_hour': start_hour,
-             'hours_in_day': hours_in_day, 
-             'hours_in_year': hours_in_year},
-            target=day,
-            rel=Rcalc_day, 
-            disposable=['elapsed_hours', 'year', 'num_leapyears'],
-            index_via=lambda elapsed_hours, year, **kw : 
-                      R.Rsame(elapsed_hours, year)
-            )
-mg.add_edge({'elapsed_hours': elapsed_hours,
-             'start_hour': start_hour, 
-             'hours_in_day': hours_in_day},
-            target=hour,
-            rel=Rcalc_hour,
-            )
-mg.add_edge({'day': day,
-             'hour': hour,
-             'is_leapyear': is_leapyear, 
+             'horizon': horizon,
+             'hours_in_day': hours_in_day,
              'hours_in_year': hours_in_year,
-             'hours_in_leapyear': hours_in_leapyear, 
-             'hours_in_day': hours_in_day},
-            target=hour_idx,
-            rel=Rget_hour_index,
-            disposable=['day', 'hour', 'is_leapyear'],
-            index_via=lambda day, hour, is_leapyear, **kw : 
-                      R.Rsame(day, hour, is_leapyear)
+             'hours_in_leapyear': hours_in_leapyear},
+            target=calendar,
+            rel=Rmake_calendar,
+            label='make_calendar',
             )
-mg.add_edge(year, is_leapyear, Rcalc_year_is_leapyear)
+for CALENDAR_NODE, FIELD in zip([num_leapyears, year, day, hour, is_leapyear, hour_idx],
+                                CALENDAR_FIELDS):
+    mg.add_edge({'calendar': calendar,
+                 'elapsed_hours': elapsed_hours},
+                target=CALENDAR_NODE,
+                rel=make_calendar_relation(FIELD),
+                label=f'get_calendar_{FIELD}',
+                disposable=['elapsed_hours'],
+                )
 
 ### Grid
 mg.add_edge(state_vector, 
@@ -393,8 +359,19 @@ mg.add_edge({str(A) : A.is_failing for A in ACTORS} | {'names': names},
                                                        if key != 'names']),
             )
 mg.add_edge({A.name for A in ACTORS}, names, Rsort_names)
+mg.add_edge(names, name_index, Rmake_name_index)
+
+mg.add_edge({A.prob_failing.label : A.prob_failing for A in ACTORS} |
+            {A.prob_fixed.label : A.prob_fixed for A in ACTORS} |
+            {'names': names, 'rng': rng, 'random_fail': has_random_failure,
+             'failing': failing_actors},
+            target=failure_trajectories,
+            rel=Rsample_failure_trajectories,
+            label='sample_failure_trajectories',
+            via=lambda random_fail, **kw : random_fail is True,
+            index_via=lambda failing, **kw : failing == 1,
+            )
 
-keyed_receiving_nodes = {}
 for ACTOR in ACTORS:
     #### Power Flow
     mg.add_edge(ACTOR.is_connected, ACTOR.state, 
@@ -403,34 +380,11 @@ for ACTOR in ACTORS:
                 )
     mg.add_edge({'x': state_vector,
                  'name': ACTOR.name,
-                 'names': names}, 
+                 'name_index': name_index}, 
                 target=ACTOR.state, 
                 rel=Rget_state_from_vector, 
                 label=f'retrieve state of {str(ACTOR)}', index_offset=1
                 )
-    for SRC in ACTORS:
-        if SRC is ACTOR:
-            mg.add_edge({'receives_from': ACTOR.receives_from[str(SRC)], 
-                         'is_conn': ACTOR.is_connected}, 
-                        target=ACTOR.receiving_from[str(SRC)], 
-                        rel=lambda receives_from, is_conn, **kwargs : 
-                            receives_from and is_conn,
-                        disposable=['is_conn'],
-                        label=f'{str(ACTOR)} receiving from itself',
-                        )
-        else:
-            mg.add_edge({'receives_from': ACTOR.receives_from[str(SRC)], 
-                         'receiver_conn': ACTOR.is_connected, 
-                         'provider_conn': SRC.is_connected}, 
-                        target=ACTOR.receiving_from[str(SRC)], 
-                        rel=Rcalc_if_receiving_power, 
-                        label=f'{str(ACTOR)} receiving from {str(SRC)}',
-                        disposable=['receiver_conn', 'provider_conn'],
-                        index_via=lambda receiver_conn, provider_conn, **kw : 
-                                  R.Rsame(receiver_conn, provider_conn)
-                        )
-        keyed_receiving_nodes.update({generate_connectivity_keyword(ACTOR, SRC) : 
-                                      ACTOR.receiving_from[str(SRC)]})
 
     #### Failures and Load Shedding
     mg.add_edge({'random_fail': has_random_failure, 
@@ -444,14 +398,17 @@ for ACTOR in ACTORS:
                 )
     mg.add_edge({'is_failing': ACTOR.is_failing,
                  'random_fail': has_random_failure, 
-                 'p_fail': ACTOR.prob_failing,
-                 'p_fix': ACTOR.prob_fixed},
+                 'trajectories': failure_trajectories,
+                 'name': ACTOR.name,
+                 'time': time,
+                 'time_step': time_step},
                 target=ACTOR.is_failing, 
-                rel=Rdeterming_if_failing,
+                rel=Rget_failure_from_trajectories,
                 label='determine_if_failing',
                 index_offset=1,
-                disposable=['is_failing'],
+                disposable=['is_failing', 'time'],
                 via=lambda random_fail, **kwargs : random_fail is True,
+                index_via=lambda is_failing, time, **kw : R.Rsame(is_failing, time),
                 ) #TODO: Need a way to specify failures of connectivity (like BUS1/BUS2 line)
 
     mg.add_edge({'req_demand': ACTOR.req_demand,
@@ -470,12 +427,19 @@ for ACTOR in ACTORS:
                     edge_props=['LEVEL', 'DISPOSE_ALL'],
                     )
 
-mg.add_edge(keyed_receiving_nodes | {'names': names, 'key_sep': key_sep},
+mg.add_edge({str(A) : A.buses for A in ACTORS} | {'name_index': name_index},
+            target=bus_links,
+            rel=Rget_bus_links,
+            label='get_bus_links',
+            )
+mg.add_edge({str(A) : A.is_connected for A in ACTORS} | 
+            {'name_index': name_index, 'bus_links': bus_links},
             target=conn_matrix, 
             rel=Rform_connectivity_matrix, 
             label='form connectivity matrix',
-            disposable=[key for key in keyed_receiving_nodes],
-            index_via=lambda **kwargs : R.Rsame(*[kwargs[key] for key in keyed_receiving_nodes])
+            disposable=[str(A) for A in ACTORS],
+            index_via=lambda **kwargs : R.Rsame(*[val for key,val in kwargs.items() 
+                                                  if key not in ('name_index', 'bus_links')]),
             )
 
 #### State vector
@@ -530,7 +494,10 @@ mg.add_edge({'directory': sunlight_directory,
             sunlight_filename, 
             Rget_solar_filename)
 
-mg.add_edge(sunlight_filename, sunlight_data, Rget_data_from_csv_file)
+mg.add_edge({'filename': sunlight_filename,
+             'col': sunlight_data_label},
+            target=sunlight_data,
+            rel=Rget_data_from_csv_file)
 
 mg.add_edge({'csv_data': sunlight_data,
              'row': hour_idx,
@@ -586,7 +553,12 @@ for B in BUILDINGs:
                 B.building_filename,
                 Rget_building_filename)
 
-    mg.add_edge(B.building_filename, B.load_data, Rget_data_from_csv_file)
+    mg.add_edge({'filename': B.building_filename,
+                 'normal_col': B.normal_col_name,
+                 'lights_col': B.lights_col_name,
+                 'equipment_col': B.equipment_col_name},
+                target=B.load_data,
+                rel=Rget_data_from_csv_file)
 
     mg.add_edge({'csv_data': B.load_data,
                  'row': hour_idx,
@@ -617,12 +589,18 @@ for B in BUILDINGs:
                 )
 
 ### Generators
+mg.add_edge({'prob': prob_daily_refueling,
+             'hours_in_day': hours_in_day,
+             'rng': rng},
+            target=refuel_schedule,
+            rel=Rsample_refuel_schedule,
+            label='sample_refuel_schedule',
+            )
 mg.add_edge({'refuel_time': next_refuel_hour,
              'curr_hour': hour_idx, 
-             'prob': prob_daily_refueling,
-             'hours_in_day': hours_in_day}, 
+             'schedule': refuel_schedule}, 
             target=next_refuel_hour, 
-            rel=Rcalc_next_time_for_refueling, 
+            rel=Rget_next_refuel_hour, 
             index_offset=1,
             disposable=['refuel_time', 'curr_hour'],
             index_via=lambda refuel_time, curr_hour, **kw : 
@@ -1,5 +1,6 @@
 from constrainthg import Node
 from enum import Enum, auto
+import warnings
 
 class GridActor:
     """An entity on the grid that either receives or supplies power 
@@ -77,14 +78,13 @@ class GridActor:
             description=f'True if supply costing is per unit versus lump',
             )
         
-        self.receives_from = {name: Node(
-            f'{name} receives from itself', 
-            True, 
-            description=f'{name} receives power from itself (trivial)'
-            )}
+        self.buses = Node(
+            f'buses_{name}',
+            tuple(str(bus) for bus in kwargs.get('buses', [])),
+            description=f'names of the buses {name} is wired to',
+            )
         for source, val in dict(kwargs.get('receives_from', {})).items():
             self.add_source(source, val)
-        self.receiving_from = {}
         for source, val in dict(kwargs.get('receiving_from', {})).items():
             self.add_active_source(source, val)
 
@@ -106,25 +106,34 @@ class GridActor:
             description=f'Values for calculating {name} supply',
             )
         
+    def add_bus(self, bus):
+        """Wires the GridObject to the bus, so that power can flow both 
+        ways between them. Must be called before the edges of the model
+        are made."""
+        if str(bus) not in self.buses.static_value:
+            self.buses.static_value += (str(bus),)
+
     def add_source(self, source, val: bool=True):
-        """Creates a node indicating that the source GridObject is wired 
-        to provide power to this GridObject."""
-        description = f'true if {str(self)} receives power from {str(source)}'
-        self.receives_from[str(source)] = Node(
-            f'{str(self)} receives from {str(source)}', 
-            val, 
-            description=description
-            )
+        """Deprecated, use ``add_bus``. Wires the GridObject to the source 
+        if ``val`` is true (or unwires it if false). Wiring is now two-way,
+        so the source also receives power from the GridObject."""
+        warnings.warn('add_source and receives_from are deprecated, wire actors '
+                      'with add_bus or the buses keyword instead', 
+                      DeprecationWarning, stacklevel=2)
+        if str(source) == str(self):
+            return
+        if val:
+            self.add_bus(source)
+        else:
+            self.buses.static_value = tuple(b for b in self.buses.static_value 
+                                            if b != str(source))
 
     def add_active_source(self, source, val: bool=None):
-        """Creates a node indicating that the source GridObject actively 
-        providing power to this GridObject."""
-        description = f'true if {str(self)} is actively receiving power from {str(source)}'
-        self.receiving_from[str(source)] = Node(
-            f'{str(self)} receiving from {str(source)}', 
-            val, 
-            description=description
-            )
+        """Deprecated, has no effect. Whether the GridObject is receiving 
+        power from the source is now found from the connectivity matrix."""
+        warnings.warn('add_active_source and receiving_from are deprecated and '
+                      'ignored, as active connections are found from the buses '
+                      'each actor is wired to', DeprecationWarning, stacklevel=2)
 
     def __str__(self):
         """Returns the name of the GridObject."""
@@ -375,7 +384,7 @@ class Building(Load):
         self.load_data = Node(
             f'load_data_{name}',
             kwargs.get('load_data', None),
-            description='list of dictionaries for building load data'
+            description='columns of building load data keyed by column name'
             )
         self.normal_col_name = Node(
             f'normal_col_name_{name}', 
@@ -0,0 +1,665 @@
+"""Lockstep simulation of many scenarios of the microgrid as NumPy arrays.
+
+A ``Simulation`` walks the hypergraph one scenario at a time, calling a
+relation for every edge of every step, so a large Monte Carlo study or
+sweep spends most of its time in Python overhead. A ``BatchSimulation``
+instead advances S scenarios of ``model.microgrid`` in lockstep, holding
+the quantities of each actor (charge and fuel levels, costs, benefits,
+supplies and demands) as arrays of shape (S, actors), so that each step
+costs a fixed number of array operations however many scenarios there
+are::
+
+    batch = BatchSimulation(1000, MC_INPUTS, seed=7)
+    results = batch.run(336)
+
+The relations of ``microgrid_relations`` are evaluated as array
+operations across the scenarios. Quantities that do not depend on the
+state of the grid (the calendar, sunlight and building loads, failures
+and refuelings) are calculated for every step up front. The power
+distribution strategy of ``Rmake_state_vector`` is evaluated for every
+scenario at once by ``meet_batch_circuit_demand``, which steps through
+the supply and demand queues of each scenario as a vectorized state
+machine, so that the states found are the same as for a single
+scenario. Scenarios with the same connectivity share their circuits.
+
+Scenario s draws its start date, failures and refuelings from
+``make_rng(seed, s)`` in the order the model draws them, so it sees the
+same conditions as run s of a Monte Carlo study with the same seed (see
+``microgrid_montecarlo``). The parameters of each scenario can also be
+set separately with ``scenario_inputs``, such as for a sweep::
+
+    configs = make_grid({'PV1.area': [6000, 8000], 'Battery1.charge_capacity': [1e4, 2e4]})
+    batch = BatchSimulation(len(configs), MC_INPUTS, scenario_inputs=configs)
+
+Only the actors of ``model.microgrid`` with relations for their supply
+and demand are supported: utility grids, buses, photovoltaic arrays,
+loads, buildings, generators and batteries.
+"""
+from collections import namedtuple
+import importlib
+import numpy as np
+
+from model.microgrid_calendar import make_calendar_arrays
+from model.microgrid_montecarlo import ACTOR_GROUPS, MC_INPUTS, get_actors, \
+    resolve_parameter, summarize_results, write_results_csv, write_summary_csv
+from model.microgrid_plan import get_labeled_inputs
+from model.microgrid_relations import make_rng, Rget_random_day, Rget_random_year, \
+    Rget_random_hour, Rsample_failure_trajectories, Rsample_refuel_schedule, \
+    Rsort_names, Rmake_name_index, Rget_bus_links, Rform_connectivity_matrix, \
+    Rget_solar_filename, Rget_building_filename, Rget_data_from_csv_file, \
+    Rcalc_critical_load, Rcalc_generator_fuel_consumption, Rcalc_generator_cost, \
+    Rcalc_solar_supply, Rdetermine_building_load, Rcalc_battery_cost, \
+    Rcalc_battery_benefit, Rcalc_battery_max_demand, Rcalc_battery_charge_level, \
+    Rcalc_generator_fuel_level, Rget_next_refuel_hour
+from model.microgrid_topology import TOPOLOGY_CACHE
+
+BatchStep = namedtuple('BatchStep', ['index', 'time', 'state_vectors', 'values'])
+BatchStep.__doc__ = """The state of the grid of every scenario at an index
+of a batch simulation, with ``state_vectors`` of shape (S, actors) in the
+order of ``BatchSimulation.names`` and ``values`` holding an array (S,)
+for each reported node {label : np.ndarray}."""
+
+class BatchSimulation:
+    """Simulation of many scenarios of the microgrid in lockstep.
+
+    Parameters
+    ----------
+    num_scenarios : int
+        The number of scenarios (S) to simulate.
+    inputs : dict, optional
+        The inputs {node | label : value} shared by every scenario.
+    scenario_inputs : dict | list, optional
+        The inputs of each scenario, given either as a sequence of S
+        values for each parameter {parameter : [Any,]} or as a list of S
+        configurations [{parameter : Any},]. Parameters are node labels
+        or ``<actor>.<attribute>`` (see ``microgrid_sweep``).
+    seed : int, default=0
+        Seed of the study, from which the generator of each scenario is
+        spawned (see ``make_rng``).
+    first_run : int, default=0
+        The run of the study of the first scenario, so that scenario s 
+        is run ``first_run + s``.
+    model : str, default='model.microgrid'
+        The module building the microgrid.
+    graph : str, default='mg'
+        The name of the hypergraph in the module.
+    """
+    def __init__(self, num_scenarios: int, inputs: dict=None,
+                 scenario_inputs=None, seed: int=0, first_run: int=0,
+                 model: str='model.microgrid', graph: str='mg'):
+        module = importlib.import_module(model)
+        self.hg = getattr(module, graph)
+        self.num_scenarios = int(num_scenarios)
+        self.seed = seed
+        self.first_run = int(first_run)
+        self.inputs = get_labeled_inputs(self.hg, inputs)
+        self.scenario_inputs = self.get_scenario_inputs(module, scenario_inputs)
+
+        self.groups = {group: list(getattr(module, group, [])) for group in ACTOR_GROUPS}
+        if len(self.groups['WINDs']) > 0:
+            raise NotImplementedError('Wind turbines are not supported by batch simulations')
+        self.actors = [A for group in ACTOR_GROUPS for A in self.groups[group]]
+        self.cols = {str(A): i for i, A in enumerate(self.actors)}
+        self.names = Rsort_names(*[str(A) for A in self.actors])
+        self.name_index = Rmake_name_index(self.names)
+        self.name_cols = np.array([self.cols[name] for name in self.names])
+        self.bus_links = Rget_bus_links(self.name_index, **{str(A): A.buses.static_value
+                                                            for A in self.actors})
+
+    def get_scenario_inputs(self, module, scenario_inputs)-> dict:
+        """Returns the inputs of each scenario keyed by node label
+        {label : [Any,]}."""
+        if scenario_inputs is None:
+            return {}
+        if not isinstance(scenario_inputs, dict):
+            scenario_inputs = {key: [config[key] for config in scenario_inputs]
+                               for key in scenario_inputs[0]}
+        actors = get_actors(module)
+        labeled = {}
+        for key, values in scenario_inputs.items():
+            if len(values) != self.num_scenarios:
+                raise ValueError(f'Expected {self.num_scenarios} values of {key}, not {len(values)}')
+            labeled[resolve_parameter(self.hg, actors, key)] = list(values)
+        return labeled
+
+    def get_value(self, label: str, scenario: int):
+        """Returns the value of the node for the scenario."""
+        if label in self.scenario_inputs:
+            return self.scenario_inputs[label][scenario]
+        if label in self.inputs:
+            return self.inputs[label]
+        return self.hg.get_node(label).static_value
+
+    def has_value(self, label: str)-> bool:
+        """Returns true if the node has a value for every scenario."""
+        if label in self.scenario_inputs:
+            return all(v is not None for v in self.scenario_inputs[label])
+        return self.get_value(label, 0) is not None
+
+    def get(self, label: str)-> np.ndarray:
+        """Returns the value of the node for each scenario as an array (S,)."""
+        if label in self.scenario_inputs:
+            values = self.scenario_inputs[label]
+        else:
+            values = [self.get_value(label, 0)] * self.num_scenarios
+        if not self.has_value(label):
+            raise ValueError(f'No value given for {label}')
+        return np.array(values)
+
+    def get_shared(self, label: str):
+        """Returns the value of a node that must be the same for every
+        scenario."""
+        if label in self.scenario_inputs:
+            raise ValueError(f'{label} must be the same for every scenario')
+        value = self.get_value(label, 0)
+        if value is None:
+            raise ValueError(f'No value given for {label}')
+        return value
+
+    def setup(self, num_steps: int)-> dict:
+        """Returns the quantities of every step that do not depend on the
+        state of the grid, as arrays (num_steps, S, ...) indexed by step,
+        along with the refuel schedule of each scenario."""
+        S, n = self.num_scenarios, len(self.actors)
+        time_step = self.get_shared('time_step')
+        seconds_in_hour = self.get_shared('seconds_in_minute') * self.get_shared('minutes_in_hour')
+        hours_in_day = self.get_shared('hours_in_day')
+        days_in_year = self.get_shared('days_in_year')
+        hours_in_year = days_in_year * hours_in_day
+        hours_in_leapyear = (days_in_year + 1) * hours_in_day
+        times = np.arange(num_steps) * time_step
+        elapsed_hours = (times // seconds_in_hour).astype(np.int64)
+
+        hour_idx = np.zeros((num_steps, S), dtype=np.int64)
+        year = np.zeros((num_steps, S), dtype=np.int64)
+        failing = np.zeros((num_steps, S, n), dtype=bool)
+        failing[0] = np.column_stack([self.get(A.is_failing.label).astype(bool)
+                                      for A in self.actors])
+        schedules = []
+        for s in range(S):
+            rng = make_rng(self.seed, self.first_run + s)
+            start = self.sample_start_date(s, rng)
+            calendar = make_calendar_arrays(elapsed_hours, *start, hours_in_day,
+                                            hours_in_year, hours_in_leapyear)
+            hour_idx[:, s], year[:, s] = calendar['hour_idx'], calendar['year']
+            failures = None
+            if self.get_value('has_random_failure', s) is True:
+                failures = self.get_failure_trajectories(s, rng)
+            if failures is not None:
+                failures.extend(num_steps)
+                rows = [failures.name_index.get(str(A), None) for A in self.actors]
+                for col, row in enumerate(rows):
+                    if row is not None:
+                        failing[1:, s, col] = failures.array[row, 1:num_steps]
+            schedules.append(self.get_refuel_schedule(s, rng))
+
+        return dict(time=times, hour_idx=hour_idx, failing=failing,
+                    sunlight=self.get_sunlight(hour_idx, year),
+                    loads=self.get_loads(hour_idx), refuel_schedules=schedules)
+
+    def sample_start_date(self, s: int, rng: np.random.Generator)-> tuple:
+        """Returns the start year, day and hour of the scenario, drawing
+        those not given if the start date is random."""
+        is_random = self.get_value('use_random_date', s) is True
+        start = {}
+        for label, rel, args in [('start_day', Rget_random_day, ['days_in_year']),
+                                 ('start_year', Rget_random_year, ['min year', 'max year']),
+                                 ('start_hour', Rget_random_hour, ['hours_in_day'])]:
+            value = self.get_value(label, s)
+            if value is None and is_random:
+                value = rel(*[self.get_value(a, s) for a in args], rng=rng)
+            if value is None:
+                raise ValueError(f'No value given for {label}')
+            start[label] = value
+        return start['start_year'], start['start_day'], start['start_hour']
+
+    def get_failure_trajectories(self, s: int, rng: np.random.Generator):
+        """Returns the failure trajectories of the scenario, sampled from
+        the generator if not given, or None if no actor can fail."""
+        failures = self.get_value('failure_trajectories', s)
+        if failures is not None:
+            return failures
+        probs = {}
+        for A in self.actors:
+            for node in [A.prob_failing, A.prob_fixed]:
+                probs[node.label] = self.get_value(node.label, s)
+        if not any(probs[A.prob_failing.label] for A in self.actors):
+            rng.integers(2**63) #Drawn by the sampling relation for its own generator
+            return None
+        failing = [str(A) for A in self.actors if self.get_value(A.is_failing.label, s)]
+        return Rsample_failure_trajectories(self.names, rng, failing, **probs)
+
+    def get_refuel_schedule(self, s: int, rng: np.random.Generator):
+        """Returns the refuel schedule of the scenario, sampled from the
+        generator if not given."""
+        schedule = self.get_value('refuel_schedule', s)
+        if schedule is not None:
+            return schedule
+        return Rsample_refuel_schedule(self.get_value('prob of daily refueling', s),
+                                       self.get_value('hours_in_day', s), rng)
+
+    def get_sunlight(self, hour_idx: np.ndarray, year: np.ndarray)-> np.ndarray:
+        """Returns the sunlight of each step of each scenario, from the
+        solar data of the year."""
+        directory = self.get_shared('sunlight_directory')
+        col = self.get_shared('sunlight_data_label')
+        sunlight = np.zeros(hour_idx.shape)
+        for y in np.unique(year):
+            column = Rget_data_from_csv_file(Rget_solar_filename(directory, int(y)), col)[col]
+            is_year = year == y
+            sunlight[is_year] = column[np.minimum(hour_idx[is_year], len(column) - 1)]
+        return sunlight
+
+    def get_loads(self, hour_idx: np.ndarray)-> dict:
+        """Returns the normal and critical load of each step of each
+        scenario for each load {name : (normal, critical)}."""
+        loads = {}
+        for L in self.groups['LOADs']:
+            loads[str(L)] = (np.full(hour_idx.shape, L.normal_load.static_value, dtype=float),
+                             np.full(hour_idx.shape, L.critical_load.static_value, dtype=float))
+        directory = self.get_shared('load_directory')
+        for B in self.groups['BUILDINGs']:
+            cols = [B.normal_col_name.static_value, B.lights_col_name.static_value,
+                    B.equipment_col_name.static_value]
+            data = Rget_data_from_csv_file(Rget_building_filename(directory, B.type.static_value),
+                                           *cols)
+            normal, lights, equipment = [data[col][np.minimum(hour_idx, len(data[col]) - 1)] for col in cols]
+            loads[str(B)] = (normal, Rcalc_critical_load(lights, equipment))
+        return loads
+
+    def get_static_tuples(self)-> dict:
+        """Returns the benefit, required and maximum demand, cost, supply
+        and costing of each actor that are constant over the simulation,
+        as arrays (S, actors). Values calculated at each step are NaN."""
+        S, n = self.num_scenarios, len(self.actors)
+        tuples = {key: np.full((S, n), np.nan) for key in
+                  ['benefit', 'req_demand', 'max_demand', 'cost', 'supply']}
+        tuples['is_cost_per_unit'] = np.zeros((S, n), dtype=bool)
+        for col, A in enumerate(self.actors):
+            for key in tuples:
+                label = getattr(A, key).label
+                if self.has_value(label):
+                    tuples[key][:, col] = self.get(label)
+
+        time_step = self.get_shared('time_step')
+        seconds_in_hour = self.get_shared('seconds_in_minute') * self.get_shared('minutes_in_hour')
+        consumption = np.vectorize(Rcalc_generator_fuel_consumption)
+        cost = np.vectorize(Rcalc_generator_cost)
+        for G in self.groups['GENs']:
+            col = self.cols[str(G)]
+            max_output = self.get(G.max_output.label)
+            max_consumption = consumption(max_output, max_output, time_step, seconds_in_hour)
+            tuples['cost'][:, col] = cost(self.get('cost of diesel'), max_consumption,
+                                          time_step, max_output, seconds_in_hour)
+            tuples['supply'][:, col] = max_output
+        return tuples
+
+    def iter_steps(self, num_steps: int):
+        """Yields a ``BatchStep`` for each index of the simulation, from 1
+        to ``num_steps``, with the charge level of each battery, fuel
+        level of each generator, required demand of each load, and the
+        hour index and next refuel hour of each scenario."""
+        exog = self.setup(num_steps)
+        tuples = self.get_static_tuples()
+        S, tol = self.num_scenarios, self.get_shared('tolerance')
+        time_step = self.get_shared('time_step')
+        seconds_in_hour = self.get_shared('seconds_in_minute') * self.get_shared('minutes_in_hour')
+        island_mode = self.get('island_mode').astype(bool)
+        ug_cols = [self.cols[str(UG)] for UG in self.groups['UGs']]
+        ug_cost = self.get(self.groups['UGs'][0].cost.label) if len(ug_cols) > 0 else None
+        trickle_rate = self.get('battery trickle charge rate prop')
+        next_refuel = self.get('next refuel hour').astype(np.int64)
+
+        batteries = {}
+        for B in self.groups['BATTERYs']:
+            batteries[str(B)] = {key: self.get(getattr(B, key).label) for key in
+                ['charge_capacity', 'max_output', 'charge_efficiency', 'max_charge_rate',
+                 'scarcity_factor', 'trickle_prop']}
+            batteries[str(B)]['level'] = self.get(B.charge_level.label).astype(float)
+            batteries[str(B)]['state'] = np.zeros(S)
+        fuel_capacity = {str(G): self.get(G.fuel_capacity.label) for G in self.groups['GENs']}
+        fuel = {str(G): np.minimum(self.get(G.starting_fuel_level.label),
+                                   fuel_capacity[str(G)]).astype(float)
+                for G in self.groups['GENs']}
+        pvs = {str(PV): (self.get(PV.area.label), self.get(PV.efficiency.label))
+               for PV in self.groups['PVs']}
+
+        for i in range(num_steps):
+            failing = exog['failing'][i]
+            is_connected = ~failing
+            is_connected[:, ug_cols] &= ~island_mode[:, None]
+            is_islanded = ~is_connected[:, ug_cols].any(axis=1)
+
+            for PV in self.groups['PVs']:
+                tuples['supply'][:, self.cols[str(PV)]] = Rcalc_solar_supply(
+                    None, *pvs[str(PV)], exog['sunlight'][i])
+            for L in self.groups['LOADs'] + self.groups['BUILDINGs']:
+                col = self.cols[str(L)]
+                normal, critical = [load[i] for load in exog['loads'][str(L)]]
+                tuples['max_demand'][:, col] = normal
+                tuples['req_demand'][:, col] = Rdetermine_building_load(
+                    is_connected[:, col], normal, critical, is_islanded)
+            for B in self.groups['BATTERYs']:
+                b, col = batteries[str(B)], self.cols[str(B)]
+                level, capacity = b['level'], b['charge_capacity']
+                tuples['supply'][:, col] = np.minimum(b['max_output'], level)
+                tuples['cost'][:, col] = Rcalc_battery_cost(ug_cost, tol, level, capacity,
+                                                            b['scarcity_factor'], b['state'] < 0)
+                tuples['benefit'][:, col] = Rcalc_battery_benefit(ug_cost, level, capacity,
+                                                                  b['scarcity_factor'])
+                tuples['max_demand'][:, col] = Rcalc_battery_max_demand(
+                    level, capacity, b['max_charge_rate'], b['trickle_prop'], trickle_rate,
+                    time_step, seconds_in_hour)
+
+            states = self.make_state_vectors(tuples, is_connected, tol)
+            hour_idx = exog['hour_idx'][i]
+            values = {'hour index': hour_idx, 'next refuel hour': next_refuel}
+            for B in self.groups['BATTERYs']:
+                values[B.charge_level.label] = batteries[str(B)]['level']
+            for G in self.groups['GENs']:
+                values[G.fuel_level.label] = fuel[str(G)]
+            for L in self.groups['LOADs'] + self.groups['BUILDINGs']:
+                values[L.req_demand.label] = tuples['req_demand'][:, self.cols[str(L)]].copy()
+            yield BatchStep(i + 1, exog['time'][i], states[:, self.name_cols], values)
+
+            for B in self.groups['BATTERYs']:
+                b = batteries[str(B)]
+                b['state'] = states[:, self.cols[str(B)]]
+                b['level'] = Rcalc_battery_charge_level(b['state'], b['level'],
+                                                        b['charge_capacity'], time_step,
+                                                        b['charge_efficiency'], seconds_in_hour)
+            for G in self.groups['GENs']:
+                fuel[str(G)] = Rcalc_generator_fuel_level(next_refuel, hour_idx, fuel[str(G)],
+                                                          fuel_capacity[str(G)])
+            next_refuel = Rget_next_refuel_hour(next_refuel, hour_idx, exog['refuel_schedules'])
+
+    def make_state_vectors(self, tuples: dict, is_connected: np.ndarray, tol: float)-> np.ndarray:
+        """Returns the state of each actor of each scenario (S, actors),
+        as found by ``Rmake_state_vector`` for each scenario.
+
+        Scenarios with the same connectivity share their circuits. The
+        circuits of each scenario are met in turn, with the first circuit
+        of every scenario met at once, then the second, and so on.
+        """
+        S, n = is_connected.shape
+        states = np.full((S, n), np.nan)
+        packed = np.ascontiguousarray(np.packbits(is_connected, axis=1))
+        keys = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        rounds = []
+        for p, pattern in enumerate(is_connected[first]):
+            rows = np.flatnonzero(inverse.ravel() == p)
+            conn = Rform_connectivity_matrix(self.name_index, self.bus_links,
+                **{str(A): pattern[col] for col, A in enumerate(self.actors)})
+            for k, (suppliers, demanders) in enumerate(TOPOLOGY_CACHE.get(conn, self.names)):
+                in_circuit = np.zeros((2, len(rows), n), dtype=bool)
+                in_circuit[0][:, [self.cols[a] for a in suppliers]] = True
+                in_circuit[1][:, [self.cols[a] for a in demanders]] = True
+                if k == len(rounds):
+                    rounds.append([])
+                rounds[k].append((rows, in_circuit))
+
+        for circuits in rounds:
+            rows = np.concatenate([rows for rows, _ in circuits])
+            in_supply, in_demand = np.concatenate([c for _, c in circuits], axis=1)
+            unassigned = np.isnan(states[rows])
+            cost, supply = tuples['cost'][rows], tuples['supply'][rows]
+            benefit, req = tuples['benefit'][rows], tuples['req_demand'][rows]
+            supply_q = make_batch_queue(
+                cost, in_supply & unassigned & (cost != np.inf) & (supply > 0),
+                cost=cost, supply=supply, is_cost_per_unit=tuples['is_cost_per_unit'][rows])
+            demand_q = make_batch_queue(
+                -benefit, in_demand & unassigned & ((benefit > 0) | (req > 0)),
+                benefit=benefit, req_demand=req, max_demand=tuples['max_demand'][rows])
+            found = meet_batch_circuit_demand(demand_q, supply_q, n, tol)
+            is_repeated = (~np.isnan(found) & ~unassigned).any(axis=1)
+            keep = rows[~is_repeated]
+            found = found[~is_repeated]
+            states[keep] = np.where(np.isnan(found), states[keep], found)
+        return np.nan_to_num(states, nan=0.)
+
+    def run(self, num_steps: int)-> list:
+        """Simulates every scenario for ``num_steps``, returning the
+        resilience metrics of each scenario (see ``ResilienceMetrics``)."""
+        metrics = BatchMetrics(self.names, [str(B) for B in self.groups['BATTERYs']],
+                               [str(G) for G in self.groups['GENs']],
+                               self.get_load_weights(), self.get_shared('time_step'))
+        for step in self.iter_steps(num_steps):
+            metrics.update(step)
+        return metrics.result()
+
+    def get_load_weights(self)-> dict:
+        """Returns the weight of each load {name : float | np.ndarray} for
+        the mission impact, which is its benefit."""
+        weights = {}
+        for L in self.groups['LOADs'] + self.groups['BUILDINGs']:
+            has_weight = self.has_value(L.benefit.label)
+            weights[str(L)] = self.get(L.benefit.label) if has_weight else 1.
+        return weights
+
+class BatchMetrics:
+    """The resilience metrics of every scenario of a batch simulation,
+    updated with each ``BatchStep``. The metrics are those of a
+    ``ResilienceMetrics``, held as arrays (S,).
+
+    Parameters
+    ----------
+    names : list
+        The names of the actors, in the order of the state vectors.
+    batteries : list
+        Names of the batteries on the grid.
+    generators : list
+        Names of the generators on the grid.
+    loads : dict
+        The weight of each load {name : float | np.ndarray} for the
+        mission impact.
+    time_step : float, default=3600
+        Seconds between each step.
+    tol : float, default=1e-6
+        Values smaller than the tolerance are treated as zero.
+    """
+    def __init__(self, names: list, batteries: list, generators: list,
+                 loads: dict, time_step: float=3600, tol: float=1e-6):
+        self.name_index = {name: i for i, name in enumerate(names)}
+        self.batteries = batteries
+        self.generators = generators
+        self.loads = loads
+        self.hours_per_step = time_step / 3600
+        self.tol = tol
+        self.exhausted = {b: 0. for b in batteries}
+        self.fuel_empty = {g: 0. for g in generators}
+        self.load_shed = {l: 0. for l in loads}
+        self.shed_hours = {l: 0. for l in loads}
+
+    def update(self, step: BatchStep):
+        """Adds the step of every scenario to the metrics."""
+        values, dt = step.values, self.hours_per_step
+        for b in self.batteries:
+            self.exhausted[b] = self.exhausted[b] + dt * (values[f'charge_level_{b}'] < self.tol)
+        for g in self.generators:
+            self.fuel_empty[g] = self.fuel_empty[g] + dt * (values[f'fuel_level_{g}'] < self.tol)
+        for l in self.loads:
+            received = -step.state_vectors[:, self.name_index[l]]
+            shed = values[f'req_demand_{l}'] - received
+            is_shed = shed > self.tol
+            self.load_shed[l] = self.load_shed[l] + np.where(is_shed, shed * dt, 0.)
+            self.shed_hours[l] = self.shed_hours[l] + dt * is_shed
+
+    def result(self)-> list:
+        """Returns the metrics of each scenario [{column : float},]."""
+        out = {'MI': sum(self.shed_hours[l] * w for l, w in self.loads.items())}
+        out |= {f'BatteryExhausted_{b}': v for b, v in self.exhausted.items()}
+        out |= {f'FuelEmpty_{g}': v for g, v in self.fuel_empty.items()}
+        out |= {f'LoadShed_{l}': v for l, v in self.load_shed.items()}
+        out |= {f'ShedHours_{l}': v for l, v in self.shed_hours.items()}
+        out['SkippedSteps'] = 0
+        num_scenarios = max([np.size(v) for v in out.values()])
+        columns = {col: np.broadcast_to(np.asarray(v, dtype=float), (num_scenarios,))
+                   for col, v in out.items()}
+        return [{col: float(v[s]) for col, v in columns.items()}
+                for s in range(num_scenarios)]
+
+
+## Power distribution strategy
+def make_batch_queue(keys: np.ndarray, valid: np.ndarray, **columns)-> dict:
+    """Returns the queue of each row as arrays (rows, actors), sorted by
+    key (keeping the order of equal keys) with the invalid actors last.
+    The queue holds the column of each actor in the queue (``actor``),
+    the length of each queue (``size``) and each of the columns
+    {name : np.ndarray} in the order of the queue."""
+    order = np.argsort(np.where(valid, keys, np.inf), axis=1, kind='stable')
+    queue = {name: np.take_along_axis(col, order, axis=1) for name, col in columns.items()}
+    queue['actor'] = order
+    queue['size'] = valid.sum(axis=1)
+    return queue
+
+(REQ_START, REQ_CHECK, REQ_SUPPLY, REQ_DEMAND, REQ_MATCH, REQ_END,
+ MAX_START, MAX_SUPPLY, MAX_DEMAND, MAX_MATCH, DONE) = range(11)
+
+def meet_batch_circuit_demand(demand_q: dict, supply_q: dict, num_actors: int,
+                              tol: float)-> np.ndarray:
+    """Returns the states of the actors of a circuit in each row (rows,
+    actors), with NaN for actors without a state, as found by
+    ``meet_circuit_demand`` for the supply and demand queue of each row
+    (see ``make_batch_queue``).
+
+    The recursion of ``meet_req_demands`` and the loops of both it and
+    ``meet_max_demands`` are unrolled into a state machine, where each
+    row holds its own position in the strategy and in its queues. Each
+    pass advances every row by one step of the strategy with array
+    operations, until every row is done.
+    """
+    rows = len(demand_q['size'])
+    states = np.full((rows, num_actors), np.nan)
+    current = np.full((rows, num_actors), np.nan)
+    pc = np.where((demand_q['size'] > 0) & (supply_q['size'] > 0), REQ_START, DONE)
+    if (pc == DONE).all():
+        return states
+    s_idx, d_idx = np.zeros(rows, dtype=np.int64), np.zeros(rows, dtype=np.int64)
+    keyframe_s_idx = np.zeros(rows, dtype=np.int64)
+    unused_s, unmet_d = supply_q['supply'][:, 0].copy(), np.zeros(rows)
+    keyframe_supply = np.zeros(rows)
+
+    def at(queue, name, r, idx):
+        return queue[name][r, np.minimum(idx[r], queue[name].shape[1] - 1)]
+
+    def advance(queue, idx, r, fail_pc):
+        """Moves the rows to the next actor in the queue, returning the
+        rows still in the queue."""
+        idx[r] += 1
+        is_past = idx[r] >= queue['size'][r]
+        pc[r[is_past]] = fail_pc
+        return r[~is_past]
+
+    while not (pc == DONE).all():
+        r = np.flatnonzero(pc == REQ_START)
+        unmet_d[r] = at(demand_q, 'req_demand', r, d_idx)
+        current[r] = np.nan
+        keyframe_s_idx[r], keyframe_supply[r] = s_idx[r], unused_s[r]
+        pc[r] = REQ_CHECK
+
+        r = np.flatnonzero(pc == REQ_CHECK)
+        is_worth = at(demand_q, 'benefit', r, d_idx) >= at(supply_q, 'cost', r, s_idx)
+        pc[r] = np.where(is_worth, REQ_SUPPLY, REQ_END)
+
+        r = np.flatnonzero(pc == REQ_SUPPLY)
+        while len(r) > 0:
+            s_label = at(supply_q, 'actor', r, s_idx)
+            is_used = (unused_s[r] < tol) | (states[r, s_label] < 0)
+            pc[r[~is_used]] = REQ_DEMAND
+            r = advance(supply_q, s_idx, r[is_used], REQ_END)
+            unused_s[r] = at(supply_q, 'supply', r, s_idx)
+
+        r = np.flatnonzero(pc == REQ_DEMAND)
+        while len(r) > 0:
+            d_label = at(demand_q, 'actor', r, d_idx)
+            is_met = (unmet_d[r] < tol) | ~np.isnan(states[r, d_label]) \
+                     | (d_label == at(supply_q, 'actor', r, s_idx))
+            pc[r[~is_met]] = REQ_MATCH
+            r = advance(demand_q, d_idx, r[is_met], REQ_END)
+            unmet_d[r] = at(demand_q, 'req_demand', r, d_idx)
+
+        r = np.flatnonzero(pc == REQ_MATCH)
+        diff = unmet_d[r] - unused_s[r]
+        unmet_d[r], unused_s[r] = np.maximum(0., diff), np.maximum(0., -diff)
+        current[r, at(supply_q, 'actor', r, s_idx)] = \
+            np.abs(at(supply_q, 'supply', r, s_idx) - unused_s[r])
+        r = r[unmet_d[r] < tol]
+        states[r, at(demand_q, 'actor', r, d_idx)] = -np.abs(at(demand_q, 'req_demand', r, d_idx))
+        states[r] = np.where(np.isnan(current[r]), states[r], current[r])
+        current[r] = np.nan
+        keyframe_s_idx[r], keyframe_supply[r] = s_idx[r], unused_s[r]
+        pc[pc == REQ_MATCH] = REQ_CHECK
+
+        r = np.flatnonzero(pc == REQ_END)
+        is_retry = (~np.isnan(current[r])).any(axis=1) & (d_idx[r] < demand_q['size'][r] - 1)
+        retry, r = r[is_retry], r[~is_retry]
+        d_idx[retry] += 1
+        s_idx[retry], unused_s[retry] = keyframe_s_idx[retry], keyframe_supply[retry]
+        pc[retry] = REQ_START
+        pc[r] = np.where(s_idx[r] < supply_q['size'][r], MAX_START, DONE)
+
+        r = np.flatnonzero(pc == MAX_START)
+        d_idx[r] = 0
+        unmet_d[r] = demand_q['max_demand'][r, 0] - demand_q['req_demand'][r, 0]
+        pc[r] = MAX_SUPPLY
+
+        r = np.flatnonzero(pc == MAX_SUPPLY)
+        while len(r) > 0:
+            s_label, cost = at(supply_q, 'actor', r, s_idx), at(supply_q, 'cost', r, s_idx)
+            supply = at(supply_q, 'supply', r, s_idx)
+            is_lump_ok = at(supply_q, 'is_cost_per_unit', r, s_idx) \
+                         | (unused_s[r] - supply >= tol) \
+                         | (at(demand_q, 'benefit', r, d_idx) > cost)
+            is_used = (unused_s[r] < tol) | ~is_lump_ok | (states[r, s_label] < 0)
+            pc[r[~is_used]] = MAX_DEMAND
+            r = advance(supply_q, s_idx, r[is_used], DONE)
+            unused_s[r] = at(supply_q, 'supply', r, s_idx)
+
+        r = np.flatnonzero(pc == MAX_DEMAND)
+        while len(r) > 0:
+            d_label = at(demand_q, 'actor', r, d_idx)
+            is_met = (unmet_d[r] < tol) | (states[r, d_label] > 0) \
+                     | (d_label == at(supply_q, 'actor', r, s_idx))
+            pc[r[~is_met]] = MAX_MATCH
+            r = advance(demand_q, d_idx, r[is_met], DONE)
+            unmet_d[r] = at(demand_q, 'max_demand', r, d_idx) - at(demand_q, 'req_demand', r, d_idx)
+
+        r = np.flatnonzero(pc == MAX_MATCH)
+        is_costly = at(supply_q, 'is_cost_per_unit', r, s_idx) \
+                    & (at(demand_q, 'benefit', r, d_idx) < at(supply_q, 'cost', r, s_idx))
+        pc[r[is_costly]] = DONE
+        r = r[~is_costly]
+        diff = unmet_d[r] - unused_s[r]
+        unmet_d[r], unused_s[r] = np.maximum(0., diff), np.maximum(0., -diff)
+        states[r, at(supply_q, 'actor', r, s_idx)] = \
+            np.abs(at(supply_q, 'supply', r, s_idx) - unused_s[r])
+        states[r, at(demand_q, 'actor', r, d_idx)] = \
+            -np.abs(at(demand_q, 'max_demand', r, d_idx) - unmet_d[r])
+        pc[r] = MAX_SUPPLY
+
+    return states
+
+
+## Studies
+def run_batch_monte_carlo(num_runs: int, inputs: dict=None, results_file: str=None,
+                          summary_file: str=None, num_steps: int=336, seed: int=0,
+                          batch_size: int=1024, model: str='model.microgrid',
+                          graph: str='mg')-> tuple:
+    """Runs a Monte Carlo study with batch simulations of ``batch_size``
+    runs at a time, returning the metrics of each run (in order of the
+    runs) and their summary (as for ``run_monte_carlo``). The results
+    and summary are written to CSV files if given."""
+    inputs = MC_INPUTS if inputs is None else inputs
+    results = []
+    for start in range(0, num_runs, batch_size):
+        size = min(batch_size, num_runs - start)
+        batch = BatchSimulation(size, inputs, seed=seed, first_run=start,
+                                model=model, graph=graph)
+        results.extend(batch.run(num_steps))
+    summary = summarize_results(results)
+    if results_file is not None:
+        write_results_csv(results, results_file)
+    if summary_file is not None:
+        write_summary_csv(summary, summary_file)
+    return results, summary
@@ -0,0 +1,78 @@
+"""Precomputed calendar for the simulation clock.
+
+The calendar values (year, day, hour, etc.) for every elapsed hour of a
+simulation are calculated in a single vectorized pass, so that the
+hypergraph only has to index into an array each time step. The values
+match those given by the scalar relations ``Rcalc_num_leapyears``,
+``Rcalc_year``, ``Rcalc_day``, ``Rcalc_hour``, ``Rcalc_year_is_leapyear``
+and ``Rget_hour_index``.
+"""
+import numpy as np
+
+CALENDAR_FIELDS = ('num_leapyears', 'year', 'day', 'hour', 'is_leapyear', 'hour_idx')
+
+class Calendar:
+    """Integer arrays of calendar values indexed by elapsed hour, which
+    are extended automatically if a later hour is requested."""
+    def __init__(self, start_year: int, start_day: int, start_hour: int,
+                 horizon: int, hours_in_day: int, hours_in_year: int,
+                 hours_in_leapyear: int):
+        self.start_year = int(start_year)
+        self.start_day = int(start_day)
+        self.start_hour = int(start_hour)
+        self.hours_in_day = int(hours_in_day)
+        self.hours_in_year = int(hours_in_year)
+        self.hours_in_leapyear = int(hours_in_leapyear)
+        self.arrays = {}
+        self.extend(max(1, int(horizon)))
+
+    def __len__(self):
+        return len(self.arrays['hour'])
+
+    def extend(self, horizon: int):
+        """Calculates the calendar for elapsed hours 0 to ``horizon - 1``."""
+        elapsed_hours = np.arange(horizon, dtype=np.int64)
+        self.arrays = make_calendar_arrays(elapsed_hours, self.start_year,
+            self.start_day, self.start_hour, self.hours_in_day,
+            self.hours_in_year, self.hours_in_leapyear)
+
+    def get(self, field: str, elapsed_hours: int):
+        """Returns the value of the field at the given elapsed hour."""
+        if elapsed_hours >= len(self):
+            self.extend(max(2 * len(self), elapsed_hours + 1))
+        value = self.arrays[field][elapsed_hours]
+        if field == 'is_leapyear':
+            return bool(value)
+        return int(value)
+
+def make_calendar_arrays(elapsed_hours: np.ndarray, start_year: int,
+                         start_day: int, start_hour: int, hours_in_day: int,
+                         hours_in_year: int, hours_in_leapyear: int)-> dict:
+    """Returns a dict of arrays for each calendar field, evaluated at each
+    of the elapsed hours."""
+    num_years = int(elapsed_hours.max(initial=0)) // hours_in_year + 2
+    years = start_year + np.arange(1, num_years + 1)
+    leapyears = years % 4 == 0
+    year_lengths = np.where(leapyears, hours_in_leapyear, hours_in_year)
+    years_covered = np.searchsorted(np.cumsum(year_lengths), elapsed_hours) + 1
+    years_covered[elapsed_hours <= 0] = 0
+    num_leapyears = np.concatenate(([0], np.cumsum(leapyears)))[years_covered]
+
+    shifted_hours = elapsed_hours - hours_in_day * num_leapyears
+    year_hours = shifted_hours + (start_day - 1) * hours_in_day + start_hour
+    year = start_year + year_hours // hours_in_year
+    day_hours = shifted_hours - hours_in_year * (year - start_year) + start_hour
+    day = start_day + day_hours // hours_in_day
+    hour = (start_hour + elapsed_hours) % hours_in_day
+    is_leapyear = year % 4 == 0
+    max_hour_idx = np.where(is_leapyear, hours_in_leapyear, hours_in_year)
+    hour_idx = np.clip(day * hours_in_day + hour, 0, max_hour_idx)
+
+    return dict(
+        num_leapyears = num_leapyears,
+        year = year,
+        day = day,
+        hour = hour,
+        is_leapyear = is_leapyear,
+        hour_idx = hour_idx,
+    )
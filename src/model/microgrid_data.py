@@ -0,0 +1,226 @@
+"""Columnar data layer for the CSV files used by the microgrid.
+
+Each CSV file is parsed once into a dictionary of NumPy arrays keyed by
+column name. Numeric columns are stored as float arrays so that lookups
+during a simulation are simple array reads, while columns that cannot be
+converted (such as timestamps) are kept as arrays of strings.
+
+Parsed files are saved to an on-disk cache of ``.npy`` files (one per
+column) that are memory-mapped by later loads, so that starting a new
+process costs a page fault rather than a CSV parse. The cache for each
+file is validated against the modification time of the source file, and
+if that has changed, against its SHA-256 hash.
+
+Loaded files are held in a process-wide registry keyed by the resolved
+file path, so every actor that references the same file shares a single
+immutable dataset. Loads can be projected onto the columns the model 
+actually references, in which case only those columns are parsed, 
+cached, and held in memory.
+"""
+import csv
+import hashlib
+import json
+import logging
+import os
+from types import MappingProxyType
+import numpy as np
+
+CACHE_DIRNAME = '.npy_cache'
+CACHE_DIR = os.environ.get('MICROGRID_CACHE_DIR', None)
+META_FILENAME = 'meta.json'
+
+def read_csv_columns(filename: str, columns: list=None)-> dict:
+    """Parses a CSV file into a dict of read-only NumPy column arrays,
+    keyed by the names given in the header row. If ``columns`` is given, 
+    only those columns are converted and returned."""
+    with open(filename, newline='', encoding='utf-8-sig') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        rows = [row for row in reader if len(row) > 0]
+
+    if columns is None:
+        columns = header
+    missing = [name for name in columns if name not in header]
+    if len(missing) > 0:
+        raise KeyError(f'Columns {missing} not found in {filename}')
+
+    data = {}
+    for name in columns:
+        i = header.index(name)
+        data[name] = make_column([row[i] if i < len(row) else '' for row in rows])
+    return data
+
+def make_column(values: list)-> np.ndarray:
+    """Converts a sequence of strings to a read-only NumPy array, as
+    floats if possible (with empty cells as NaN) or otherwise as strings."""
+    column = np.array(values, dtype=str)
+    try:
+        column = column.astype(float)
+    except ValueError:
+        try:
+            column = np.where(np.char.strip(column) == '', 'nan', column).astype(float)
+        except ValueError:
+            pass
+    column.setflags(write=False)
+    return column
+
+
+## Binary cache
+def load_csv_columns(filename: str, columns: list=None, 
+                     use_cache: bool=True)-> dict:
+    """Returns the columns of the CSV file (all of them if ``columns`` 
+    is None), memory-mapped from the binary cache. Columns missing from
+    the cache (or all of them, if the cache is out of date) are parsed 
+    from the file and added to the cache."""
+    if not use_cache:
+        return read_csv_columns(filename, columns)
+
+    cache_dir = get_cache_dir(filename)
+    meta = read_cache_meta(cache_dir)
+    if meta is not None and not cache_is_valid(filename, cache_dir, meta):
+        meta = None
+    if columns is None:
+        columns = read_csv_header(filename) if meta is None else meta['header']
+
+    uncached = [name for name in columns 
+                if meta is None or name not in meta['columns']]
+    if len(uncached) > 0:
+        parsed = read_csv_columns(filename, uncached)
+        try:
+            meta = write_cache(filename, cache_dir, parsed, meta)
+        except OSError as e:
+            logging.warning(f'Unable to cache {filename}, using parsed data: {e}')
+            return read_csv_columns(filename, columns)
+    return open_cached_columns(cache_dir, meta, columns)
+
+def get_cache_dir(filename: str)-> str:
+    """Returns the directory holding the binary cache for the CSV file."""
+    path = os.path.realpath(filename)
+    root = CACHE_DIR
+    if root is None:
+        root = os.path.join(os.path.dirname(path), CACHE_DIRNAME)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    path_hash = hashlib.sha1(path.encode()).hexdigest()[:8]
+    return os.path.join(root, f'{stem}_{path_hash}')
+
+def read_cache_meta(cache_dir: str)-> dict:
+    """Returns the metadata of the cache, or None if it cannot be read."""
+    try:
+        with open(os.path.join(cache_dir, META_FILENAME)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def cache_is_valid(filename: str, cache_dir: str, meta: dict)-> bool:
+    """Returns true if the cache matches the source file, checking the
+    modification time first and the file hash if the time has changed."""
+    stat = os.stat(filename)
+    if 'header' not in meta or stat.st_size != meta.get('size'):
+        return False
+    if stat.st_mtime_ns == meta.get('mtime_ns'):
+        return True
+    if hash_file(filename) != meta.get('sha256'):
+        return False
+    meta['mtime_ns'] = stat.st_mtime_ns
+    try:
+        write_cache_meta(cache_dir, meta)
+    except OSError:
+        pass
+    return True
+
+def hash_file(filename: str)-> str:
+    """Returns the SHA-256 hash of the file."""
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda : file.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def read_csv_header(filename: str)-> list:
+    """Returns the column names in the header row of the CSV file."""
+    with open(filename, newline='', encoding='utf-8-sig') as file:
+        return next(csv.reader(file))
+
+def write_cache(filename: str, cache_dir: str, columns: dict, 
+                meta: dict=None)-> dict:
+    """Writes each column to a ``.npy`` file in the cache directory,
+    returning the updated metadata of the cache. Columns are added to the
+    existing cache if ``meta`` is given, otherwise a new cache is made."""
+    os.makedirs(cache_dir, exist_ok=True)
+    if meta is None:
+        stat = os.stat(filename)
+        meta = dict(
+            source = os.path.realpath(filename),
+            size = stat.st_size,
+            mtime_ns = stat.st_mtime_ns,
+            sha256 = hash_file(filename),
+            header = read_csv_header(filename),
+            columns = {},
+        )
+    for name, column in columns.items():
+        column_filename = hashlib.sha1(name.encode()).hexdigest()[:12] + '.npy'
+        path = os.path.join(cache_dir, column_filename)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.save(file, column)
+        os.replace(tmp_path, path)
+        meta['columns'][name] = column_filename
+    write_cache_meta(cache_dir, meta)
+    return meta
+
+def write_cache_meta(cache_dir: str, meta: dict):
+    """Atomically writes the metadata file of the cache."""
+    path = os.path.join(cache_dir, META_FILENAME)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(meta, file, indent=1)
+    os.replace(tmp_path, path)
+
+def open_cached_columns(cache_dir: str, meta: dict, columns: list)-> dict:
+    """Opens each of the cached columns as a read-only memory map."""
+    data = {}
+    for name in columns:
+        path = os.path.join(cache_dir, meta['columns'][name])
+        data[name] = np.load(path, mmap_mode='r')
+    return data
+
+
+## Registry
+class DataRegistry:
+    """A store of loaded CSV datasets keyed by resolved file path, so that
+    memory grows with the number of distinct files rather than the 
+    number of actors referencing them."""
+    def __init__(self, use_cache: bool=True):
+        self.use_cache = use_cache
+        self.datasets = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename: str, columns: list=None)-> MappingProxyType:
+        """Returns the shared (read-only) columns of the CSV file, loading
+        any that have not been requested before. All columns are 
+        returned if ``columns`` is None."""
+        path = os.path.realpath(filename)
+        dataset, is_complete = self.datasets.get(path, ({}, False))
+        if is_complete or (columns is not None and 
+                           all(name in dataset for name in columns)):
+            self.hits += 1
+            return dataset
+        self.misses += 1
+        uncached = None if columns is None else [c for c in columns if c not in dataset]
+        loaded = load_csv_columns(path, uncached, self.use_cache)
+        dataset = MappingProxyType(dict(dataset) | loaded)
+        self.datasets[path] = (dataset, columns is None)
+        return dataset
+
+    def info(self)-> dict:
+        """Returns the hit and miss counts and number of files held."""
+        return dict(hits=self.hits, misses=self.misses, files=len(self.datasets))
+
+    def clear(self):
+        """Removes all datasets and resets the counters."""
+        self.datasets = {}
+        self.hits = 0
+        self.misses = 0
+
+DATA_REGISTRY = DataRegistry()
@@ -0,0 +1,156 @@
+"""Presampled failure trajectories of the actors of the microgrid.
+
+Whether an actor is failing is a Markov chain, where an operating actor
+fails with a probability of ``prob_failing`` each step and a failing
+actor is fixed with a probability of ``prob_fixed`` (as sampled one 
+step at a time by ``Rdeterming_if_failing``). The chains do not
+depend on the state of the grid, so the failures of every actor over a
+block of steps are sampled up front in a single vectorized pass, and the
+hypergraph only has to index into an array each time step.
+
+The time an actor stays operating (or failing) is geometrically
+distributed, so each chain is sampled as alternating run lengths drawn
+with ``Generator.geometric``, rather than a draw for every step. The
+trajectories are extended a block at a time as later steps are
+requested, from their own generator, so the failures at a step do not
+depend on when they were requested.
+
+Trajectories can be sampled once and passed to other simulations as the
+``failure_trajectories`` input, so that several variants of the model
+(such as the configurations of a sweep) see the same failures::
+
+    failures = FailureTrajectories(['Generator1', 'PV1'], p_fail=[0.02, 0.02],
+                                   p_fix=[0.5, 0.5], is_failing=[False, False],
+                                   rng=make_rng(7))
+    sim = Simulation(mg, inputs | {'failure_trajectories': failures})
+
+Actors without a trajectory are never failing.
+"""
+import numpy as np
+
+class FailureTrajectories:
+    """Boolean arrays of whether each actor is failing, indexed by step,
+    which are extended automatically if a later step is requested.
+
+    Parameters
+    ----------
+    names : list
+        The names of the actors.
+    p_fail : list
+        Probability each (operating) actor fails in a step.
+    p_fix : list
+        Probability each (failing) actor is fixed in a step.
+    is_failing : list
+        Whether each actor is failing at step 0.
+    rng : np.random.Generator
+        Generator the trajectories are sampled from.
+    block_size : int, default=8784
+        Number of steps sampled each time the trajectories are extended.
+    """
+    def __init__(self, names: list, p_fail: list, p_fix: list, is_failing: list,
+                 rng: np.random.Generator, block_size: int=8784):
+        self.name_index = {name: i for i, name in enumerate(names)}
+        self.p_fail = np.asarray(p_fail, dtype=float)
+        self.p_fix = np.asarray(p_fix, dtype=float)
+        self.rng = rng
+        self.block_size = max(1, int(block_size))
+        self.array = np.asarray(is_failing, dtype=bool).reshape(-1, 1)
+        self.num_used = 1
+        self.extend(self.block_size)
+
+    @classmethod
+    def from_actors(cls, actors: list, seed: int=None, run: int=None, **kwargs):
+        """Samples the trajectories of the actors from their static
+        probabilities, with a generator made from the seed (see
+        ``make_rng``)."""
+        from model.microgrid_relations import make_rng
+        return cls([str(A) for A in actors],
+                   [A.prob_failing.static_value or 0. for A in actors],
+                   [A.prob_fixed.static_value or 0. for A in actors],
+                   [bool(A.is_failing.static_value) for A in actors],
+                   make_rng(seed, run), **kwargs)
+
+    def __len__(self):
+        return self.array.shape[1]
+
+    def extend(self, num_steps: int):
+        """Samples the trajectories up to ``num_steps``, a block at a time."""
+        while len(self) < num_steps:
+            block = sample_failure_trajectories(self.array[:, -1], self.p_fail,
+                                                self.p_fix, self.block_size + 1,
+                                                self.rng)
+            self.array = np.concatenate((self.array, block[:, 1:]), axis=1)
+
+    def get(self, name: str, step: int)-> bool:
+        """Returns true if the actor is failing at the step."""
+        if name not in self.name_index:
+            return False
+        if step >= len(self):
+            self.extend(step + 1)
+        self.num_used = max(self.num_used, step + 1)
+        return bool(self.array[self.name_index[name], step])
+
+    def get_steps(self, name: str, start: int, stop: int, use: bool=True)-> np.ndarray:
+        """Returns a boolean array of whether the actor is failing at each
+        step from ``start`` up to ``stop``. The steps are counted as used
+        (see ``log_likelihood_ratio``) unless ``use`` is false."""
+        if name not in self.name_index:
+            return np.zeros(max(0, stop - start), dtype=bool)
+        if stop > len(self):
+            self.extend(stop)
+        if use:
+            self.num_used = max(self.num_used, stop)
+        return self.array[self.name_index[name], start:stop].copy()
+
+    def log_likelihood_ratio(self, p_fail: list, p_fix: list)-> float:
+        """Returns the log of the likelihood of the steps returned so far
+        under the probabilities ``p_fail`` and ``p_fix`` of each actor, 
+        relative to their likelihood under the probabilities they were
+        sampled with."""
+        x = self.array[:, :self.num_used]
+        prev, curr = x[:, :-1], x[:, 1:]
+        counts = [(~prev & curr).sum(axis=1), (~prev & ~curr).sum(axis=1),
+                  (prev & ~curr).sum(axis=1), (prev & curr).sum(axis=1)]
+        def log_likelihood(p_fail, p_fix):
+            p_fail = np.asarray(p_fail, dtype=float)
+            p_fix = np.asarray(p_fix, dtype=float)
+            probs = [p_fail, 1. - p_fail, p_fix, 1. - p_fix]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return sum(np.where(n > 0, n * np.log(p), 0.).sum() 
+                           for n, p in zip(counts, probs))
+        return float(log_likelihood(p_fail, p_fix) - log_likelihood(self.p_fail, self.p_fix))
+
+def sample_failure_trajectories(is_failing: np.ndarray, p_fail: np.ndarray,
+                                p_fix: np.ndarray, num_steps: int,
+                                rng: np.random.Generator)-> np.ndarray:
+    """Returns a boolean array (actors, num_steps) of whether each actor
+    is failing at each step, starting from ``is_failing`` at step 0.
+
+    Each actor alternates between runs of operating and failing steps,
+    where the length of each run is geometric with the probability of
+    leaving the state. Enough runs are drawn for every actor to cover the
+    steps, and the state at each step is given by the number of runs
+    ended before it.
+    """
+    start = np.asarray(is_failing, dtype=bool)
+    num_actors = len(start)
+    if num_actors == 0:
+        return np.zeros((0, num_steps), dtype=bool)
+    rate = np.maximum(np.maximum(p_fail, p_fix), 1. / num_steps)
+    num_runs = int(np.ceil(num_steps * rate.max())) + 2
+
+    lengths = np.zeros((num_actors, 0), dtype=np.int64)
+    while lengths.shape[1] == 0 or lengths.sum(axis=1).min() < num_steps:
+        k = lengths.shape[1] + np.arange(num_runs)
+        state = start[:, None] ^ (k % 2 == 1)[None, :]
+        p_leave = np.where(state, p_fix[:, None], p_fail[:, None])
+        runs = rng.geometric(np.where(p_leave > 0., p_leave, 1.))
+        runs[p_leave <= 0.] = num_steps
+        lengths = np.concatenate((lengths, runs), axis=1)
+
+    ends = np.cumsum(lengths, axis=1)
+    offsets = (np.arange(num_actors) * (ends[:, -1].max() + 1))[:, None]
+    steps = np.arange(num_steps)[None, :] + offsets
+    num_ended = np.searchsorted((ends + offsets).ravel(), steps.ravel(), side='right')
+    num_ended = num_ended.reshape(num_actors, num_steps) - np.arange(num_actors)[:, None] * lengths.shape[1]
+    return start[:, None] ^ (num_ended % 2 == 1)
@@ -0,0 +1,219 @@
+"""Importance sampling of rare outages of the microgrid.
+
+The outages that matter most for resilience, such as a generator failing
+while its fuel is late, are rare under realistic probabilities of
+failure, so plain Monte Carlo needs a great many runs to see them. An
+importance sampling study instead samples the failures and refuelings of
+each run from tilted probabilities, such as::
+
+    inputs = MC_INPUTS | {'prob_failingGenerator1': 0.002}
+    tilt = {
+        'prob_failingGenerator1': 0.05,
+        'prob_fixedGenerator1': 0.05,
+        'prob of daily refueling': 0.05,
+    }
+
+and weighs the metrics of each run by the likelihood ratio of its
+failures and refuelings under the nominal probabilities (those of the
+model and its inputs) relative to the tilted ones. Since the failures
+(see ``microgrid_failures``) and refuelings (see ``microgrid_refueling``)
+are sampled up front, the likelihood ratio is calculated exactly from
+the transitions and gaps used by the run. A probability can only be 
+tilted if it is zero under neither the nominal nor the tilted 
+probabilities, as the runs could not otherwise be weighed.
+
+The refuelings before the start hour of each run are sampled from the
+nominal probability of refueling, so that only the refuelings during the
+run are tilted and weighed.
+
+The log of the weight of each run is given as the ``LogWeight`` metric.
+``estimate_importance`` then gives unbiased estimates of the mean of each
+metric and of the probability of each metric exceeding a threshold, along
+with their standard errors and effective sample sizes.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import importlib
+import math
+import numpy as np
+
+from model.microgrid_montecarlo import MC_INPUTS, ScenarioRunner, get_actors, \
+    make_batches, write_results_csv, write_summary_csv
+from model.microgrid_failures import FailureTrajectories
+from model.microgrid_refueling import RefuelSchedule
+
+REFUEL_PROB = 'prob of daily refueling'
+
+IMPORTANCE_STATS = ['mean', 'std_error', 'ess', 'size']
+
+class ImportanceRunner(ScenarioRunner):
+    """Simulates single runs of an importance sampling study, built once
+    for each worker. The failures and refuelings of each run are sampled
+    from the tilted probabilities {label : float}, given for any of the
+    ``prob_failing<actor>``, ``prob_fixed<actor>`` and ``prob of daily
+    refueling`` nodes. Other parameters are as for ``ScenarioRunner``.
+    """
+    def __init__(self, model: str, graph: str, inputs: dict, num_steps: int,
+                 tilt: dict, search_depth: int=100000, stop_condition=None):
+        module = importlib.import_module(model)
+        hg = getattr(module, graph)
+        self.actor_names = list(get_actors(module))
+        labels = [f'prob_failing{a}' for a in self.actor_names]
+        labels += [f'prob_fixed{a}' for a in self.actor_names] + [REFUEL_PROB]
+        unknown = set(tilt).difference(labels)
+        if len(unknown) > 0:
+            raise ValueError(f'Unable to tilt {sorted(unknown)}')
+
+        def get_prob(label):
+            value = inputs.get(label, hg.get_node(label).static_value)
+            return 0. if value is None else float(value)
+        self.nominal = {label: get_prob(label) for label in labels}
+        self.is_failing = [bool(inputs.get(f'is_failing{a}', 
+                                           hg.get_node(f'is_failing{a}').static_value))
+                           for a in self.actor_names]
+        self.tilted = self.nominal | tilt
+        for label, prob in tilt.items():
+            if (self.nominal[label] == 0.) != (prob == 0.):
+                raise ValueError(f'Unable to tilt {label} from {self.nominal[label]} to {prob}, '
+                                 'as only one of them is zero')
+        self.hours_in_day = inputs.get('hours_in_day', hg.get_node('hours_in_day').static_value)
+
+        failures, schedule = self.sample(np.random.default_rng(0))
+        inputs = inputs | {'failure_trajectories': failures, 'refuel_schedule': schedule}
+        super().__init__(model, graph, inputs, num_steps, search_depth, stop_condition)
+
+    def get_probs(self, probs: dict)-> tuple:
+        """Returns the probability of failing and of being fixed of each
+        actor, and the probability of daily refueling."""
+        p_fail = [probs[f'prob_failing{a}'] for a in self.actor_names]
+        p_fix = [probs[f'prob_fixed{a}'] for a in self.actor_names]
+        return p_fail, p_fix, probs[REFUEL_PROB]
+
+    def sample(self, rng: np.random.Generator, start_hour: int=0)-> tuple:
+        """Samples the failures and refuelings of a run from the tilted
+        probabilities, starting from the failing actors of the inputs, 
+        with the refuelings before the start hour sampled from the nominal
+        probability."""
+        p_fail, p_fix, p_refuel = self.get_probs(self.tilted)
+        failures = FailureTrajectories(self.actor_names, p_fail, p_fix,
+                                       self.is_failing, rng)
+        schedule = RefuelSchedule(p_refuel, self.hours_in_day, rng,
+                                  nominal_prob=self.nominal[REFUEL_PROB],
+                                  nominal_until=start_hour)
+        return failures, schedule
+
+    def get_start_hour(self, run_id: int, seed: int)-> int:
+        """Returns the hour index the run starts at, from the setup of the
+        simulation with the generator of the run."""
+        self.sim.reseed(seed, run_id)
+        static = self.sim.plan.run_setup(self.sim.inputs)[0]
+        return static['calendar'].get('hour_idx', 0)
+
+    def run(self, run_id: int, seed: int)-> tuple:
+        """Simulates the run of a study with the seed, returning the run
+        id, seed and the metrics of the run, including its ``LogWeight``."""
+        seq = np.random.SeedSequence(seed, spawn_key=(run_id, 1))
+        failures, schedule = self.sample(np.random.default_rng(seq),
+                                         self.get_start_hour(run_id, seed))
+        self.sim.update_inputs({'failure_trajectories': failures,
+                                'refuel_schedule': schedule})
+        run_id, seed, metrics = super().run(run_id, seed)
+        p_fail, p_fix, p_refuel = self.get_probs(self.nominal)
+        log_weight = failures.log_likelihood_ratio(p_fail, p_fix)
+        log_weight += schedule.log_likelihood_ratio(p_refuel)
+        metrics['LogWeight'] = log_weight
+        return run_id, seed, metrics
+
+_RUNNER = None
+
+def init_worker(*args):
+    """Builds the importance sampling runner for a worker process."""
+    global _RUNNER
+    _RUNNER = ImportanceRunner(*args)
+
+def run_batch(runs: list)-> list:
+    """Simulates each ``(run_id, seed)`` in a worker process."""
+    return [_RUNNER.run(run_id, seed) for run_id, seed in runs]
+
+def iter_importance_sampling(num_runs: int, tilt: dict, inputs: dict=None,
+                             num_steps: int=336, seed: int=0, max_workers: int=None,
+                             batch_size: int=4, model: str='model.microgrid',
+                             graph: str='mg', search_depth: int=100000,
+                             stop_condition=None):
+    """Yields ``(run_id, seed, metrics)`` for each run of an importance
+    sampling study as it finishes (not necessarily in order). If
+    ``max_workers`` is 0, the runs are simulated in this process."""
+    inputs = MC_INPUTS if inputs is None else inputs
+    batches = make_batches(num_runs, seed, batch_size)
+    args = (model, graph, inputs, num_steps, tilt, search_depth, stop_condition)
+
+    if max_workers == 0:
+        runner = ImportanceRunner(*args)
+        for batch in batches:
+            for run_id, run_seed in batch:
+                yield runner.run(run_id, run_seed)
+        return
+
+    with ProcessPoolExecutor(max_workers, initializer=init_worker, initargs=args) as pool:
+        futures = [pool.submit(run_batch, batch) for batch in batches]
+        for future in as_completed(futures):
+            for result in future.result():
+                yield result
+
+def get_effective_sample_size(weights: np.ndarray)-> float:
+    """Returns the effective sample size (sum w)^2 / sum w^2 of the
+    weights."""
+    total_sq = float(np.sum(weights**2))
+    return 0. if total_sq == 0. else float(np.sum(weights))**2 / total_sq
+
+def estimate_importance(results: list, thresholds: dict=None)-> dict:
+    """Returns the importance sampling estimates {stat : {column : float}}
+    over the metrics of each run, with the estimate (``mean``), its
+    standard error, the effective sample size and the number of runs.
+
+    The mean of each metric is estimated as the mean of the metric times
+    the weight of each run, which is unbiased. For each threshold
+    {column : float}, the probability of the metric exceeding the
+    threshold is estimated as a column ``P(<column> > <threshold>)``,
+    where the effective sample size is that of the runs exceeding it.
+    """
+    thresholds = {} if thresholds is None else thresholds
+    summary = {stat: {} for stat in IMPORTANCE_STATS}
+    if len(results) == 0:
+        return summary
+    weights = np.exp([r['LogWeight'] for r in results])
+    size = len(results)
+    ess = get_effective_sample_size(weights)
+
+    def add(col, values, col_ess):
+        weighted = weights * values
+        summary['mean'][col] = float(weighted.mean())
+        summary['std_error'][col] = float(weighted.std(ddof=1) / math.sqrt(size)) \
+                                    if size > 1 else math.inf
+        summary['ess'][col] = col_ess
+        summary['size'][col] = size
+
+    for col in results[0]:
+        if col != 'LogWeight':
+            add(col, np.array([r[col] for r in results], dtype=float), ess)
+    for col, threshold in thresholds.items():
+        exceeds = np.array([r[col] > threshold for r in results], dtype=float)
+        add(f'P({col} > {threshold})', exceeds, get_effective_sample_size(weights * exceeds))
+    return summary
+
+def run_importance_sampling(num_runs: int, tilt: dict, inputs: dict=None,
+                            thresholds: dict=None, results_file: str=None,
+                            summary_file: str=None, **kwargs)-> tuple:
+    """Runs an importance sampling study, returning the metrics of each
+    run (in order of the runs) and their estimates (see
+    ``estimate_importance``). The results and estimates are written to
+    CSV files if given. Keyword arguments are passed to
+    ``iter_importance_sampling``."""
+    results = [None] * num_runs
+    for run_id, seed, metrics in iter_importance_sampling(num_runs, tilt, inputs, **kwargs):
+        results[run_id] = metrics
+    estimates = estimate_importance(results, thresholds)
+    if results_file is not None:
+        write_results_csv(results, results_file)
+    if summary_file is not None:
+        write_summary_csv(estimates, summary_file)
+    return results, estimates
@@ -0,0 +1,626 @@
+"""Monte Carlo studies of the resilience of the microgrid.
+
+Each run of a study is an independent simulation of the model with its
+own random generator, spawned from the seed of the study by the number
+of the run (see ``make_rng``), so that the random start date, failures
+and refueling times differ between runs. Any run can be reproduced on 
+its own from the seed of the study and its number with ``run_single``.
+
+Runs are distributed across a pool of worker processes, each of which 
+builds the model and compiles its simulation once, and the metrics of
+each run are streamed back as they finish.
+
+The metrics mirror the results of the archived MATLAB model
+(``MG_Sim_MC_Results.csv``), calculated for each run:
+
+- ``MI``: mission impact, the sum of the hours each load was shed
+  weighted by the benefit of the load.
+- ``BatteryExhausted_<battery>``: hours the battery had no charge.
+- ``FuelEmpty_<generator>``: hours the generator had no fuel.
+- ``LoadShed_<load>``: unmet demand of the load (kWh).
+- ``ShedHours_<load>``: hours the load was shed.
+- ``SkippedSteps``: steps not simulated after the run was stopped early.
+
+A run can be stopped early by a stop condition (such as ``GridLost``),
+which is checked after each step. The stop condition fills in the 
+metrics of the remaining steps, which ``GridLost`` calculates exactly
+from the loads, failures and refuelings of each remaining step, as these
+do not depend on the state of the grid.
+
+The summary of a study (``MG_Sim_MC_Summary.csv``) gives the mean, max,
+min, (population) standard deviation and size of each metric. Summaries
+are accumulated one run at a time by a ``RunningSummary``, which each 
+worker keeps for its own runs and which are merged exactly (by Welford's
+and Chan's updates), so ``summarize_monte_carlo`` can summarize a large 
+study without holding the metrics of each run.
+
+Rather than guessing the number of runs a study needs, 
+``run_adaptive_monte_carlo`` runs batches until the confidence interval
+of the mean of each target metric is within a relative precision of the
+mean, or until a budget of runs or time is spent.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import deque
+from statistics import NormalDist
+import csv
+import importlib
+import math
+import os
+import time
+import numpy as np
+
+from model.microgrid_simulation import Simulation
+from model.microgrid_relations import Rcalc_elapsed_hours, Rget_float_from_csv_data, \
+    Rcalc_critical_load, Rdetermine_building_load, Rcalc_generator_fuel_level, \
+    Rget_next_refuel_hour, Rcalc_battery_charge_level
+
+MC_INPUTS = {
+    'use_random_date': True,
+    'has_random_failure': True,
+    'island_mode': True,
+    'time_step': 3600,
+}
+"""Inputs for a two week islanded study with failures allowed."""
+
+SUMMARY_STATS = ['mean', 'max', 'min', 'std', 'size']
+
+ACTOR_GROUPS = ['UGs', 'BUSs', 'PVs', 'WINDs', 'LOADs', 'BUILDINGs', 'GENs', 'BATTERYs']
+"""Groups of actors listed by a model, in the order their tuples are 
+passed to ``Rmake_state_vector`` (which breaks ties in the queues)."""
+
+def get_actors(module)-> dict:
+    """Returns each actor of the model {name : GridActor}, in the order of
+    ``ACTOR_GROUPS``."""
+    actors = {}
+    for group in ACTOR_GROUPS:
+        for actor in getattr(module, group, []):
+            actors[str(actor)] = actor
+    return actors
+
+def resolve_parameter(hg, actors: dict, key: str)-> str:
+    """Returns the label of the node set by the parameter, given either as
+    ``<actor>.<attribute>`` or as a node label."""
+    if key in hg.nodes:
+        return key
+    name, _, attr = key.partition('.')
+    if name not in actors or not hasattr(actors[name], attr):
+        raise KeyError(f'No actor parameter or node found for {key}')
+    return getattr(actors[name], attr).label
+
+class ResilienceMetrics:
+    """The resilience metrics of a single run, updated as each step of
+    the simulation arrives.
+
+    Parameters
+    ----------
+    names : list
+        The names of the actors, in the order of the state vector.
+    batteries : list
+        Names of the batteries on the grid.
+    generators : list
+        Names of the generators on the grid.
+    loads : dict
+        The weight of each load {name : float} for the mission impact.
+    time_step : float, default=3600
+        Seconds between each step.
+    tol : float, default=1e-6
+        Values smaller than the tolerance are treated as zero.
+    """
+    def __init__(self, names: list, batteries: list, generators: list,
+                 loads: dict, time_step: float=3600, tol: float=1e-6):
+        self.name_index = {name: i for i, name in enumerate(names)}
+        self.batteries = batteries
+        self.generators = generators
+        self.loads = loads
+        self.hours_per_step = time_step / 3600
+        self.tol = tol
+        self.exhausted = {b: 0. for b in batteries}
+        self.fuel_empty = {g: 0. for g in generators}
+        self.load_shed = {l: 0. for l in loads}
+        self.shed_hours = {l: 0. for l in loads}
+        self.skipped_steps = 0
+
+    @staticmethod
+    def get_nodes(batteries: list, generators: list, loads: dict)-> list:
+        """Returns the labels of the nodes needed by the metrics."""
+        nodes = [f'charge_level_{b}' for b in batteries]
+        nodes += [f'fuel_level_{g}' for g in generators]
+        nodes += [f'req_demand_{l}' for l in loads]
+        return nodes
+
+    def update(self, step):
+        """Adds the ``SimulationStep`` to the metrics."""
+        if step.state_vector is None:
+            return
+        values, dt = step.values, self.hours_per_step
+        for b in self.batteries:
+            if values[f'charge_level_{b}'] < self.tol:
+                self.exhausted[b] += dt
+        for g in self.generators:
+            if values[f'fuel_level_{g}'] < self.tol:
+                self.fuel_empty[g] += dt
+        for l in self.loads:
+            received = -step.state_vector[self.name_index[l]]
+            shed = values[f'req_demand_{l}'] - received
+            if shed > self.tol:
+                self.load_shed[l] += shed * dt
+                self.shed_hours[l] += dt
+
+    def extrapolate(self, num_steps: int, charge_levels: dict, fuel_levels: dict,
+                    req_demands: dict):
+        """Fills in the metrics of ``num_steps`` skipped steps in which no
+        load receives power, given the charge level of each battery, fuel
+        level of each generator and required demand of each load at each
+        skipped step {name : np.ndarray}."""
+        self.skipped_steps += num_steps
+        dt = self.hours_per_step
+        for b in self.batteries:
+            for level in charge_levels[b]:
+                if level < self.tol:
+                    self.exhausted[b] += dt
+        for g in self.generators:
+            for level in fuel_levels[g]:
+                if level < self.tol:
+                    self.fuel_empty[g] += dt
+        for l in self.loads:
+            for shed in req_demands[l]:
+                if shed > self.tol:
+                    self.load_shed[l] += shed * dt
+                    self.shed_hours[l] += dt
+
+    def result(self)-> dict:
+        """Returns the metrics of the run {column : float}."""
+        out = {'MI': sum(self.shed_hours[l] * w for l, w in self.loads.items())}
+        out |= {f'BatteryExhausted_{b}': v for b, v in self.exhausted.items()}
+        out |= {f'FuelEmpty_{g}': v for g, v in self.fuel_empty.items()}
+        out |= {f'LoadShed_{l}': v for l, v in self.load_shed.items()}
+        out |= {f'ShedHours_{l}': v for l, v in self.shed_hours.items()}
+        out['SkippedSteps'] = self.skipped_steps
+        return out
+
+class GridLost:
+    """Stop condition holding once no actor can supply power for the rest
+    of the run, so that no load receives power until its end. This is the
+    case when, at every remaining step, each utility grid is islanded or
+    failing, each photovoltaic array, wind turbine and generator is 
+    failing, and each battery is failing or has no charge. The failures of
+    a run are sampled up front, so they are known for every remaining 
+    step.
+
+    The metrics of the remaining steps are then filled in exactly, with
+    the demand of each load and the fuel level of each generator at each
+    remaining step calculated by the relations of the model without 
+    simulating the grid. Generators are not checked for fuel, as their 
+    supply does not depend on their fuel level.
+    """
+    nodes = ['next refuel hour', 'hour index']
+
+    def __call__(self, step, metrics: ResilienceMetrics, remaining: int,
+                 runner: 'ScenarioRunner')-> bool:
+        """Returns true if the grid is lost after the step, with 
+        ``remaining`` steps left in the run, after filling in the metrics
+        of the remaining steps."""
+        get = runner.get_value
+        groups = runner.groups
+        start, stop = step.index, step.index + remaining
+        failures = get('failure_trajectories') if get('has_random_failure') is True else None
+        def is_failing(A, use=False):
+            if failures is None:
+                return np.zeros(remaining, dtype=bool)
+            return failures.get_steps(str(A), start, stop, use)
+
+        island_mode = get('island_mode') is True
+        if not all(island_mode or is_failing(UG).all() for UG in groups['UGs']):
+            return False
+        if not all(is_failing(A).all() for A in groups['PVs'] + groups['WINDs'] + groups['GENs']):
+            return False
+        time_step, seconds_in_hour = get('time_step'), get('seconds_in_hour')
+        charge_levels = {}
+        for B in groups['BATTERYs']:
+            level = Rcalc_battery_charge_level(step.state_vector[metrics.name_index[str(B)]],
+                                               step.values[B.charge_level.label],
+                                               get(B.charge_capacity.label), time_step,
+                                               get(B.charge_efficiency.label), seconds_in_hour)
+            if level > get('tolerance') and not is_failing(B).all():
+                return False
+            charge_levels[str(B)] = np.full(remaining, level)
+
+        times = step.time + time_step * np.arange(1, remaining + 1)
+        calendar = get('calendar')
+        hours = [calendar.get('hour_idx', Rcalc_elapsed_hours(t, seconds_in_hour)) for t in times]
+        req_demands = {}
+        for L in groups['LOADs'] + groups['BUILDINGs']:
+            if L in groups['BUILDINGs']:
+                data = get(L.load_data.label)
+                normal = [Rget_float_from_csv_data(data, h, get(L.normal_col_name.label))
+                          for h in hours]
+                critical = [Rcalc_critical_load(
+                                Rget_float_from_csv_data(data, h, get(L.lights_col_name.label)),
+                                Rget_float_from_csv_data(data, h, get(L.equipment_col_name.label)))
+                            for h in hours]
+            else:
+                normal = [get(L.normal_load.label)] * remaining
+                critical = [get(L.critical_load.label)] * remaining
+            req_demands[str(L)] = [Rdetermine_building_load(not f, n, c, True)
+                                   for f, n, c in zip(is_failing(L, use=True), normal, critical)]
+
+        next_refuel, hour = step.values['next refuel hour'], step.values['hour index']
+        fuel = {str(G): step.values[G.fuel_level.label] for G in groups['GENs']}
+        fuel_levels = {g: [] for g in fuel}
+        schedule = get('refuel_schedule')
+        for k in range(remaining):
+            for G in groups['GENs']:
+                fuel[str(G)] = Rcalc_generator_fuel_level(next_refuel, hour, fuel[str(G)],
+                                                          get(G.fuel_capacity.label))
+                fuel_levels[str(G)].append(fuel[str(G)])
+            if schedule is not None:
+                next_refuel = Rget_next_refuel_hour(next_refuel, hour, schedule)
+            hour = hours[k]
+
+        metrics.extrapolate(remaining, charge_levels, fuel_levels, req_demands)
+        return True
+
+class RunningSummary:
+    """The summary statistics of the metrics of each run of a study, 
+    updated one run at a time without holding the runs. The mean and 
+    variance of each metric are updated with Welford's algorithm, and 
+    summaries of separate runs are merged with Chan's parallel update."""
+    def __init__(self):
+        self.size = 0
+        self.mean = {}
+        self.m2 = {}
+        self.max = {}
+        self.min = {}
+
+    def update(self, metrics: dict):
+        """Adds the metrics of a run {column : float} to the summary."""
+        self.size += 1
+        for col, val in metrics.items():
+            mean = self.mean.get(col, 0.)
+            delta = val - mean
+            self.mean[col] = mean + delta / self.size
+            self.m2[col] = self.m2.get(col, 0.) + delta * (val - self.mean[col])
+            self.max[col] = max(self.max.get(col, val), val)
+            self.min[col] = min(self.min.get(col, val), val)
+
+    def merge(self, other: 'RunningSummary'):
+        """Adds the runs summarized by another summary to the summary."""
+        if other.size == 0:
+            return
+        if self.size == 0:
+            self.size = other.size
+            self.mean, self.m2 = dict(other.mean), dict(other.m2)
+            self.max, self.min = dict(other.max), dict(other.min)
+            return
+        size = self.size + other.size
+        for col in other.mean:
+            delta = other.mean[col] - self.mean[col]
+            self.mean[col] += delta * other.size / size
+            self.m2[col] += other.m2[col] + delta**2 * self.size * other.size / size
+            self.max[col] = max(self.max[col], other.max[col])
+            self.min[col] = min(self.min[col], other.min[col])
+        self.size = size
+
+    def get_half_widths(self, confidence: float=0.95)-> dict:
+        """Returns the half width of the (normal) confidence interval of
+        the mean of each metric {column : float}, which is infinite 
+        until there are two runs."""
+        if self.size < 2:
+            return {col: math.inf for col in self.mean}
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        return {col: z * math.sqrt(m2 / (self.size - 1) / self.size)
+                for col, m2 in self.m2.items()}
+
+    def result(self)-> dict:
+        """Returns the mean, max, min, population standard deviation and
+        size of each metric {stat : {column : float}}."""
+        summary = {stat: {} for stat in SUMMARY_STATS}
+        for col, mean in self.mean.items():
+            summary['mean'][col] = mean
+            summary['max'][col] = self.max[col]
+            summary['min'][col] = self.min[col]
+            summary['std'][col] = math.sqrt(self.m2[col] / self.size)
+            summary['size'][col] = self.size
+        return summary
+
+class ScenarioRunner:
+    """Simulates single runs of a study, built once for each worker.
+
+    Parameters
+    ----------
+    model : str
+        The module building the microgrid (such as ``model.microgrid``),
+        which lists its actors as ``BATTERYs``, ``GENs``, ``LOADs`` and
+        ``BUILDINGs``.
+    graph : str
+        The name of the hypergraph in the module (such as ``mg``).
+    inputs : dict
+        The inputs of each simulation.
+    num_steps : int
+        The number of steps to simulate for each run.
+    search_depth : int, default=100000
+        Search depth used when compiling the simulation.
+    stop_condition : Callable, optional
+        Called with each step, the metrics of the run, the number of 
+        steps remaining and the runner, ending the run early if it 
+        returns true after filling in the metrics of the remaining steps
+        (see ``GridLost``). Any nodes it needs beyond those of the metrics
+        are listed in its ``nodes`` attribute.
+    """
+    def __init__(self, model: str, graph: str, inputs: dict, num_steps: int,
+                 search_depth: int=100000, stop_condition=None):
+        module = importlib.import_module(model)
+        self.hg = getattr(module, graph)
+        self.groups = {group: list(getattr(module, group, [])) for group in ACTOR_GROUPS}
+        self.batteries = [str(B) for B in self.groups['BATTERYs']]
+        self.generators = [str(G) for G in self.groups['GENs']]
+        self.loads = {}
+        for L in self.groups['LOADs'] + self.groups['BUILDINGs']:
+            weight = L.benefit.static_value
+            self.loads[str(L)] = 1. if weight is None else weight
+        self.inputs = inputs
+        self.num_steps = num_steps
+        self.stop_condition = stop_condition
+        nodes = ResilienceMetrics.get_nodes(self.batteries, self.generators, self.loads)
+        if stop_condition is not None:
+            nodes += [n for n in getattr(stop_condition, 'nodes', []) if n not in nodes]
+        self.sim = Simulation(self.hg, inputs, nodes=nodes, search_depth=search_depth)
+
+    def get_value(self, label: str):
+        """Returns the value of a node set before the first step of the
+        current run."""
+        if label in self.sim.static:
+            return self.sim.static[label]
+        if label in self.sim.inputs:
+            return self.sim.inputs[label]
+        return self.hg.get_node(label).static_value
+
+    def run(self, run_id: int, seed: int)-> tuple:
+        """Simulates the run of a study with the seed, returning the run 
+        id, seed and the metrics of the run."""
+        self.sim.reseed(seed, run_id)
+        metrics = ResilienceMetrics(self.sim.names, self.batteries, self.generators,
+                                    self.loads, self.inputs.get('time_step', 3600))
+        for step in self.sim.iter_steps(self.num_steps):
+            metrics.update(step)
+            remaining = self.num_steps - step.index
+            if self.stop_condition is not None and remaining > 0 \
+                    and step.state_vector is not None \
+                    and self.stop_condition(step, metrics, remaining, self):
+                if metrics.skipped_steps != remaining:
+                    raise ValueError('Stop condition ended the run without filling in '
+                                     'the metrics of its remaining steps')
+                break
+        return run_id, seed, metrics.result()
+
+_RUNNER = None
+
+def init_worker(*args):
+    """Builds the scenario runner for a worker process."""
+    global _RUNNER
+    _RUNNER = ScenarioRunner(*args)
+
+def run_batch(runs: list)-> list:
+    """Simulates each ``(run_id, seed)`` in a worker process."""
+    return [_RUNNER.run(run_id, seed) for run_id, seed in runs]
+
+def summarize_batch(runs: list, runner: ScenarioRunner=None)-> RunningSummary:
+    """Simulates each ``(run_id, seed)`` in a worker process (or with the
+    runner, if given), returning only the summary of their metrics."""
+    runner = _RUNNER if runner is None else runner
+    summary = RunningSummary()
+    for run_id, seed in runs:
+        summary.update(runner.run(run_id, seed)[2])
+    return summary
+
+def make_batches(num_runs: int, seed: int, batch_size: int)-> list:
+    """Returns the ``(run_id, seed)`` of each run, split into batches."""
+    runs = [(run_id, seed) for run_id in range(num_runs)]
+    return [runs[i:i + batch_size] for i in range(0, num_runs, batch_size)]
+
+def iter_monte_carlo(num_runs: int, inputs: dict=None, num_steps: int=336,
+                     seed: int=0, max_workers: int=None, batch_size: int=4,
+                     model: str='model.microgrid', graph: str='mg',
+                     search_depth: int=100000, stop_condition=None):
+    """Yields ``(run_id, seed, metrics)`` for each run of a Monte Carlo
+    study as it finishes (not necessarily in order).
+
+    Runs are sent to the worker processes in batches of ``batch_size``.
+    If ``max_workers`` is 0, the runs are simulated in this process. A
+    stop condition ends runs early (see ``ScenarioRunner``).
+    """
+    inputs = MC_INPUTS if inputs is None else inputs
+    batches = make_batches(num_runs, seed, batch_size)
+    args = (model, graph, inputs, num_steps, search_depth, stop_condition)
+
+    if max_workers == 0:
+        runner = ScenarioRunner(*args)
+        for batch in batches:
+            for run_id, run_seed in batch:
+                yield runner.run(run_id, run_seed)
+        return
+
+    with ProcessPoolExecutor(max_workers, initializer=init_worker, initargs=args) as pool:
+        futures = [pool.submit(run_batch, batch) for batch in batches]
+        for future in as_completed(futures):
+            for result in future.result():
+                yield result
+
+def run_single(run_id: int, seed: int=0, inputs: dict=None, num_steps: int=336,
+               model: str='model.microgrid', graph: str='mg',
+               search_depth: int=100000, stop_condition=None)-> dict:
+    """Reproduces a single run of a study, returning its metrics."""
+    inputs = MC_INPUTS if inputs is None else inputs
+    runner = ScenarioRunner(model, graph, inputs, num_steps, search_depth,
+                            stop_condition)
+    return runner.run(run_id, seed)[2]
+
+def summarize_monte_carlo(num_runs: int, inputs: dict=None, summary_file: str=None,
+                          num_steps: int=336, seed: int=0, max_workers: int=None,
+                          batch_size: int=64, model: str='model.microgrid',
+                          graph: str='mg', search_depth: int=100000,
+                          stop_condition=None)-> dict:
+    """Runs a Monte Carlo study, returning only the summary of its metrics
+    (as given by ``summarize_results``). Each worker summarizes its own
+    batches of runs, which are merged as they are returned, so neither 
+    the trajectories nor the metrics of each run are held. The summary
+    is written to a CSV file if given. If ``max_workers`` is 0, the runs
+    are simulated in this process.
+    """
+    inputs = MC_INPUTS if inputs is None else inputs
+    batches = make_batches(num_runs, seed, batch_size)
+    args = (model, graph, inputs, num_steps, search_depth, stop_condition)
+    summary = RunningSummary()
+
+    if max_workers == 0:
+        runner = ScenarioRunner(*args)
+        for batch in batches:
+            summary.merge(summarize_batch(batch, runner))
+    else:
+        with ProcessPoolExecutor(max_workers, initializer=init_worker, initargs=args) as pool:
+            futures = [pool.submit(summarize_batch, batch) for batch in batches]
+            for future in futures:
+                summary.merge(future.result())
+
+    summary = summary.result()
+    if summary_file is not None:
+        write_summary_csv(summary, summary_file)
+    return summary
+
+def is_precise(summary: RunningSummary, targets: list, rel_precision: float,
+               confidence: float=0.95)-> bool:
+    """Returns true if the confidence interval of the mean of each target
+    metric is within ``rel_precision`` of the mean. A target that has had
+    the same value in every run (such as a rare outage not yet seen) is
+    not precise, as its variance is not yet known."""
+    half_widths = summary.get_half_widths(confidence)
+    return all(summary.m2[col] > 0 and 
+               half_widths[col] <= rel_precision * abs(summary.mean[col])
+               for col in targets)
+
+def run_adaptive_monte_carlo(inputs: dict=None, targets: list=None, 
+                             rel_precision: float=0.05, confidence: float=0.95,
+                             min_runs: int=16, max_runs: int=10000, 
+                             max_time: float=None, summary_file: str=None,
+                             num_steps: int=336, seed: int=0, 
+                             max_workers: int=None, batch_size: int=8,
+                             model: str='model.microgrid', graph: str='mg',
+                             search_depth: int=100000, stop_condition=None)-> tuple:
+    """Runs a Monte Carlo study in batches until the mean of each target
+    metric is known to within a relative precision, returning the summary
+    of the study and whether the precision was reached.
+
+    Parameters
+    ----------
+    inputs : dict, optional
+        The inputs of each run, by default ``MC_INPUTS``.
+    targets : list, optional
+        The metrics (columns) that must reach the precision, by default
+        the mission impact (``MI``). Runs continue while a target has had
+        the same value in every run (see ``is_precise``).
+    rel_precision : float, default=0.05
+        Largest half width of the confidence interval of the mean of each
+        target, relative to the mean.
+    confidence : float, default=0.95
+        Confidence level of the intervals.
+    min_runs : int, default=16
+        Runs made before the precision is first checked.
+    max_runs : int, default=10000
+        Budget of runs, after which the study stops regardless.
+    max_time : float, optional
+        Budget of seconds, after which no more batches are started.
+    summary_file : str, optional
+        CSV file the summary is written to.
+    **kwargs
+        The remaining arguments are as for ``summarize_monte_carlo``.
+
+    Notes
+    -----
+    Batches are merged in the order of their runs, so that a study stops
+    after the same runs (and gives the same summary) no matter the number
+    of workers. The summary has an extra ``ci`` row with the half width
+    of the confidence interval of the mean of each metric.
+    """
+    inputs = MC_INPUTS if inputs is None else inputs
+    targets = ['MI'] if targets is None else targets
+    args = (model, graph, inputs, num_steps, search_depth, stop_condition)
+    summary = RunningSummary()
+    start = time.perf_counter()
+
+    def next_batch(num_started):
+        run_ids = range(num_started, min(num_started + batch_size, max_runs))
+        return [(run_id, seed) for run_id in run_ids]
+
+    def is_done():
+        if summary.size >= max_runs:
+            return True
+        if max_time is not None and time.perf_counter() - start >= max_time:
+            return True
+        return summary.size >= min_runs and is_precise(summary, targets, rel_precision,
+                                                       confidence)
+
+    if max_workers == 0:
+        runner = ScenarioRunner(*args)
+        while not is_done():
+            summary.merge(summarize_batch(next_batch(summary.size), runner))
+    else:
+        with ProcessPoolExecutor(max_workers, initializer=init_worker, initargs=args) as pool:
+            num_ahead = 2 * (max_workers or os.cpu_count() or 1)
+            pending, num_started = deque(), 0
+            while not is_done():
+                while len(pending) < num_ahead and num_started < max_runs:
+                    batch = next_batch(num_started)
+                    pending.append(pool.submit(summarize_batch, batch))
+                    num_started += len(batch)
+                summary.merge(pending.popleft().result())
+            for future in pending:
+                future.cancel()
+
+    precise = summary.size > 0 and is_precise(summary, targets, rel_precision, confidence)
+    half_widths = summary.get_half_widths(confidence)
+    summary = summary.result()
+    summary['ci'] = half_widths
+    if summary_file is not None:
+        write_summary_csv(summary, summary_file)
+    return summary, precise
+
+def summarize_results(results: list)-> dict:
+    """Returns the mean, max, min, population standard deviation and size
+    of each metric {stat : {column : float}} over the metrics of each run."""
+    summary = RunningSummary()
+    for metrics in results:
+        summary.update(metrics)
+    return summary.result()
+
+def write_results_csv(results: list, filename: str):
+    """Writes the metrics of each run to a CSV file."""
+    with open(filename, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+def write_summary_csv(summary: dict, filename: str):
+    """Writes the summary of a study to a CSV file, with a row for each
+    statistic."""
+    columns = list(summary['mean'])
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Row'] + columns)
+        for stat, row in summary.items():
+            writer.writerow([stat] + [row[col] for col in columns])
+
+def run_monte_carlo(num_runs: int, inputs: dict=None, results_file: str=None,
+                    summary_file: str=None, **kwargs)-> tuple:
+    """Runs a Monte Carlo study, returning the metrics of each run (in
+    order of the runs) and their summary. The results and summary are
+    written to CSV files if given. Keyword arguments are passed to
+    ``iter_monte_carlo``."""
+    results = [None] * num_runs
+    for run_id, seed, metrics in iter_monte_carlo(num_runs, inputs, **kwargs):
+        results[run_id] = metrics
+    summary = summarize_results(results)
+    if results_file is not None:
+        write_results_csv(results, results_file)
+    if summary_file is not None:
+        write_summary_csv(summary, summary_file)
+    return results, summary
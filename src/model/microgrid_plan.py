@@ -0,0 +1,532 @@
+"""Compiled step plans for simulating a microgrid hypergraph.
+
+Solving a hypergraph with ``Hypergraph.solve`` searches for a path to the
+target for every index, even though the structure of a time step does
+not change between steps. A ``StepPlan`` is compiled by solving the
+hypergraph once for a few steps and walking the solution tree, from
+which the edges used to calculate each node at each index are found.
+
+The solution is split into two parts:
+
+1. **Setup:** every node calculated before the steps of the simulation
+   start repeating, with each source node referenced by absolute index.
+2. **Step:** the nodes calculated for each index once the steps repeat,
+   with each source node referenced either as a static node (calculated
+   once in the setup) or by its lag behind the current index (such as
+   the ``index_offset`` cycles for time, charge level, fuel level and
+   refuel hour).
+
+The plan is then executed as a simple loop over the step, calling the
+relation of each edge directly. The ``verify`` method compares the
+results of a plan against ``Hypergraph.solve``.
+
+The plan is only valid for inputs that take the same paths through the
+hypergraph as the inputs it was compiled with. If the ``via`` condition
+of every edge found for a node fails, a ``ValueError`` is raised.
+"""
+from collections import defaultdict
+import heapq
+import random
+from inspect import signature
+import numpy as np
+import constrainthg as chg
+from constrainthg.hypergraph import Edge, EdgeProperty
+
+class PlanEntry:
+    """The calculation of a node in a plan from one or more candidate
+    edges, each of which has references to the nodes of its sources."""
+    def __init__(self, label: str, index: int=None):
+        self.label = label
+        self.index = index
+        self.candidates = []
+        self.is_optional = False
+
+    def add_candidate(self, edge: Edge, refs: tuple):
+        """Adds an edge (with the references to its source values) as a
+        way of calculating the node, if not already added."""
+        for c_edge, c_refs, *_ in self.candidates:
+            if c_edge is edge and c_refs == refs:
+                return
+        call, needs_index = make_edge_call(edge, [ref[0] for ref in refs])
+        self.candidates.append((edge, refs, call, needs_index))
+
+    def get_dependencies(self)-> set:
+        """Returns the references of each candidate edge."""
+        return {ref[1:] for c in self.candidates for ref in c[1]}
+
+class StepPlan:
+    """A fixed-order execution plan for the given targets of a
+    hypergraph, compiled from the solution of ``Hypergraph.solve``.
+
+    Parameters
+    ----------
+    hg : Hypergraph
+        The hypergraph to compile the plan for.
+    targets : list
+        The nodes (or labels) of each target. Every node that the
+        targets depend on is included in the plan.
+    inputs : dict, optional
+        The inputs {node | label : value} to compile the plan with.
+    trace_index : int, default=6
+        The index of each target to solve for when compiling, which must
+        be at least two steps past the point at which steps repeat.
+    search_depth : int, default=100000
+        Search depth passed to ``Hypergraph.solve``.
+    """
+    def __init__(self, hg: chg.Hypergraph, targets: list, inputs: dict=None,
+                 trace_index: int=6, search_depth: int=100000):
+        self.hg = hg
+        self.targets = [hg.get_node(t).label for t in targets]
+        self.input_labels = set(get_labeled_inputs(hg, inputs))
+        self.source_labels = set()
+        self.static_labels = set()
+        self.setup = []
+        self.step = []
+        self.start_index = 2
+        self.max_lag = 1
+        self.carry_labels = {}
+        self.compile(inputs, trace_index, search_depth)
+
+    ## Compiling
+    def compile(self, inputs: dict, trace_index: int, search_depth: int):
+        """Solves the hypergraph for each target and compiles the
+        solutions into the setup and step entries of the plan. Targets
+        found in the solution of an earlier target are not solved for."""
+        traces, found = [], set()
+        for target in self.targets:
+            if target in found:
+                continue
+            t = self.hg.solve(target, inputs=inputs, min_index=trace_index,
+                              search_depth=search_depth)
+            if t is None:
+                raise ValueError(f'No solution found for {target} when compiling plan')
+            traces.append(get_trace(t))
+            found.update(tnode.node_label for tnode in traces[-1])
+
+        for trace in traces:
+            for t in trace:
+                if is_source_tnode(t):
+                    self.source_labels.add(t.node_label)
+        dynamic_labels = {t.node_label for trace in traces for t in trace
+                          if t.index > 1}
+        self.static_labels = {t.node_label for trace in traces for t in trace
+                              if t.node_label not in dynamic_labels}
+
+        steps = [self.find_step(trace) for trace in traces]
+        self.start_index = max([2] + [start for start, step in steps 
+                                      if start is not None])
+        self.make_setup(traces, steps)
+        self.make_step(steps)
+
+    def get_step_refs(self, t)-> tuple:
+        """Returns the references of each source of a TNode relative to
+        its index, as ``(key, label, lag)`` where lag is None for static
+        nodes."""
+        edge = self.get_edge(t)
+        refs = []
+        for key, child in zip(get_source_keys(edge, t.children), t.children):
+            lag = None if child.node_label in self.static_labels else t.index - child.index
+            refs.append((key, child.node_label, lag))
+        return tuple(refs)
+
+    def find_step(self, trace: list)-> tuple:
+        """Returns the first index at which the trace repeats, along with
+        the edge and source references {label : (edge, refs)} for each
+        node in the repeated step.
+
+        The last indices of a trace may only hold the nodes needed for 
+        the target (such as a target outside of any cycle), which are
+        added to the step as well. The start is None if every node in 
+        the trace is static.
+        """
+        templates = defaultdict(dict)
+        for t in trace:
+            if not is_source_tnode(t) and t.node_label not in self.static_labels:
+                templates[t.index][t.node_label] = (self.get_edge(t), self.get_step_refs(t))
+
+        indices = sorted(i for i in templates if i > 1)
+        if len(indices) == 0:
+            return None, {}
+        for start in indices:
+            if len(templates[start]) > 0 and templates[start] == templates.get(start + 1):
+                break
+        else:
+            msg = 'Steps do not repeat in the trace, increase the trace '
+            msg += 'index to compile the plan'
+            raise ValueError(msg)
+
+        step = dict(templates[start])
+        for index in indices:
+            if index <= start + 1:
+                continue
+            for label, calc in templates[index].items():
+                if step.setdefault(label, calc) != calc:
+                    raise ValueError(f'{label} is not calculated the same way each step')
+        return start, step
+
+    def make_setup(self, traces: list, steps: list):
+        """Compiles the entries for each node calculated before the
+        start index, referenced by absolute index.
+
+        Nodes calculated before the step of a trace repeats are taken 
+        from the trace, while those after are translated from the step.
+        Nodes only found at the end of a trace are calculated for each
+        earlier index where their sources are available.
+        """
+        entries = {}
+        for trace, (start, step) in zip(traces, steps):
+            limit = self.start_index if start is None else min(start, self.start_index)
+            for t in trace:
+                if is_source_tnode(t) or t.index >= limit:
+                    continue
+                key = (t.node_label, t.index)
+                entry = entries.setdefault(key, PlanEntry(*key))
+                edge = self.get_edge(t)
+                refs = tuple((k, c.node_label, c.index) for k, c in
+                             zip(get_source_keys(edge, t.children), t.children))
+                entry.add_candidate(edge, refs)
+
+        for start, step in steps:
+            if start is None:
+                continue
+            for index in range(1, self.start_index):
+                for label, (edge, refs) in step.items():
+                    key = (label, index)
+                    if key in entries and index < start:
+                        continue
+                    abs_refs = tuple((k, l, 1 if lag is None else index - lag)
+                                     for k, l, lag in refs)
+                    if any(ref[2] < 1 for ref in abs_refs):
+                        continue
+                    entry = entries.setdefault(key, PlanEntry(*key))
+                    entry.is_optional = index < start
+                    entry.add_candidate(edge, abs_refs)
+
+        known = {(label, 1) for label in self.source_labels}
+        self.setup = sort_entries(entries, known)
+
+    def make_step(self, steps: list):
+        """Compiles the entries for each node calculated at an index past
+        the start index, referenced by lag. The labels of the nodes each
+        step takes from previous indices are kept by lag in 
+        ``carry_labels``."""
+        entries, carry_labels = {}, defaultdict(set)
+        for start, step in steps:
+            for label, (edge, refs) in step.items():
+                entry = entries.setdefault(label, PlanEntry(label))
+                entry.add_candidate(edge, refs)
+                for key, ref_label, lag in refs:
+                    if lag is not None and lag > 0:
+                        carry_labels[lag].add(ref_label)
+        self.carry_labels = dict(carry_labels)
+        self.max_lag = max([1] + list(carry_labels))
+
+        lags = range(1, self.max_lag + 1)
+        known = {(label, None) for label in self.static_labels}
+        known |= {(label, lag) for label in entries for lag in lags}
+        known |= {(label, lag) for label in self.source_labels for lag in lags}
+        self.step = sort_entries({(label, 0): e for label, e in entries.items()}, known)
+
+    def get_edge(self, t)-> Edge:
+        """Returns the edge that generated the TNode."""
+        edge_label = t.gen_edge_label.rsplit('#', 1)[0]
+        return self.hg.edges[edge_label]
+
+    ## Execution
+    def get_source_values(self, inputs: dict=None)-> dict:
+        """Returns the value of each source node, taken from the inputs
+        or the static value of the node."""
+        inputs = get_labeled_inputs(self.hg, inputs)
+        if set(inputs) != self.input_labels:
+            msg = f'Plan was compiled with inputs {sorted(self.input_labels)}, '
+            msg += f'not {sorted(inputs)}'
+            raise ValueError(msg)
+        values = {}
+        for label in self.source_labels:
+            if label in inputs:
+                values[label] = inputs[label]
+            else:
+                values[label] = self.hg.nodes[label].static_value
+        return values
+
+    def run_setup(self, inputs: dict=None)-> tuple:
+        """Calculates the setup of the plan, returning the value of each
+        static node {label : Any} and the values of the dynamic nodes for
+        each index before the start index {index : {label : Any}}."""
+        values = {(label, 1): val for label, val in self.get_source_values(inputs).items()}
+        for entry in self.setup:
+            values[(entry.label, entry.index)] = evaluate_entry(
+                entry, lambda label, index : values[(label, index)],
+                lambda label, index : index)
+
+        static = {label: values[(label, 1)] for label in self.static_labels}
+        frames = defaultdict(dict)
+        for (label, index), val in values.items():
+            if label not in self.static_labels:
+                frames[index][label] = val
+        return static, frames
+
+    def iter_steps(self, inputs: dict=None, setup: tuple=None, resume: tuple=None):
+        """Yields ``(index, values)`` for each index of the simulation,
+        starting at 1, where ``values`` is a dict of the value of each
+        dynamic node calculated for that index. Only the values of the
+        last ``max_lag`` indices are held between steps.
+
+        The static nodes can be found by calling ``run_setup`` and 
+        passing its result as ``setup``, otherwise the setup is run from
+        the inputs. A simulation is continued by passing ``resume`` as 
+        ``(index, frames)``, where ``index`` is the next index to 
+        calculate and ``frames`` holds the values {index : {label : Any}} 
+        of each node in ``carry_labels`` for the indices before it."""
+        static, frames = self.run_setup(inputs) if setup is None else setup
+        if resume is None:
+            for index in range(1, self.start_index):
+                yield index, frames[index]
+            index = self.start_index
+        else:
+            index, frames = resume
+            if index < self.start_index:
+                raise ValueError(f'Unable to resume before index {self.start_index}')
+
+        lagged = [None] + [frames.get(index - lag, {})
+                           for lag in range(1, self.max_lag + 1)]
+        get_value = lambda label, lag : static[label] if lag is None else lagged[lag][label]
+        while True:
+            get_index = lambda label, lag : 1 if lag is None else index - lag
+            lagged[0] = {}
+            for entry in self.step:
+                lagged[0][entry.label] = evaluate_entry(entry, get_value, get_index)
+            yield index, lagged[0]
+            lagged.insert(0, None)
+            lagged.pop()
+            index += 1
+
+    def run(self, inputs: dict=None, min_index: int=1)-> dict:
+        """Runs the plan up to ``min_index``, returning a dict of the
+        value of each target at each index {label : [Any,]}, starting
+        from index 1 (with None for indices the target is not found)."""
+        out = {label: [] for label in self.targets}
+        static, frames = self.run_setup(inputs)
+        for index, frame in self.iter_steps(inputs, (static, frames)):
+            for label in self.targets:
+                out[label].append(static[label] if label in static else frame.get(label, None))
+            if index >= min_index:
+                break
+        return out
+
+    def verify(self, inputs: dict=None, min_index: int=10,
+               search_depth: int=100000, seed: int=None)-> list:
+        """Compares the values of each target found by the plan against
+        those found by ``Hypergraph.solve``, returning a list of
+        ``(label, index, plan_value, solve_value)`` for each mismatch.
+
+        Every index is compared for targets in a cycle, while only the 
+        last index is compared for other targets (as ``solve`` only 
+        returns the last value). Stochastic relations are seeded 
+        identically for both by passing a ``seed`` for the ``random``
+        module (random generators given in the inputs are also reset to
+        their starting state), though ``solve`` may draw random values for
+        edges that are not part of its solution, so only deterministic 
+        inputs are expected to match exactly."""
+        rngs = [val for val in get_labeled_inputs(self.hg, inputs).values()
+                if isinstance(val, np.random.Generator)]
+        rng_states = [rng.bit_generator.state for rng in rngs]
+        def reset():
+            if seed is not None:
+                random.seed(seed)
+            for rng, state in zip(rngs, rng_states):
+                rng.bit_generator.state = state
+
+        mismatches = []
+        for label in self.targets:
+            reset()
+            index = 0 if label in self.static_labels else min_index
+            t = self.hg.solve(label, inputs=inputs, min_index=index,
+                              search_depth=search_depth)
+            reset()
+            plan_values = self.run(inputs, t.index)[label]
+            solve_values = t.values[label]
+            if len(solve_values) != t.index:
+                solve_values = [None] * (t.index - 1) + [t.value]
+            for i, (pv, sv) in enumerate(zip(plan_values, solve_values)):
+                if sv is not None and not values_equal(pv, sv):
+                    mismatches.append((label, i + 1, pv, sv))
+        return mismatches
+
+
+## Helpers
+def get_labeled_inputs(hg: chg.Hypergraph, inputs: dict=None)-> dict:
+    """Returns the inputs keyed by node label. Inputs not found in the
+    hypergraph are kept under their key, as ``Hypergraph.solve`` inserts
+    them as new nodes."""
+    if inputs is None:
+        return {}
+    labeled = {}
+    for key, val in inputs.items():
+        try:
+            labeled[hg.get_node(key).label] = val
+        except KeyError:
+            labeled[key] = val
+    return labeled
+
+def get_trace(t)-> list:
+    """Returns every TNode in the solution tree, in the order they were
+    found (children before parents)."""
+    found, stack = {}, [t]
+    while len(stack) > 0:
+        tnode = stack.pop()
+        if id(tnode) in found:
+            continue
+        found[id(tnode)] = tnode
+        stack.extend(tnode.children)
+    return sorted(found.values(), key=get_tnode_counter)
+
+def get_tnode_counter(t)-> int:
+    """Returns the search counter when the TNode was made."""
+    return int(t.label.rsplit('#', 1)[1])
+
+def is_source_tnode(t)-> bool:
+    """Returns true if the TNode is the value of a source node."""
+    return t.gen_edge_label is None
+
+def get_source_keys(edge: Edge, children: list)-> list:
+    """Returns the key in the edge of each of the children, matching the
+    first source node with the label of the child."""
+    keys = []
+    for child in children:
+        for key, sn in edge.source_nodes.items():
+            if not isinstance(sn, tuple) and sn.label == child.node_label:
+                keys.append(key)
+                break
+        else:
+            raise ValueError(f'{child.node_label} is not a source of {edge.label}')
+    return keys
+
+def sort_entries(entries: dict, known: set)-> list:
+    """Orders the entries so that each is evaluated after the entries
+    it depends on, otherwise keeping the order of ``entries`` (which for
+    a trace is the order ``solve`` calculated them in). ``entries`` is 
+    keyed by the reference to each entry, and ``known`` is the set of 
+    references that are already available. Optional entries whose 
+    sources are unavailable are dropped."""
+    keys = list(entries)
+    waiting_on, dependents = {}, defaultdict(list)
+    for pos, key in enumerate(keys):
+        deps = {dep for dep in entries[key].get_dependencies() if dep not in known}
+        waiting_on[pos] = len(deps)
+        for dep in deps:
+            dependents[dep].append(pos)
+
+    ready = [pos for pos, count in waiting_on.items() if count == 0]
+    heapq.heapify(ready)
+    ordered = []
+    while len(ready) > 0:
+        pos = heapq.heappop(ready)
+        ordered.append(entries[keys[pos]])
+        for dependent in dependents[keys[pos]]:
+            waiting_on[dependent] -= 1
+            if waiting_on[dependent] == 0:
+                heapq.heappush(ready, dependent)
+
+    unresolved = [entries[keys[pos]] for pos, count in waiting_on.items() 
+                  if count > 0 and not entries[keys[pos]].is_optional]
+    if len(unresolved) > 0:
+        missing = {dep for e in unresolved for dep in e.get_dependencies()
+                   if dep not in known and dep not in entries}
+        raise ValueError(f'Unable to order plan, unresolved sources: {missing}')
+    return ordered
+
+def evaluate_entry(entry: PlanEntry, get_value, get_index):
+    """Calculates the value of the entry from the first candidate edge
+    that is viable and returns a value."""
+    for edge, refs, call, needs_index in entry.candidates:
+        vals = [get_value(label, ref) for key, label, ref in refs]
+        idxs = [get_index(label, ref) for key, label, ref in refs] if needs_index else None
+        val = call(vals, idxs)
+        if val is not None:
+            return val
+    msg = f'No viable edge found for {entry.label}, inputs may take a path '
+    msg += 'not seen when the plan was compiled'
+    raise ValueError(msg)
+
+def make_edge_call(edge: Edge, keys: list)-> tuple:
+    """Returns a function calculating the value of the edge from a list
+    of source values (and their indices) ordered the same as ``keys``, 
+    returning None if the via condition of the edge is false. Also 
+    returns whether the function needs the indices of the values.
+
+    Edges made with the LEVEL property call their original relation
+    directly, as the level condition is met by the plan.
+    """
+    if EdgeProperty.LEVEL in edge.edge_props:
+        og_keys = [k for k in keys if k in edge.og_source_nodes]
+        positions = [keys.index(k) for k in og_keys]
+        og_rel = edge.og_rel
+        og_via = None
+        if edge.og_via is not Edge.via_true:
+            og_via = make_caller(edge.og_via, og_keys)
+        def call(vals, idxs):
+            og_vals = [vals[p] for p in positions]
+            if og_via is not None and not og_via(og_vals):
+                return None
+            return og_rel(**dict(zip(og_keys, og_vals)))
+        return call, False
+
+    pseudo = [(k, keys.index(sn[0]), sn[1]) for k, sn in edge.source_nodes.items() 
+              if isinstance(sn, tuple)]
+    needs_index = len(pseudo) > 0
+    if any(attr != 'index' for k, p, attr in pseudo):
+        raise ValueError(f'Unsupported pseudo node in {edge.label}')
+    all_keys = [k for k, p, attr in pseudo] + keys
+    rel = make_caller(edge.rel, all_keys)
+    via = None if edge.via is Edge.via_true else make_caller(edge.via, all_keys)
+    def call(vals, idxs):
+        if needs_index:
+            vals = [idxs[p] for k, p, attr in pseudo] + vals
+        if via is not None and not via(vals):
+            return None
+        return rel(vals)
+    return call, needs_index
+
+def make_caller(method, keys: list):
+    """Returns a function that calls the method with a list of values
+    ordered the same as ``keys``, binding each value to the method's
+    parameters the same way as ``Edge.filtered_call``."""
+    arg_pos, kwarg_pos, used = [], [], set()
+    has_var_args, has_var_kwargs = False, False
+    for p in signature(method).parameters.values():
+        if p.name in keys:
+            if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD):
+                arg_pos.append(keys.index(p.name))
+            elif p.kind == p.KEYWORD_ONLY:
+                kwarg_pos.append((p.name, keys.index(p.name)))
+            used.add(p.name)
+        elif p.kind == p.VAR_POSITIONAL:
+            has_var_args = True
+        elif p.kind == p.VAR_KEYWORD:
+            has_var_kwargs = True
+
+    remaining = [(k, i) for i, k in enumerate(keys) if k not in used]
+    if has_var_kwargs:
+        kwarg_pos.extend(remaining)
+    elif has_var_args:
+        arg_pos.extend(i for k, i in remaining)
+
+    if len(kwarg_pos) == 0:
+        return lambda vals : method(*[vals[i] for i in arg_pos])
+    return lambda vals : method(*[vals[i] for i in arg_pos],
+                                **{k: vals[i] for k, i in kwarg_pos})
+
+def values_equal(a, b)-> bool:
+    """Returns true if the two values are identical, treating NaN as
+    equal to NaN."""
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return np.array_equal(np.asarray(a), np.asarray(b), equal_nan=True)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(values_equal(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) and isinstance(b, float) and a != a and b != b:
+        return True
+    try:
+        return bool(a == b)
+    except ValueError:
+        return False
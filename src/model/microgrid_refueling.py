@@ -0,0 +1,118 @@
+"""Presampled refueling schedule of the generators of the microgrid.
+
+The generators are refueled at random times, where each refueling is a
+number of whole days after the last (the day of each refueling being
+reached with a probability of ``prob of daily refueling``) plus a random
+hour, as sampled one refueling at a time by
+``Rcalc_next_time_for_refueling``. The times only depend on the previous
+refueling, so the gaps between a block of refuelings are sampled up
+front in a single vectorized draw and summed into a sorted array of
+refuel hours. The hypergraph then only has to find the refueling after
+the last with a binary search.
+
+The schedule is extended a block at a time as later refuelings are
+requested, from its own generator, so the refuel hours do not depend on
+when they were requested. A schedule can be passed to other simulations
+as the ``refuel_schedule`` input to reuse the same refuelings.
+
+The refuelings before a given hour (such as the start of a run) can be
+sampled from a separate ``nominal_prob``, so that importance sampling 
+only tilts, and weighs, the refuelings during the run.
+"""
+import numpy as np
+
+class RefuelSchedule:
+    """Sorted array of the hours (of the simulation clock) generators are
+    refueled at, which is extended automatically if a later hour is
+    requested.
+
+    Parameters
+    ----------
+    prob : float
+        Probability of refueling on each day.
+    hours_in_day : int
+        Number of hours in a day.
+    rng : np.random.Generator
+        Generator the schedule is sampled from.
+    start : int, default=0
+        The hour the schedule starts from (the first refueling is after
+        this hour).
+    block_size : int, default=512
+        Number of refuelings sampled each time the schedule is extended.
+    nominal_prob : float, optional
+        Probability of refueling on each day for the gaps that start 
+        before ``nominal_until``, if different from ``prob``.
+    nominal_until : int, default=0
+        The hour before which gaps are sampled with ``nominal_prob``.
+    """
+    def __init__(self, prob: float, hours_in_day: int, rng: np.random.Generator,
+                 start: int=0, block_size: int=512, nominal_prob: float=None,
+                 nominal_until: int=0):
+        for p in (prob, prob if nominal_prob is None else nominal_prob):
+            if not 0. < p <= 1.:
+                raise ValueError(f'Probability of refueling must be in (0, 1], not {p}')
+        self.prob = float(prob)
+        self.nominal_prob = self.prob if nominal_prob is None else float(nominal_prob)
+        self.nominal_until = int(nominal_until)
+        self.num_nominal = 0
+        self.hours_in_day = int(hours_in_day)
+        self.rng = rng
+        self.start = int(start)
+        self.block_size = max(1, int(block_size))
+        self.hours = np.zeros(0, dtype=np.int64)
+        self.days = np.zeros(0, dtype=np.int64)
+        self.num_used = 0
+        self.extend()
+
+    def __len__(self):
+        return len(self.hours)
+
+    def extend(self):
+        """Samples the next block of refuelings. If the block starts 
+        before ``nominal_until``, only the gaps starting before it are
+        kept, sampled with ``nominal_prob``."""
+        last = self.hours[-1] if len(self) > 0 else self.start
+        is_nominal = last < self.nominal_until
+        prob = self.nominal_prob if is_nominal else self.prob
+        days, hours = sample_refuel_gaps(prob, self.block_size, self.rng, 
+                                         self.hours_in_day)
+        refuel_hours = last + np.cumsum(days * self.hours_in_day + hours)
+        if is_nominal:
+            num_kept = 1 + int(np.searchsorted(refuel_hours[:-1], self.nominal_until))
+            days, refuel_hours = days[:num_kept], refuel_hours[:num_kept]
+            self.num_nominal += num_kept
+        self.hours = np.concatenate((self.hours, refuel_hours))
+        self.days = np.concatenate((self.days, days))
+
+    def get_next(self, hour: int)-> int:
+        """Returns the first refuel hour after the hour."""
+        while self.hours[-1] <= hour:
+            self.extend()
+        i = int(np.searchsorted(self.hours, hour, side='right'))
+        self.num_used = max(self.num_used, i + 1)
+        return int(self.hours[i])
+
+    def log_likelihood_ratio(self, prob: float)-> float:
+        """Returns the log of the likelihood of the refuelings returned so
+        far under a daily probability of ``prob``, relative to their 
+        likelihood under the probability they were sampled with. The 
+        random hour of each refueling is equally likely under both. 
+        Refuelings sampled with ``nominal_prob`` are not weighed."""
+        days = self.days[self.num_nominal:max(self.num_nominal, self.num_used)]
+        return float(log_geometric(days, prob).sum() - log_geometric(days, self.prob).sum())
+
+def sample_refuel_gaps(prob: float, num_gaps: int, rng: np.random.Generator,
+                       hours_in_day: int)-> tuple:
+    """Returns the gaps between each of ``num_gaps`` consecutive 
+    refuelings, as the number of days until the day of refueling and a 
+    random hour of the day."""
+    days = rng.geometric(prob, num_gaps) - 1
+    hours = rng.integers(0, hours_in_day, num_gaps)
+    return days, hours
+
+def log_geometric(days: np.ndarray, prob: float)-> np.ndarray:
+    """Returns the log probability of waiting each number of days before
+    an event with a daily probability of ``prob``."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_wait = np.where(days > 0, days * np.log1p(-prob), 0.)
+    return log_wait + np.log(prob)
@@ -1,21 +1,17 @@
 import constrainthg.relations as R
-import random
-import csv
 import numpy as np
 import logging
 
 from model.microgrid_actors import *
+from model.microgrid_data import DATA_REGISTRY
+from model.microgrid_calendar import Calendar, CALENDAR_FIELDS
+from model.microgrid_failures import FailureTrajectories
+from model.microgrid_refueling import RefuelSchedule
+from model.microgrid_topology import TOPOLOGY_CACHE, get_circuits
 
 #TODO: We shouldn't be passing information by node IDs, this should be implemented with tuples
 KEY_SEP = '¦&¦' #A unique constant for seperating strings in paired keywordss
 
-def generate_connectivity_keyword(OBJ_to, OBJ_from):
-    """Generates a keyword for referencing the cell connecting OBJ_from 
-    to OBJ_to."""
-    name_to, name_from = [str(OBJ) for OBJ in (OBJ_to, OBJ_from)]
-    keyword = f'{name_to}{KEY_SEP}{name_from}'
-    return keyword
-
 def generate_building_keyword(building: GridActor, keyword: str):
     """Generates a keyword for referencing the value of the building."""
     key = f'{keyword}{KEY_SEP}{str(building)}'
@@ -23,19 +19,33 @@ def generate_building_keyword(building: GridActor, keyword: str):
 
 
 ## Simulation
-def Rget_random_year(min_year: int, max_year: int, **kwargs):
+def make_rng(seed: int=None, run: int=None)-> np.random.Generator:
+    """Returns a random number generator for a simulation. Generators for
+    the runs of a study are spawned from the seed of the study, so that 
+    each run can be reproduced on its own."""
+    spawn_key = () if run is None else (run,)
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=spawn_key))
+
+def as_value(value):
+    """Returns a result that may be an array of scenarios, where a single
+    value is returned as a Python float."""
+    if np.ndim(value) == 0:
+        return float(value)
+    return value
+
+def Rget_random_year(min_year: int, max_year: int, rng: np.random.Generator, **kwargs):
     """Returns a random year from the maximum range."""
-    rand_year = random.randint(int(min_year), int(max_year))
+    rand_year = int(rng.integers(int(min_year), int(max_year) + 1))
     return rand_year
 
-def Rget_random_day(days_in_year: int, **kwargs)-> int:
+def Rget_random_day(days_in_year: int, rng: np.random.Generator, **kwargs)-> int:
     """Returns a random int for a day (1-365)."""
-    rand_day = random.randint(1, days_in_year)
+    rand_day = int(rng.integers(1, days_in_year + 1))
     return rand_day
 
-def Rget_random_hour(hours_in_day: int, **kwargs)-> int:
+def Rget_random_hour(hours_in_day: int, rng: np.random.Generator, **kwargs)-> int:
     """Returns a random int for an hour (0-23)."""
-    rand_hour = random.randint(0, hours_in_day-1)
+    rand_hour = int(rng.integers(0, hours_in_day))
     return rand_hour
 
 def Rcalc_year(elapsed_hours: int, num_leapyears: int, start_year: int, 
@@ -89,6 +99,23 @@ def Rcalc_year_is_leapyear(year: int, **kwargs)-> bool:
     is_leapyear = year % 4 == 0
     return is_leapyear
 
+def Rmake_calendar(start_year: int, start_day: int, start_hour: int, 
+                   horizon: int, hours_in_day: int, hours_in_year: int, 
+                   hours_in_leapyear: int, **kwargs)-> Calendar:
+    """Precomputes the year, day, hour, etc. for each elapsed hour of the 
+    simulation."""
+    calendar = Calendar(start_year, start_day, start_hour, horizon, 
+                        hours_in_day, hours_in_year, hours_in_leapyear)
+    return calendar
+
+def make_calendar_relation(field: str):
+    """Returns a relation looking up the given field of the calendar at 
+    the elapsed hour."""
+    def Rget_calendar_value(calendar: Calendar, elapsed_hours: int, **kwargs):
+        """Returns the precomputed calendar value at the elapsed hour."""
+        return calendar.get(field, elapsed_hours)
+    return Rget_calendar_value
+
 def Rcalc_elapsed_hours(time: float, seconds_in_hour: int, **kwargs)-> int:
     """Calculates the number of hours that have passed."""
     hours = time // seconds_in_hour
@@ -101,16 +128,22 @@ def Rcalc_elapsed_minutes(time: int, seconds_in_minute: int, **kwargs)-> int:
 
 
 ### Data
-def Rget_data_from_csv_file(filename: str, **kwargs)-> list:
-    """Converts a CSV file to a list of dictionaries."""
-    with open(filename, newline='') as file:
-        reader = csv.DictReader(file)
-        data = [row for row in reader]
+def Rget_data_from_csv_file(filename: str, *args, **kwargs)-> dict:
+    """Returns the shared dict of NumPy column arrays (keyed by column 
+    name) for a CSV file. Any other arguments are the names of the 
+    columns to load, with every column loaded if none are given."""
+    columns = []
+    for col in R.extend(args, kwargs):
+        columns.extend([col] if isinstance(col, str) else col)
+    data = DATA_REGISTRY.get(filename, columns if len(columns) > 0 else None)
     return data
 
 def Rget_float_from_csv_data(csv_data: dict, row, col, **kwargs):
-    """Returns the value in the row and column from the CSV dict reader."""
-    value = float(csv_data[row][col])
+    """Returns the value in the row and column from the columnar CSV data,
+    where rows past the end of the data (such as the last hours of a leap
+    year for data given over 8760 hours) read the last row."""
+    column = csv_data[col]
+    value = float(column[min(row, len(column) - 1)])
     return value
 
 
@@ -121,6 +154,13 @@ def Rsort_names(*args, **kwargs)->list:
     names.sort()
     return names
 
+def Rmake_name_index(names: list, **kwargs)-> dict:
+    """Maps the name of each actor to its index in the ordered names, 
+    which is the actor's row and column in the connectivity matrix and 
+    its position in the state vector."""
+    name_index = {name: i for i, name in enumerate(names)}
+    return name_index
+
 def Rdetermine_load(*args, **kwargs)->float:
     """Determines the amount of energy necessary to run the microgrid.
     
@@ -135,25 +175,46 @@ def Rdetermine_if_connected(is_failing: bool, is_load_shedding: bool, **kwargs)-
     """Determines whether or not the object is connected to the grid."""
     return not (is_failing or is_load_shedding)
 
-def Rcalc_if_receiving_power(receives_from: bool, receiver_conn: bool, 
-                             provider_conn: bool, **kwargs)-> bool:
-    """Determines if the receiver object is receiving power from the 
-    provider object."""
-    return receives_from and receiver_conn and provider_conn
+def Rget_bus_links(name_index: dict, **kwargs)-> list:
+    """Returns the (actor, bus) index pairs for each actor wired to a bus,
+    where each keyword is the name of an actor and each value is the 
+    names of the buses it is wired to."""
+    links = []
+    for name, buses in kwargs.items():
+        if name not in name_index:
+            continue
+        i = name_index[name]
+        links.extend((i, name_index[bus]) for bus in buses 
+                     if name_index[bus] != i)
+    return links
 
-def Rform_connectivity_matrix(names: list, key_sep: str, *args, **kwargs)-> np.ndarray:
+def Rform_connectivity_matrix(name_index: dict, bus_links: list, 
+                              **kwargs)-> np.ndarray:
     """Forms the connectivity (A) matrix where the ij-th cell indicates 
-    power is flowing from object j to object i."""
-    A = np.zeros((len(names), len(names)))
-    for key, val in kwargs.items():
-        if key_sep in key:
-            i,j = [names.index(name) for name in key.split(key_sep)[:2]]
-            A[i][j] = 1 if bool(val) else 0
+    power is flowing from object j to object i.
+
+    Each connected actor is connected to itself, and power flows both 
+    ways between each actor and bus in ``bus_links`` if both are 
+    connected. The keywords are the names of each actor, with the value
+    of whether the actor is connected to the grid.
+    """
+    n = len(name_index)
+    is_conn = np.zeros(n, dtype=bool)
+    for name, val in kwargs.items():
+        if name in name_index:
+            is_conn[name_index[name]] = bool(val)
+
+    A = np.diag(is_conn.astype(float))
+    if len(bus_links) > 0:
+        i, j = np.array(bus_links).T
+        linked = (is_conn[i] & is_conn[j]).astype(float)
+        A[i, j] = linked
+        A[j, i] = linked
     return A
 
-def Rget_state_from_vector(x: np.ndarray, name: str, names: list, **kwargs)-> float:
+def Rget_state_from_vector(x: np.ndarray, name: str, name_index: dict, **kwargs)-> float:
     """Indexes and returns the state of the object in the state matrix."""
-    idx = names.index(name)
+    idx = name_index[name]
     out = x[idx]
     return out
 
@@ -163,12 +224,35 @@ def Rlinear_solve(A: np.ndarray, B: np.ndarray, **kwargs)-> np.ndarray:
     return x
 
 def Rdeterming_if_failing(is_failing: bool, p_fail: float, p_fix: float, 
-                          *args, **kwargs)-> bool:
-    """Returns true if the actor is failing."""
-    p = random.random()
+                          rng: np.random.Generator, *args, **kwargs)-> bool:
+    """Returns true if the actor is failing, where an operating actor 
+    fails with a probability of ``p_fail`` and a failing actor is fixed
+    with a probability of ``p_fix``."""
+    p = rng.random()
     if not is_failing:
-        return p > p_fail
-    return not (p > p_fix)
+        return p < p_fail
+    return not (p < p_fix)
+
+def Rsample_failure_trajectories(names: list, rng: np.random.Generator, 
+                                 failing: list=None, *args, **kwargs)-> FailureTrajectories:
+    """Presamples whether each actor is failing for each step, where 
+    kwargs are of the form ``{prob_failing<name> : float}`` and 
+    ``{prob_fixed<name> : float}``. The trajectories are sampled from a 
+    generator seeded by ``rng``, starting with the actors in ``failing``
+    failing (as given by ``Rget_failing_actors``)."""
+    p_fail = [kwargs.get(f'prob_failing{name}', 0.) for name in names]
+    p_fix = [kwargs.get(f'prob_fixed{name}', 0.) for name in names]
+    failing = [] if failing is None else failing
+    is_failing = [name in failing for name in names]
+    traj_rng = np.random.default_rng(int(rng.integers(2**63)))
+    return FailureTrajectories(names, p_fail, p_fix, is_failing, traj_rng)
+
+def Rget_failure_from_trajectories(trajectories: FailureTrajectories, name: str,
+                                   time: float, time_step: float, 
+                                   *args, **kwargs)-> bool:
+    """Returns true if the actor is failing at the step after ``time``."""
+    step = int(round(time / time_step)) + 1
+    return trajectories.get(name, step)
 
 def Rget_failing_actors(names: list, *args, **kwargs)-> list:
     """Returns a list of actors that are failing, where kwargs are of the 
@@ -211,9 +295,9 @@ def Rcalc_solar_supply(conn: bool, area: float, efficiency: float,
     """Calculates the power (in kW) produced by a photovoltaic cell over one hour."""
     # if not conn:
     #     return 0.0
-    power = max(0, area * efficiency * sunlight)
+    power = np.maximum(0, area * efficiency * sunlight)
     power = power / 1000
-    return power
+    return as_value(power)
 
 
 ## Wind
@@ -239,10 +323,9 @@ def Rcalc_critical_load(lights: float, equipment: float, **kwargs)-> float:
 def Rdetermine_building_load(conn: bool, normal: float, critical: float, 
                              island: bool, **kwargs)-> float:
     """Determines the load of a building."""
-    if not conn:
-        return 0.0
-    load = critical if island else normal
-    return load
+    load = np.where(island, critical, normal)
+    load = np.where(conn, load, 0.)
+    return as_value(load)
 
 ## Generators
 def Rcalc_generator_demand(is_islanded: bool, load: float, max_out: float, 
@@ -253,23 +336,44 @@ def Rcalc_generator_demand(is_islanded: bool, load: float, max_out: float,
     return max(0., min(abs(load), max_out))
 
 def Rcalc_next_time_for_refueling(refuel_time: int, curr_hour: int, 
-                                  prob: float, hours_in_day: int, **kwargs):
+                                  prob: float, hours_in_day: int, 
+                                  rng: np.random.Generator, **kwargs):
     """Calculates the next time for refueling based on the current time."""
     if refuel_time > curr_hour:
         return refuel_time
     days_until_refuel = 0
-    while prob < random.random(): 
+    while prob < rng.random(): 
         days_until_refuel += 1
-    hours_until_refuel = random.randint(0, hours_in_day-1)
+    hours_until_refuel = int(rng.integers(0, hours_in_day))
     next_time = refuel_time + days_until_refuel * hours_in_day + hours_until_refuel
     return next_time
 
+def Rsample_refuel_schedule(prob: float, hours_in_day: int, 
+                            rng: np.random.Generator, **kwargs)-> RefuelSchedule:
+    """Presamples the hours the generators are refueled at, from a 
+    generator seeded by ``rng``."""
+    schedule_rng = np.random.default_rng(int(rng.integers(2**63)))
+    return RefuelSchedule(prob, hours_in_day, schedule_rng)
+
+def Rget_next_refuel_hour(refuel_time: int, curr_hour: int, 
+                          schedule: RefuelSchedule, **kwargs)-> int:
+    """Returns the next time for refueling from the schedule, based on 
+    the current time. For arrays of scenarios, ``schedule`` is the
+    schedule of each scenario."""
+    if np.ndim(refuel_time) == 0:
+        if refuel_time > curr_hour:
+            return refuel_time
+        return schedule.get_next(refuel_time)
+    next_time = np.array(refuel_time, dtype=np.int64)
+    for s in np.flatnonzero(next_time <= curr_hour):
+        next_time[s] = schedule[s].get_next(next_time[s])
+    return next_time
+
 def Rcalc_generator_fuel_level(refuel_time: int, curr_hour: int, curr_level: float, 
                                max_level: float, **kwargs)-> float:
     """Determines the fuel level of the generator."""
-    if refuel_time > curr_hour:
-        return curr_level
-    return max_level
+    level = np.where(refuel_time > curr_hour, curr_level, max_level)
+    return as_value(level)
 
 def Rcalc_generator_fuel_consumption(load: float, max_load: float, time_step: float,
                                      seconds_in_hour: int, *args, **kwargs)-> float:
@@ -309,31 +413,31 @@ def Rcalc_battery_charge_level(state: float, level: float, max_level: float,
     
     Note that negative state indicates receiving power.
     """
-    if state < 0:
-        state *= efficiency
+    state = np.where(state < 0, state * efficiency, state)
     expected_level = level - state * time_step / seconds_in_hour
-    new_level = max(0, min(expected_level, max_level))
-    return new_level
+    new_level = np.maximum(0, np.minimum(expected_level, max_level))
+    return as_value(new_level)
 
 def Rcalc_battery_cost(ug_cost: float, tol: float, level: float, capacity: float,
                        factor: float, is_charging: bool, **kwargs):
     """Calculate the cost of using the battery."""
-    if level <= tol:
-        return float('inf')
-    level_factor = (1 - level / capacity) * factor
-    cost = ug_cost + (ug_cost * level_factor)
-    if is_charging:
-        cost *= 1.1
-    return cost
+    level = np.asarray(level, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        level_factor = (1 - level / capacity) * factor
+        cost = ug_cost + (ug_cost * level_factor)
+    cost = np.where(is_charging, cost * 1.1, cost)
+    cost = np.where(level <= tol, np.inf, cost)
+    return as_value(cost)
 
 def Rcalc_battery_benefit(ug_cost: float, level: float, capacity:float, factor: float,
                           **kwargs):
     """Calculate the benefit of charging the battery."""
-    if level >= capacity:
-        return 0.
-    level_factor = level / capacity * factor
-    benefit = ug_cost + (ug_cost * level_factor)
-    return benefit
+    level = np.asarray(level, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        level_factor = level / capacity * factor
+        benefit = ug_cost + (ug_cost * level_factor)
+    benefit = np.where(level >= capacity, 0., benefit)
+    return as_value(benefit)
 
 def Rcalc_battery_max_demand(level: float, capacity: float, max_rate: float, 
                              trickle_prop: float, trickle_rate: float, 
@@ -341,14 +445,13 @@ def Rcalc_battery_max_demand(level: float, capacity: float, max_rate: float,
                              **kwargs)-> float:
     """Calculates the maximum power the battery can receive."""
     time_step = time_step / seconds_in_hour
-    if level > trickle_prop * capacity:
-        demand = trickle_rate * max_rate * time_step
-    else:
-        demand = max_rate * time_step
-    demand = abs(demand)
+    demand = np.where(level > trickle_prop * capacity,
+                      trickle_rate * max_rate * time_step,
+                      max_rate * time_step)
+    demand = np.abs(demand)
     space = (capacity - level) / time_step
-    demand = min(demand, space)
-    return demand
+    demand = np.minimum(demand, space)
+    return as_value(demand)
 
 
 ## Power distribution strategy
@@ -377,7 +480,8 @@ def Rmake_state_vector(conn: list, names: list, tol: float,
 
     Process
     -------
-    1. Use connectivity matrix to determine connected circuits.
+    1. Use connectivity matrix to determine connected circuits (reused
+    from the ``TOPOLOGY_CACHE`` if the connectivity is unchanged).
     2. Generate a supply queue and demand queue from each circuit based 
     on the cost and profits (respectively) from each actor in the circuit.
     3. Create a state vector for each circuit, based on the power 
@@ -406,8 +510,7 @@ def Rmake_state_vector(conn: list, names: list, tol: float,
         elif 'demand_tuple' in key.lower():
             demand_tuples.append(val)
 
-    circuits = get_circuits(conn, names)
-    circuits.sort(key=lambda c : sum([len(a) for a in c]), reverse=True)
+    circuits = TOPOLOGY_CACHE.get(conn, names)
 
     for suppliers, demanders in circuits:
         ind_suppliers = set(suppliers).difference(states.keys())
@@ -437,33 +540,6 @@ def Rmake_state_vector(conn: list, names: list, tol: float,
     state_list = [states.get(name, 0.) for name in names]
     return state_list
 
-def get_circuits(conn: list, names: list)->list:
-    """Parses a connectivity matrix and returns a list of 2 list pairs 
-    (tuples) representing the supplying and demanding actors in a 
-    connected circuit.
-
-    Actors that give power to another actor can form the supply list, 
-    while actors that receive power from another actor go to demand list. 
-    The method produces pairs such that every actor in the demand list 
-    is capable of receiving energy from any actor in the supply list.
-    """
-    circuits, n = [], len(conn)
-    conns = {src : {sink for sink in range(n) 
-                    if can_send_to(src, sink, conn)} for src in range(n)}
-
-    for src, sinks in conns.items():
-        if len(sinks) == 0:
-            continue
-        for suppliers, demanders in circuits:
-            if all([d in sinks for d in demanders]):
-                suppliers.add(src)
-        if sinks not in [c[1] for c in circuits]:
-            circuits.append(({src}, sinks))
-
-    circuits = [tuple([names[a] for a in s] for s in c) for c in circuits]
-
-    return circuits
-
 def can_send_to(src, sink, conn: list, visited: set=None):
     """Returns true if the source is able to send power to the sink. 
     ``conn`` is a list (or dict) of lists, where the keyword is an actor 
@@ -0,0 +1,314 @@
+"""Streaming simulation of a microgrid hypergraph.
+
+Solving a hypergraph with ``Hypergraph.solve`` returns the value of every
+node for every index, so the memory used grows with the length of the
+simulation. A ``Simulation`` compiles a ``StepPlan`` for the model and
+instead yields the state of the grid one step at a time, holding only
+the values needed to calculate the next step. Consumers such as plots,
+file writers or aggregators can then process each step as it arrives::
+
+    sim = Simulation(mg, inputs, nodes=['SOC_Battery1'])
+    for step in sim.iter_steps(8760):
+        writer.writerow([step.time, step.values['SOC_Battery1'], *step.state_vector])
+
+A running simulation can be saved as a ``Checkpoint``, holding the 
+values carried between steps (such as charge and fuel levels, failures
+and the time) along with the state of its random generators. Resuming 
+from a checkpoint continues the simulation exactly as if it had not 
+stopped, so that several branches can be forked from a single run (the
+generator of each branch is replaced by that of the checkpoint)::
+
+    for step in sim.iter_steps(500):
+        pass
+    checkpoint = sim.checkpoint()
+    branch = Simulation(mg, inputs | {'island_mode': False})
+    for step in branch.iter_steps(1000, checkpoint=checkpoint):
+        ...
+
+A simulation also keeps a checkpoint of its frontier, so that calling 
+``extend_to`` for a longer horizon only calculates the new steps. The
+trajectories of every selected node are collected from a single pass 
+through the steps by ``run``::
+
+    sim = Simulation(mg, inputs, nodes=['SOC_Battery1', 'fuel_level_Generator1'])
+    trajectories = sim.run(168)
+
+Which values ``run`` keeps is set by a ``RetentionPolicy``: by default 
+only the selected nodes keep their full history, while the nodes carried
+between steps keep a short buffer of their most recent values and every
+other node is discarded.
+"""
+from collections import namedtuple, deque
+import copy
+import pickle
+import random
+import constrainthg as chg
+
+from model.microgrid_plan import StepPlan, get_labeled_inputs
+from model.microgrid_relations import make_rng
+
+SimulationStep = namedtuple('SimulationStep', ['index', 'time', 'state_vector', 'values'])
+SimulationStep.__doc__ = """The state of the grid at an index of the
+simulation, with ``values`` holding the value of each selected node
+{label : Any}. Values not calculated for the index are None."""
+
+class Checkpoint:
+    """The state of a simulation between two steps, from which it can be
+    resumed.
+
+    Parameters
+    ----------
+    index : int
+        The next index to calculate.
+    frames : dict
+        The value of each node carried between steps {index : {label : Any}}
+        for the indices before ``index``.
+    random_state : tuple
+        The state of the ``random`` module and of the generator of the
+        simulation after the last step.
+    setup_random_state : tuple
+        The state of the random generators before the setup of the 
+        simulation, used to recalculate the static nodes (such as a
+        randomly chosen start date).
+    """
+    def __init__(self, index: int, frames: dict, random_state: tuple,
+                 setup_random_state: tuple):
+        self.index = index
+        self.frames = frames
+        self.random_state = random_state
+        self.setup_random_state = setup_random_state
+
+    def save(self, filename: str):
+        """Writes the checkpoint to the file."""
+        with open(filename, 'wb') as file:
+            pickle.dump(self.__dict__, file)
+
+    @classmethod
+    def load(cls, filename: str):
+        """Reads a checkpoint written by ``save``."""
+        with open(filename, 'rb') as file:
+            return cls(**pickle.load(file))
+
+class RetentionPolicy:
+    """Sets which values of a simulation are kept by ``Simulation.run``.
+
+    Parameters
+    ----------
+    history : list, optional
+        The nodes (or labels) to keep the value of for every index. If
+        not given, the time, state vector and selected nodes of the 
+        simulation are kept.
+    buffer_size : int, optional
+        The number of recent values kept for each node carried between
+        steps (those feeding the ``index_offset`` cycles). If not given,
+        the largest lag of the plan is used.
+    keep_all : bool, default=False
+        Keeps the value of every dynamic node for every index, as 
+        ``Hypergraph.solve`` does.
+    """
+    def __init__(self, history: list=None, buffer_size: int=None,
+                 keep_all: bool=False):
+        self.history = history
+        self.buffer_size = buffer_size
+        self.keep_all = keep_all
+
+    def make_store(self, sim)-> 'ValueStore':
+        """Returns an empty store of values for the simulation."""
+        if self.history is None:
+            history = [sim.time_label, sim.state_label] + sim.nodes
+        else:
+            history = [sim.hg.get_node(n).label for n in self.history]
+        buffer_size = sim.plan.max_lag if self.buffer_size is None else self.buffer_size
+        buffer_labels = set().union(*sim.plan.carry_labels.values())
+        return ValueStore(history, buffer_labels, buffer_size, self.keep_all)
+
+class ValueStore:
+    """The values of a simulation kept under a ``RetentionPolicy``, with
+    the full history of nodes in ``history`` {label : [Any,]} and the 
+    most recent values of nodes in ``buffers`` {label : deque}."""
+    def __init__(self, history_labels: list, buffer_labels: set, 
+                 buffer_size: int, keep_all: bool=False):
+        self.history = {label: [] for label in history_labels}
+        self.buffers = {label: deque(maxlen=buffer_size) for label in buffer_labels}
+        self.keep_all = keep_all
+        self.num_steps = 0
+
+    def record(self, frame: dict, static: dict):
+        """Keeps the values of the step (given as the values of the 
+        dynamic nodes calculated for the index) set by the policy."""
+        if self.keep_all:
+            for label in frame:
+                if label not in self.history:
+                    self.history[label] = [None] * self.num_steps
+        for label, values in self.history.items():
+            values.append(static[label] if label in static else frame.get(label, None))
+        for label, buffer in self.buffers.items():
+            if label in frame:
+                buffer.append(frame[label])
+        self.num_steps += 1
+
+class Simulation:
+    """A simulation of the microgrid, stepped through as a generator.
+
+    Parameters
+    ----------
+    hg : Hypergraph
+        The microgrid model to simulate.
+    inputs : dict, optional
+        The inputs {node | label : value} of the simulation.
+    nodes : list, optional
+        The nodes (or labels) to report with each step, in addition to
+        the time and state vector.
+    state_vector : Node | str, default='state_vector'
+        The node holding the state vector of the grid.
+    time : Node | str, default='time'
+        The node holding the time of the simulation.
+    retention : RetentionPolicy, optional
+        The values kept by ``run``, by default the full history of the
+        time, state vector and selected nodes.
+    seed : int, optional
+        Seed for the random generator passed to the stochastic relations
+        of the model (as the ``rng`` node), if not given in the inputs.
+        The plan is compiled with a separate generator, so the same seed
+        gives the same scenario whichever nodes are selected.
+    **kwargs
+        Passed to ``StepPlan`` (such as ``search_depth``).
+    """
+    def __init__(self, hg: chg.Hypergraph, inputs: dict=None, nodes: list=None,
+                 state_vector='state_vector', time='time',
+                 retention: RetentionPolicy=None, seed: int=None, **kwargs):
+        self.hg = hg
+        self.retention = RetentionPolicy() if retention is None else retention
+        self.store = None
+        self.inputs = get_labeled_inputs(hg, inputs)
+        if 'rng' in hg.nodes:
+            self.inputs.setdefault('rng', make_rng(seed))
+        self.state_label = hg.get_node(state_vector).label
+        self.time_label = hg.get_node(time).label
+        self.nodes = [] if nodes is None else [hg.get_node(n).label for n in nodes]
+        targets = [self.time_label, self.state_label]
+        targets += [n for n in self.nodes if n not in targets]
+        compile_inputs = dict(self.inputs)
+        if 'rng' in compile_inputs:
+            compile_inputs['rng'] = make_rng()
+        self.plan = StepPlan(hg, targets, compile_inputs, **kwargs)
+        self.static = self.plan.run_setup(compile_inputs)[0]
+        self.recent = deque(maxlen=self.plan.max_lag)
+        self.random_state = None
+        self.setup_random_state = None
+        self.frontier = None
+
+    @property
+    def index(self)-> int:
+        """The last index calculated by ``extend_to``."""
+        return 0 if self.frontier is None else self.frontier.index - 1
+
+    def update_inputs(self, inputs: dict):
+        """Changes the values of inputs the simulation was compiled with,
+        such as the size of an actor. The frontier of the simulation is 
+        discarded."""
+        inputs = get_labeled_inputs(self.hg, inputs)
+        unknown = set(inputs).difference(self.inputs)
+        if len(unknown) > 0:
+            raise ValueError(f'Simulation was not compiled with inputs {sorted(unknown)}')
+        self.inputs.update(inputs)
+        self.frontier = None
+
+    def reseed(self, seed: int=None, run: int=None):
+        """Replaces the random generator of the simulation with one for 
+        the run of a study with the seed (see ``make_rng``)."""
+        self.inputs['rng'] = make_rng(seed, run)
+
+    def get_random_state(self)-> tuple:
+        """Returns the state of the ``random`` module and of the random
+        generator of the simulation."""
+        rng = self.inputs.get('rng', None)
+        return random.getstate(), None if rng is None else rng.bit_generator.state
+
+    def set_random_state(self, state: tuple):
+        """Sets the state of the ``random`` module and of the random 
+        generator of the simulation."""
+        random.setstate(state[0])
+        if state[1] is not None:
+            self.inputs['rng'].bit_generator.state = state[1]
+
+    @property
+    def names(self)-> list:
+        """The names of the actors, in the order of the state vector."""
+        return self.static.get('names', None)
+
+    def iter_steps(self, num_steps: int=None, checkpoint: Checkpoint=None):
+        """Yields a ``SimulationStep`` for each index of the simulation,
+        starting at 1 and stopping after ``num_steps`` (or never, if not
+        given). Previous steps are not held, so the memory used does not
+        grow with the number of steps.
+
+        If a checkpoint is given, the simulation is resumed from the
+        index of the checkpoint instead. Only the most recent call to 
+        ``iter_steps`` can be checkpointed.
+        """
+        if checkpoint is None:
+            self.setup_random_state = self.get_random_state()
+        else:
+            self.setup_random_state = checkpoint.setup_random_state
+            self.set_random_state(checkpoint.setup_random_state)
+        static, frames = self.plan.run_setup(self.inputs)
+        self.static = static
+
+        self.recent.clear()
+        resume = None
+        if checkpoint is not None:
+            self.set_random_state(checkpoint.random_state)
+            resume = (checkpoint.index, copy.deepcopy(checkpoint.frames))
+            self.recent.extend(sorted(resume[1].items()))
+
+        for index, frame in self.plan.iter_steps(self.inputs, (static, frames), resume):
+            self.recent.append((index, frame))
+            self.random_state = self.get_random_state()
+            values = {label: static[label] if label in static else frame.get(label, None)
+                      for label in self.nodes}
+            yield SimulationStep(index, frame.get(self.time_label, None),
+                                 frame.get(self.state_label, None), values)
+            if num_steps is not None and index >= num_steps:
+                break
+
+    def checkpoint(self)-> Checkpoint:
+        """Returns a checkpoint of the simulation after the last step 
+        yielded by ``iter_steps``."""
+        if len(self.recent) == 0:
+            raise ValueError('Simulation has no steps to checkpoint')
+        index = self.recent[-1][0] + 1
+        if index < self.plan.start_index:
+            raise ValueError(f'Unable to checkpoint before index {self.plan.start_index}')
+        frames = {}
+        for i, frame in self.recent:
+            labels = self.plan.carry_labels.get(index - i, set())
+            frames[i] = {label: frame[label] for label in labels if label in frame}
+        return Checkpoint(index, copy.deepcopy(frames), self.random_state,
+                          self.setup_random_state)
+
+    def extend_to(self, min_index: int):
+        """Yields each step after the last index calculated by a previous
+        call, up to ``min_index``. The simulation continues from its 
+        frontier, giving the same steps as a single run to ``min_index``.
+        """
+        if min_index <= self.index:
+            return
+        try:
+            for step in self.iter_steps(min_index, checkpoint=self.frontier):
+                yield step
+        finally:
+            if len(self.recent) > 0 and self.recent[-1][0] + 1 >= self.plan.start_index:
+                self.frontier = self.checkpoint()
+
+    def run(self, min_index: int, retention: RetentionPolicy=None)-> dict:
+        """Extends the simulation to ``min_index``, returning the history
+        {label : [Any,]} for every new index of the nodes kept by the 
+        retention policy (by default the time, state vector and each 
+        selected node), all calculated in a single pass. The values kept
+        are held in the ``store`` attribute."""
+        policy = self.retention if retention is None else retention
+        self.store = policy.make_store(self)
+        for step in self.extend_to(min_index):
+            self.store.record(self.recent[-1][1], self.static)
+        return self.store.history
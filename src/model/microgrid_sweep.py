@@ -0,0 +1,168 @@
+"""Parameter sweeps for sizing the actors of the microgrid.
+
+A sweep simulates the microgrid for each of a list of configurations,
+where each configuration sets the parameters of some actors, such as::
+
+    {'PV1.area': 10000, 'Battery1.charge_capacity': 20000}
+
+Parameters are given as ``<actor>.<attribute>``, where the attribute is
+the node of the actor set by its constructor (such as ``area`` and
+``efficiency`` of a ``PhotovoltaicArray``, ``charge_capacity``,
+``max_output`` and ``max_charge_rate`` of a ``Battery``, or
+``fuel_capacity`` and ``max_output`` of a ``Generator``), or directly as
+the label of a node. The values are passed to the model as inputs, so
+the model does not need to be edited or rebuilt between configurations.
+
+Configurations are simulated concurrently across a pool of worker
+processes. Each worker compiles a simulation once for each set of
+parameters it sees and reuses it for every configuration of that set.
+The resilience metrics of each configuration (see
+``microgrid_montecarlo``) are averaged over ``num_runs`` runs and
+written as a table with a row for each configuration. If a cache file is
+given, each completed configuration is appended to it, so that an
+interrupted sweep resumes where it stopped.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+import csv
+import hashlib
+import importlib
+import json
+import os
+
+from model.microgrid_montecarlo import MC_INPUTS, ScenarioRunner, get_actors, \
+    resolve_parameter
+
+def make_grid(params: dict)-> list:
+    """Returns a configuration for every combination of the values of
+    each parameter {parameter : [Any,]}."""
+    keys = list(params)
+    return [dict(zip(keys, values)) for values in product(*params.values())]
+
+def get_config_key(config: dict, settings: dict)-> str:
+    """Returns a key identifying the results of the configuration under
+    the settings of the sweep."""
+    text = json.dumps([config, settings], sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+def load_cache(cache_file: str)-> dict:
+    """Returns the results of each configuration in the cache file
+    {key : row}."""
+    cached = {}
+    if cache_file is None or not os.path.exists(cache_file):
+        return cached
+    with open(cache_file) as file:
+        for line in file:
+            if line.strip() == '':
+                continue
+            entry = json.loads(line)
+            cached[entry['key']] = entry['row']
+    return cached
+
+class SweepRunner:
+    """Simulates configurations of a sweep, built once for each worker.
+    A ``ScenarioRunner`` is compiled for each set of parameters."""
+    def __init__(self, model: str, graph: str, inputs: dict, num_steps: int,
+                 search_depth: int=100000):
+        module = importlib.import_module(model)
+        self.hg = getattr(module, graph)
+        self.actors = get_actors(module)
+        self.args = (model, graph, inputs, num_steps, search_depth)
+        self.inputs = inputs
+        self.runners = {}
+
+    def run(self, config: dict, num_runs: int, seed: int)-> dict:
+        """Returns the mean of each metric of the configuration over the
+        runs."""
+        overrides = {resolve_parameter(self.hg, self.actors, k): v
+                     for k, v in config.items()}
+        params = frozenset(overrides)
+        if params not in self.runners:
+            model, graph, inputs, num_steps, search_depth = self.args
+            self.runners[params] = ScenarioRunner(model, graph, inputs | overrides,
+                                                  num_steps, search_depth)
+        runner = self.runners[params]
+        runner.sim.update_inputs(overrides)
+
+        totals = {}
+        for run_id in range(num_runs):
+            metrics = runner.run(run_id, seed)[2]
+            for col, val in metrics.items():
+                totals[col] = totals.get(col, 0.) + val
+        return {col: val / num_runs for col, val in totals.items()}
+
+_RUNNER = None
+
+def init_worker(*args):
+    """Builds the sweep runner for a worker process."""
+    global _RUNNER
+    _RUNNER = SweepRunner(*args)
+
+def run_config(config_id: int, config: dict, num_runs: int, seed: int)-> tuple:
+    """Simulates the configuration in a worker process."""
+    return config_id, _RUNNER.run(config, num_runs, seed)
+
+def iter_sweep(configs: list, inputs: dict=None, num_steps: int=336,
+               num_runs: int=1, seed: int=0, max_workers: int=None,
+               cache_file: str=None, model: str='model.microgrid',
+               graph: str='mg', search_depth: int=100000):
+    """Yields ``(config_id, row)`` for each configuration as it finishes,
+    where the row holds the parameters of the configuration followed by
+    the mean of each metric. Configurations found in the cache file are
+    yielded first without being simulated. If ``max_workers`` is 0, the
+    configurations are simulated in this process.
+    """
+    inputs = MC_INPUTS if inputs is None else inputs
+    settings = dict(inputs=inputs, num_steps=num_steps, num_runs=num_runs,
+                    seed=seed, model=model, graph=graph)
+    keys = [get_config_key(config, settings) for config in configs]
+    cached = load_cache(cache_file)
+
+    pending = []
+    for config_id, (config, key) in enumerate(zip(configs, keys)):
+        if key in cached:
+            yield config_id, cached[key]
+        else:
+            pending.append((config_id, config))
+
+    def finish(config_id, metrics):
+        row = dict(configs[config_id]) | metrics
+        if cache_file is not None:
+            with open(cache_file, 'a') as file:
+                file.write(json.dumps(dict(key=keys[config_id], row=row)) + '\n')
+        return config_id, row
+
+    args = (model, graph, inputs, num_steps, search_depth)
+    if max_workers == 0:
+        runner = SweepRunner(*args)
+        for config_id, config in pending:
+            yield finish(config_id, runner.run(config, num_runs, seed))
+        return
+
+    with ProcessPoolExecutor(max_workers, initializer=init_worker, initargs=args) as pool:
+        futures = [pool.submit(run_config, config_id, config, num_runs, seed)
+                   for config_id, config in pending]
+        for future in as_completed(futures):
+            yield finish(*future.result())
+
+def write_sweep_csv(rows: list, filename: str):
+    """Writes the rows of a sweep to a CSV file, with a column for each
+    parameter and metric."""
+    columns = []
+    for row in rows:
+        columns.extend(col for col in row if col not in columns)
+    with open(filename, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def run_sweep(configs: list, results_file: str=None, **kwargs)-> list:
+    """Runs a sweep over the configurations, returning a row for each (in
+    the order of the configurations). The rows are written to a CSV file
+    if given. Keyword arguments are passed to ``iter_sweep``."""
+    rows = [None] * len(configs)
+    for config_id, row in iter_sweep(configs, **kwargs):
+        rows[config_id] = row
+    if results_file is not None:
+        write_sweep_csv(rows, results_file)
+    return rows
@@ -0,0 +1,198 @@
+"""Graph algorithms for the topology of the grid.
+
+The connectivity matrix of the grid is treated as a directed graph where
+``conn[i][j]`` is an edge from actor i to actor j. Reachability between
+actors is found in a single pass by collapsing the graph into its
+strongly connected components (Tarjan's algorithm) and propagating the
+reachable sets of each component through the resulting acyclic graph.
+Reachable sets are stored as integer bitmasks, where bit j of the mask
+for actor i is set if i can send power to j.
+
+Since the connectivity of the grid rarely changes between time steps,
+the circuits found for each connectivity matrix are held in a 
+``TopologyCache``, keyed by the packed bits of the matrix.
+"""
+from collections import OrderedDict
+import numpy as np
+
+def get_strong_components(adjacency: list)-> list:
+    """Returns the strongly connected components of the graph as lists of
+    vertices, ordered such that every component comes after each of the
+    components it has an edge to (reverse topological order).
+
+    An iterative form of Tarjan's algorithm, so that large grids do not
+    exceed the recursion limit.
+    """
+    n = len(adjacency)
+    index, lowlink = [-1] * n, [0] * n
+    on_stack = [False] * n
+    stack, components = [], []
+    counter = 0
+
+    for root in range(n):
+        if index[root] != -1:
+            continue
+        work = [(root, 0)]
+        while len(work) > 0:
+            v, i = work.pop()
+            if i == 0:
+                index[v] = lowlink[v] = counter
+                counter += 1
+                stack.append(v)
+                on_stack[v] = True
+            successors = adjacency[v]
+            while i < len(successors):
+                w = successors[i]
+                i += 1
+                if index[w] == -1:
+                    work.append((v, i))
+                    work.append((w, 0))
+                    break
+                if on_stack[w]:
+                    lowlink[v] = min(lowlink[v], index[w])
+            else:
+                if lowlink[v] == index[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        component.append(w)
+                        if w == v:
+                            break
+                    components.append(component)
+                if len(work) > 0:
+                    u = work[-1][0]
+                    lowlink[u] = min(lowlink[u], lowlink[v])
+    return components
+
+def get_reach_masks(conn: list)-> list:
+    """Returns a bitmask for each actor of the actors it can send power
+    to, either directly or through other actors.
+
+    An actor is only considered to reach itself if it is directly
+    connected to itself (the diagonal of ``conn``), not through a cycle
+    of other actors.
+    """
+    conn = np.asarray(conn) != 0
+    n = len(conn)
+    adjacency = [np.flatnonzero(row).tolist() for row in conn]
+    components = get_strong_components(adjacency)
+
+    component_of = [0] * n
+    for c, component in enumerate(components):
+        for v in component:
+            component_of[v] = c
+
+    members, reach = [], []
+    for c, component in enumerate(components):
+        member_mask = 0
+        for v in component:
+            member_mask |= 1 << v
+        reach_mask = member_mask if len(component) > 1 else 0
+        for v in component:
+            for w in adjacency[v]:
+                d = component_of[w]
+                if d != c:
+                    reach_mask |= members[d] | reach[d]
+        members.append(member_mask)
+        reach.append(reach_mask)
+
+    masks = []
+    for v in range(n):
+        mask = reach[component_of[v]] & ~(1 << v)
+        if conn[v][v]:
+            mask |= 1 << v
+        masks.append(mask)
+    return masks
+
+def mask_to_set(mask: int)-> set:
+    """Returns the set of indices of the bits set in the mask, inserted
+    in ascending order."""
+    bits = bin(mask)[:1:-1]
+    indices = {i for i, bit in enumerate(bits) if bit == '1'}
+    return indices
+
+def get_circuits(conn: list, names: list)->list:
+    """Parses a connectivity matrix and returns a list of 2 list pairs 
+    (tuples) representing the supplying and demanding actors in a 
+    connected circuit.
+
+    Actors that give power to another actor can form the supply list, 
+    while actors that receive power from another actor go to demand list. 
+    The method produces pairs such that every actor in the demand list 
+    is capable of receiving energy from any actor in the supply list.
+
+    The actors reachable from each actor are found in a single pass over
+    ``conn`` (see ``get_reach_masks``), and held as bitmasks so that 
+    comparing the sinks of two actors is a single integer operation.
+    """
+    circuits, sink_masks = [], []
+    for src, mask in enumerate(get_reach_masks(conn)):
+        if mask == 0:
+            continue
+        for (suppliers, demanders), d_mask in zip(circuits, sink_masks):
+            if d_mask & ~mask == 0:
+                suppliers.add(src)
+        if mask not in sink_masks:
+            circuits.append(({src}, mask_to_set(mask)))
+            sink_masks.append(mask)
+
+    circuits = [tuple([names[a] for a in s] for s in c) for c in circuits]
+
+    return circuits
+
+def sort_circuits(circuits: list)-> list:
+    """Sorts the circuits by the number of actors in each, largest first."""
+    circuits.sort(key=lambda c : sum([len(a) for a in c]), reverse=True)
+    return circuits
+
+
+## Cache
+class TopologyCache:
+    """A least-recently-used store of the sorted circuits of the grid, 
+    keyed by the packed bits of the connectivity matrix and the names of
+    the actors, so that circuits are only found again when the 
+    connectivity of the grid changes."""
+    def __init__(self, maxsize: int=128):
+        self.maxsize = maxsize
+        self.circuits = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conn: list, names: list)-> list:
+        """Returns the circuits of the grid sorted by size, largest first.
+        The returned lists are shared between calls and should not be 
+        modified."""
+        key = self.make_key(conn, names)
+        if key in self.circuits:
+            self.hits += 1
+            self.circuits.move_to_end(key)
+            return self.circuits[key]
+        self.misses += 1
+        circuits = sort_circuits(get_circuits(conn, names))
+        self.circuits[key] = circuits
+        if len(self.circuits) > self.maxsize:
+            self.circuits.popitem(last=False)
+        return circuits
+
+    @staticmethod
+    def make_key(conn: list, names: list)-> tuple:
+        """Returns a hashable key for the connectivity matrix."""
+        conn = np.asarray(conn) != 0
+        return conn.shape, np.packbits(conn).tobytes(), tuple(names)
+
+    def info(self)-> dict:
+        """Returns the hit and miss counts, the hit rate, and the number 
+        of topologies held."""
+        calls = self.hits + self.misses
+        hit_rate = self.hits / calls if calls > 0 else 0.
+        return dict(hits=self.hits, misses=self.misses, hit_rate=hit_rate,
+                    topologies=len(self.circuits))
+
+    def clear(self):
+        """Removes all circuits and resets the counters."""
+        self.circuits = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+TOPOLOGY_CACHE = TopologyCache()
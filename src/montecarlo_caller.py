@@ -0,0 +1,22 @@
+from model.microgrid_montecarlo import *
+
+# Two week islanded runs with failures allowed, summarized as in the 
+# archived MATLAB model. Note that each worker compiles the model first.
+inputs = MC_INPUTS | {
+    'prob_failingGenerator1': 0.02,
+    'prob_failingGenerator2': 0.02,
+    'prob_failingBattery1': 0.02,
+    'prob_failingPV1': 0.02,
+}
+
+if __name__ == '__main__':
+    results, summary = run_monte_carlo(
+        num_runs=20,
+        inputs=inputs,
+        num_steps=336,
+        seed=0,
+        results_file='MG_Sim_MC_Results.csv',
+        summary_file='MG_Sim_MC_Summary.csv',
+    )
+    for stat, row in summary.items():
+        print(stat, row['MI'])
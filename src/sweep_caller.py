@@ -0,0 +1,22 @@
+from model.microgrid_sweep import *
+from model.microgrid_montecarlo import MC_INPUTS
+
+# Sizes of the solar array and battery for a two week islanded study. 
+# Completed sizes are cached, so an interrupted sweep can be rerun.
+configs = make_grid({
+    'PV1.area': [5000, 10000, 20000],
+    'Battery1.charge_capacity': [10000, 20000, 40000],
+})
+
+if __name__ == '__main__':
+    rows = run_sweep(
+        configs,
+        results_file='MG_Sizing_Sweep.csv',
+        inputs=MC_INPUTS,
+        num_steps=336,
+        num_runs=5,
+        seed=0,
+        cache_file='MG_Sizing_Sweep.jsonl',
+    )
+    for row in rows:
+        print(row['PV1.area'], row['Battery1.charge_capacity'], row['MI'])
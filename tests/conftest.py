@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src'))
+
+from model.microgrid import mg
+from validation.spanagel_hg import sg
+
+STATIC_VALUES = [(node, node.static_value) for hg in (mg, sg) for node in hg.nodes.values()]
+
+@pytest.fixture(autouse=True)
+def restore_static_values():
+    """Restores the values of the nodes of the models after each test, as
+    ``Hypergraph.solve`` keeps the inputs it was given."""
+    yield
+    for node, value in STATIC_VALUES:
+        node.static_value = value
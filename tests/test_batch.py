@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from model.microgrid_batch import run_batch_monte_carlo
+from model.microgrid_montecarlo import MC_INPUTS, ScenarioRunner
+from model.microgrid_refueling import RefuelSchedule
+from model.microgrid_relations import Rcalc_battery_charge_level, Rcalc_battery_cost, \
+    Rcalc_battery_benefit, Rcalc_battery_max_demand, Rcalc_generator_fuel_level, \
+    Rget_next_refuel_hour
+
+FAILING_ACTORS = ['Generator1', 'PV1', 'Battery1', 'Bus2', 'Building4Large', 'UtilityGrid']
+
+@pytest.mark.parametrize('island_mode', [True, False])
+def test_batch_matches_scenario_runner(island_mode):
+    inputs = MC_INPUTS | {'island_mode': island_mode}
+    for actor in FAILING_ACTORS:
+        inputs |= {f'prob_failing{actor}': 0.05, f'prob_fixed{actor}': 0.2}
+    runner = ScenarioRunner('model.microgrid', 'mg', inputs, 96)
+    expected = [runner.run(run_id, 3)[2] for run_id in range(5)]
+    results = run_batch_monte_carlo(5, inputs, num_steps=96, seed=3, batch_size=3)[0]
+    assert any(metrics['MI'] > 0 for metrics in expected)
+    for metrics, batch_metrics in zip(expected, results):
+        assert list(batch_metrics) == list(metrics)
+        for col in metrics:
+            assert batch_metrics[col] == pytest.approx(metrics[col], rel=1e-12, abs=1e-9), col
+
+def test_relations_match_for_arrays():
+    rng = np.random.default_rng(0)
+    level = np.concatenate(([0., 1e-9, 5000., 10000.], rng.uniform(0, 10000, 20)))
+    state = rng.uniform(-400, 400, len(level))
+    capacity = np.full(len(level), 10000.)
+    is_charging = state < 0
+    relations = [
+        (Rcalc_battery_charge_level, (state, level, capacity, 3600, 0.9, 3600)),
+        (Rcalc_battery_cost, (0.2, 1e-6, level, capacity, 1.5, is_charging)),
+        (Rcalc_battery_benefit, (0.2, level, capacity, 1.5)),
+        (Rcalc_battery_max_demand, (level, capacity, 400., 0.8, 0.1, 3600, 3600)),
+        (Rcalc_generator_fuel_level, (state.astype(int), 0, level, capacity)),
+    ]
+    for rel, args in relations:
+        values = rel(*args)
+        for s in range(len(level)):
+            value = rel(*[a[s] if isinstance(a, np.ndarray) else a for a in args])
+            assert isinstance(value, float)
+            assert values[s] == value, (rel.__name__, s)
+
+def test_next_refuel_hour_for_arrays():
+    schedules = [RefuelSchedule(0.3, 24, np.random.default_rng(s), block_size=4)
+                 for s in range(3)]
+    singles = [RefuelSchedule(0.3, 24, np.random.default_rng(s), block_size=4)
+               for s in range(3)]
+    next_refuel = np.zeros(3, dtype=np.int64)
+    single_next = [0, 0, 0]
+    for hour in range(0, 600, 7):
+        next_refuel = Rget_next_refuel_hour(next_refuel, hour, schedules)
+        single_next = [Rget_next_refuel_hour(n, hour, schedule)
+                       for n, schedule in zip(single_next, singles)]
+        assert list(next_refuel) == single_next
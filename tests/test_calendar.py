@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from model.microgrid_calendar import Calendar, CALENDAR_FIELDS, make_calendar_arrays
+from model.microgrid_relations import Rcalc_num_leapyears, Rcalc_year, Rcalc_day, \
+    Rcalc_hour, Rcalc_year_is_leapyear, Rget_hour_index
+
+HOURS_IN_DAY, HOURS_IN_YEAR, HOURS_IN_LEAPYEAR = 24, 8760, 8784
+
+def scalar_calendar(elapsed_hours, start_year, start_day, start_hour):
+    """The calendar fields as calculated by the per-step relations."""
+    num_leapyears = Rcalc_num_leapyears(start_year, elapsed_hours, HOURS_IN_YEAR,
+                                        HOURS_IN_LEAPYEAR)
+    year = Rcalc_year(elapsed_hours, num_leapyears, start_year, start_day, start_hour,
+                      HOURS_IN_DAY, HOURS_IN_YEAR)
+    day = Rcalc_day(elapsed_hours, start_year, year, num_leapyears, start_day,
+                    start_hour, HOURS_IN_DAY, HOURS_IN_YEAR)
+    hour = Rcalc_hour(elapsed_hours, start_hour, HOURS_IN_DAY)
+    is_leapyear = Rcalc_year_is_leapyear(year)
+    hour_idx = Rget_hour_index(day, hour, is_leapyear, HOURS_IN_DAY, HOURS_IN_YEAR,
+                               HOURS_IN_LEAPYEAR)
+    return dict(zip(CALENDAR_FIELDS, [num_leapyears, year, day, hour, is_leapyear, hour_idx]))
+
+START_DATES = [(2001, 1, 0), (2003, 365, 23), (2004, 59, 12), (2007, 200, 5), (2008, 366, 0)]
+
+@pytest.mark.parametrize('start', START_DATES)
+def test_arrays_match_scalar_relations(start):
+    elapsed_hours = np.unique(np.concatenate((np.arange(0, 4 * HOURS_IN_LEAPYEAR, 97),
+                                              np.arange(HOURS_IN_YEAR - 30, HOURS_IN_YEAR + 30))))
+    arrays = make_calendar_arrays(elapsed_hours, *start, HOURS_IN_DAY, HOURS_IN_YEAR,
+                                  HOURS_IN_LEAPYEAR)
+    for i, hours in enumerate(elapsed_hours):
+        expected = scalar_calendar(int(hours), *start)
+        for field in CALENDAR_FIELDS:
+            assert arrays[field][i] == expected[field], (field, int(hours))
+
+def test_calendar_extends_past_horizon():
+    calendar = Calendar(2003, 300, 4, 10, HOURS_IN_DAY, HOURS_IN_YEAR, HOURS_IN_LEAPYEAR)
+    for hours in [0, 9, 10, 5000, 20000]:
+        expected = scalar_calendar(hours, 2003, 300, 4)
+        assert {f: calendar.get(f, hours) for f in CALENDAR_FIELDS} == expected
@@ -0,0 +1,31 @@
+import numpy as np
+
+from model.microgrid_batch import BatchSimulation
+from model.microgrid_importance import ImportanceRunner
+from model.microgrid_montecarlo import MC_INPUTS
+from model.microgrid_simulation import Simulation
+
+INPUTS = MC_INPUTS | {'has_random_failure': True, 'is_failingPV1': True,
+                      'prob_failingPV1': 0., 'prob_fixedPV1': 0.,
+                      'prob_failingGenerator1': 0.05, 'prob_fixedGenerator1': 0.2}
+
+def test_failing_actor_stays_failing():
+    from model.microgrid import mg
+    sim = Simulation(mg, INPUTS, nodes=['is_failingPV1', 'is_failingGenerator1'], seed=1)
+    steps = list(sim.iter_steps(48))
+    assert all(step.values['is_failingPV1'] for step in steps)
+    assert not all(step.values['is_failingGenerator1'] is False for step in steps)
+
+def test_failing_actor_stays_failing_in_batch():
+    batch = BatchSimulation(3, INPUTS, seed=1)
+    col = batch.names.index('PV1')
+    for step in batch.iter_steps(48):
+        assert np.all(step.state_vectors[:, col] == 0.)
+    failing = batch.setup(48)['failing'][:, :, batch.cols['PV1']]
+    assert failing.all()
+
+def test_failing_actor_stays_failing_when_tilted():
+    runner = ImportanceRunner('model.microgrid', 'mg', INPUTS, 24,
+                              {'prob_failingGenerator1': 0.1})
+    failures = runner.sample(np.random.default_rng(0))[0]
+    assert failures.get_steps('PV1', 0, 100).all()
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from model.microgrid_failures import FailureTrajectories
+from model.microgrid_importance import ImportanceRunner
+from model.microgrid_montecarlo import MC_INPUTS
+from model.microgrid_refueling import RefuelSchedule, log_geometric
+
+INPUTS = MC_INPUTS | {'prob_failingGenerator1': 0.01, 'prob_failingPV1': 0.}
+
+@pytest.mark.parametrize('tilt', [{'prob_failingPV1': 0.05}, {'prob_failingGenerator1': 0.},
+                                  {'prob_failingBus9': 0.05}])
+def test_unweighable_tilts_are_rejected(tilt):
+    with pytest.raises(ValueError):
+        ImportanceRunner('model.microgrid', 'mg', INPUTS, 24, tilt)
+
+def test_untilted_runs_have_unit_weight():
+    runner = ImportanceRunner('model.microgrid', 'mg', INPUTS, 48,
+                              {'prob_failingGenerator1': 0.01})
+    for run_id in range(2):
+        assert runner.run(run_id, 1)[2]['LogWeight'] == 0.
+
+def test_refuelings_before_start_are_not_weighed():
+    schedule = RefuelSchedule(0.5, 24, np.random.default_rng(1), block_size=8,
+                              nominal_prob=0.1, nominal_until=2000)
+    hour = 0
+    while hour < 2000:
+        hour = schedule.get_next(hour)
+    num_nominal = schedule.num_nominal
+    assert np.all(schedule.hours[:num_nominal - 1] < 2000)
+    assert schedule.hours[num_nominal - 1] >= 2000
+    assert schedule.log_likelihood_ratio(0.3) == 0.
+
+    while hour < 4000:
+        hour = schedule.get_next(hour)
+    days = schedule.days[num_nominal:schedule.num_used]
+    expected = log_geometric(days, 0.3).sum() - log_geometric(days, 0.5).sum()
+    assert len(days) > 0
+    assert schedule.log_likelihood_ratio(0.3) == pytest.approx(expected)
+
+def test_weighted_failures_estimate_nominal_probability():
+    p_fail, p_fix, tilted_fail, step = 0.01, 0.2, 0.1, 10
+    expected = 0.
+    for _ in range(step):
+        expected = expected * (1 - p_fix) + (1 - expected) * p_fail
+
+    rng = np.random.default_rng(5)
+    is_failing, weights = [], []
+    for _ in range(4000):
+        failures = FailureTrajectories(['Generator1'], [tilted_fail], [p_fix], [False],
+                                       rng, block_size=16)
+        is_failing.append(failures.get('Generator1', step))
+        weights.append(np.exp(failures.log_likelihood_ratio([p_fail], [p_fix])))
+    values = np.array(is_failing) * np.array(weights)
+    std_error = values.std() / np.sqrt(len(values))
+    assert abs(values.mean() - expected) < 4 * std_error
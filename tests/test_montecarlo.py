@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from model.microgrid_montecarlo import MC_INPUTS, SUMMARY_STATS, RunningSummary, \
+    ScenarioRunner, GridLost, run_monte_carlo, summarize_monte_carlo, is_precise, \
+    run_adaptive_monte_carlo, run_single
+
+INPUTS = MC_INPUTS | {'prob_failingGenerator1': 0.05, 'prob_failingBattery1': 0.05,
+                      'prob_failingPV1': 0.05}
+
+def make_results(num_runs, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{'MI': float(rng.normal(1e4, 50.)), 'ShedHours': float(rng.integers(0, 5)),
+             'Constant': 3.} for _ in range(num_runs)]
+
+def assert_summary_matches(summary, results):
+    for col in results[0]:
+        values = np.array([r[col] for r in results])
+        expected = dict(mean=values.mean(), max=values.max(), min=values.min(),
+                        std=values.std(), size=len(values))
+        for stat in SUMMARY_STATS:
+            assert summary[stat][col] == pytest.approx(expected[stat], rel=1e-12, abs=1e-9)
+
+def test_running_summary_matches_numpy():
+    results = make_results(50)
+    summary = RunningSummary()
+    for metrics in results:
+        summary.update(metrics)
+    assert_summary_matches(summary.result(), results)
+
+@pytest.mark.parametrize('splits', [[0, 50], [1, 49], [17, 20, 0, 13], [10] * 5])
+def test_merged_summaries_match_numpy(splits):
+    results = make_results(sum(splits), seed=len(splits))
+    summary, start = RunningSummary(), 0
+    for size in splits:
+        part = RunningSummary()
+        for metrics in results[start:start + size]:
+            part.update(metrics)
+        summary.merge(part)
+        start += size
+    assert_summary_matches(summary.result(), results)
+
+def test_half_widths():
+    results = make_results(40)
+    summary = RunningSummary()
+    for metrics in results:
+        summary.update(metrics)
+    values = np.array([r['MI'] for r in results])
+    expected = 1.959963984540054 * values.std(ddof=1) / np.sqrt(len(values))
+    assert summary.get_half_widths()['MI'] == pytest.approx(expected)
+    assert RunningSummary().get_half_widths() == {}
+
+def test_study_summary_matches_results():
+    results, summary = run_monte_carlo(6, INPUTS, num_steps=48, seed=1, max_workers=0)
+    assert_summary_matches(summary, results)
+    merged = summarize_monte_carlo(6, INPUTS, num_steps=48, seed=1, max_workers=0,
+                                   batch_size=4)
+    assert_summary_matches(merged, results)
+
+@pytest.mark.parametrize('island_mode', [True, False])
+def test_grid_lost_matches_full_run(island_mode):
+    inputs = MC_INPUTS | {'island_mode': island_mode, 'starting_fuel_level_Generator2': 0.,
+                          'prob_failingBuilding1Small': 0.05, 'prob_failingBuilding4Large': 0.1}
+    for actor in ['PV1', 'Generator1', 'Generator2', 'UtilityGrid']:
+        inputs |= {f'prob_failing{actor}': 0.05, f'prob_fixed{actor}': 0.}
+    full = ScenarioRunner('model.microgrid', 'mg', inputs, 150)
+    stopped = ScenarioRunner('model.microgrid', 'mg', inputs, 150, stop_condition=GridLost())
+    num_stopped = 0
+    for run_id in range(6):
+        expected = full.run(run_id, 3)[2]
+        metrics = stopped.run(run_id, 3)[2]
+        num_stopped += metrics.pop('SkippedSteps') > 0
+        assert metrics == {k: v for k, v in expected.items() if k != 'SkippedSteps'}
+    assert num_stopped > 0
+
+def test_is_precise():
+    summary = RunningSummary()
+    for value in [10., 10.2, 9.8, 10.1, 9.9]:
+        summary.update({'MI': value, 'Constant': 0.})
+    assert is_precise(summary, ['MI'], 0.05)
+    assert not is_precise(summary, ['MI'], 0.001)
+    assert not is_precise(summary, ['Constant'], 0.05)
+    assert not is_precise(summary, ['MI', 'Constant'], 0.05)
+
+def test_adaptive_study_runs_while_target_has_not_varied():
+    settings = dict(num_steps=48, seed=1, max_workers=0, min_runs=2, max_runs=6,
+                    batch_size=2)
+    summary, precise = run_adaptive_monte_carlo(INPUTS, ['FuelEmpty_Generator1'],
+                                                rel_precision=0.5, **settings)
+    assert not precise
+    assert summary['size']['MI'] == 6
+    summary, precise = run_adaptive_monte_carlo(INPUTS, ['MI'], rel_precision=10.,
+                                                **settings)
+    assert precise
+    assert summary['size']['MI'] < 6
+
+def test_worker_pool_matches_single_process():
+    settings = dict(num_steps=24, seed=2, batch_size=2)
+    results = run_monte_carlo(4, INPUTS, max_workers=0, **settings)[0]
+    assert run_monte_carlo(4, INPUTS, max_workers=2, **settings)[0] == results
+    assert run_single(3, 2, INPUTS, num_steps=24) == results[3]
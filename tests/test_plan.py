@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+from model.microgrid_plan import StepPlan
+from model.microgrid_relations import make_rng
+
+SPANAGEL_DATA = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src',
+                             'validation', 'Spanagel_Test_29APR-1MAY2025.csv')
+
+def get_microgrid():
+    from model.microgrid import mg
+    inputs = {'use_random_date': False, 'start_day': 100, 'start_year': 2005,
+              'start_hour': 6, 'has_random_failure': False, 'island_mode': True,
+              'time_step': 3600, 'rng': make_rng(3)}
+    return mg, inputs, 12
+
+def get_spanagel():
+    from validation.spanagel_hg import sg
+    inputs = {'valid_data_path': SPANAGEL_DATA, 'use_random_date': False,
+              'start_day': 119, 'start_year': 2025, 'start_hour': 15,
+              'has_random_failure': False, 'time_step': 60}
+    return sg, inputs, 20
+
+@pytest.mark.parametrize('get_model', [get_microgrid, get_spanagel])
+def test_plan_matches_solve(get_model):
+    hg, inputs, min_index = get_model()
+    plan = StepPlan(hg, ['state_vector'], inputs)
+    assert plan.verify(inputs, min_index=min_index, search_depth=500000, seed=3) == []
@@ -0,0 +1,53 @@
+import pytest
+
+from model.microgrid_montecarlo import MC_INPUTS
+from model.microgrid_plan import values_equal
+from model.microgrid_simulation import Checkpoint, Simulation
+
+INPUTS = MC_INPUTS | {'prob_failingGenerator1': 0.05, 'prob_failingBattery1': 0.05,
+                      'prob_failingPV1': 0.05}
+NODES = ['SOC_Battery1', 'fuel_level_Generator1', 'next refuel hour']
+
+@pytest.fixture(scope='module')
+def mg():
+    from model.microgrid import mg
+    return mg
+
+def assert_same_steps(steps, other_steps):
+    assert [s.index for s in steps] == [s.index for s in other_steps]
+    for a, b in zip(steps, other_steps):
+        assert a.time == b.time
+        assert values_equal(a.state_vector, b.state_vector), a.index
+        assert values_equal(list(a.values.values()), list(b.values.values())), a.index
+
+def test_checkpoint_resumes_run(mg, tmp_path):
+    full = list(Simulation(mg, INPUTS, nodes=NODES, seed=7).iter_steps(60))
+
+    sim = Simulation(mg, INPUTS, nodes=NODES, seed=7)
+    for _ in sim.iter_steps(30):
+        pass
+    sim.checkpoint().save(tmp_path / 'checkpoint.pkl')
+    checkpoint = Checkpoint.load(tmp_path / 'checkpoint.pkl')
+
+    resumed = Simulation(mg, INPUTS, nodes=NODES, seed=11)
+    assert_same_steps(full[30:], list(resumed.iter_steps(60, checkpoint=checkpoint)))
+
+def test_extend_to_continues_run(mg):
+    full = list(Simulation(mg, INPUTS, nodes=NODES, seed=7).iter_steps(60))
+
+    sim = Simulation(mg, INPUTS, nodes=NODES, seed=7)
+    steps = list(sim.extend_to(1)) + list(sim.extend_to(25))
+    for step in sim.extend_to(50):
+        steps.append(step)
+        if step.index == 40:
+            break
+    assert sim.index == 40
+    steps += list(sim.extend_to(60))
+    assert list(sim.extend_to(45)) == []
+    assert_same_steps(full, steps)
+
+def test_seed_gives_same_scenario_for_any_nodes(mg):
+    steps = list(Simulation(mg, INPUTS, seed=7).iter_steps(30))
+    with_nodes = list(Simulation(mg, INPUTS, nodes=NODES, seed=7).iter_steps(30))
+    for a, b in zip(steps, with_nodes):
+        assert values_equal(a.state_vector, b.state_vector), a.index
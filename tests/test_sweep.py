@@ -0,0 +1,41 @@
+from model import microgrid_sweep
+from model.microgrid_montecarlo import MC_INPUTS
+from model.microgrid_sweep import make_grid, run_sweep
+
+INPUTS = MC_INPUTS | {'prob_failingGenerator1': 0.05}
+SETTINGS = dict(inputs=INPUTS, num_steps=24, num_runs=2, seed=1, max_workers=0)
+
+def count_runs(monkeypatch):
+    """Counts the configurations simulated by the sweep runners."""
+    calls = []
+    run = microgrid_sweep.SweepRunner.run
+    def counted_run(self, config, *args):
+        calls.append(config)
+        return run(self, config, *args)
+    monkeypatch.setattr(microgrid_sweep.SweepRunner, 'run', counted_run)
+    return calls
+
+def test_sweep_resumes_from_cache(tmp_path, monkeypatch):
+    configs = make_grid({'PV1.area': [5000, 20000], 'Battery1.charge_capacity': [5000, 40000]})
+    cache_file = tmp_path / 'sweep.jsonl'
+    rows = run_sweep(configs, **SETTINGS)
+    assert run_sweep(configs, cache_file=cache_file, **SETTINGS) == rows
+
+    lines = cache_file.read_text().splitlines()
+    assert len(lines) == len(configs)
+    cache_file.write_text('\n'.join(lines[:1]) + '\n')
+    calls = count_runs(monkeypatch)
+    assert run_sweep(configs, cache_file=cache_file, **SETTINGS) == rows
+    assert len(calls) == len(configs) - 1
+
+    calls.clear()
+    assert run_sweep(configs, cache_file=cache_file, **SETTINGS) == rows
+    assert calls == []
+
+def test_cache_is_keyed_by_settings(tmp_path, monkeypatch):
+    configs = [{'PV1.area': 5000}]
+    cache_file = tmp_path / 'sweep.jsonl'
+    run_sweep(configs, cache_file=cache_file, **SETTINGS)
+    calls = count_runs(monkeypatch)
+    run_sweep(configs, cache_file=cache_file, **(SETTINGS | {'seed': 2}))
+    assert calls == configs
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from aux.benchmarks import get_circuits_pairwise
+from model.microgrid_topology import get_circuits
+
+@pytest.mark.parametrize('seed', range(5))
+def test_circuits_match_pairwise_search(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(100):
+        n = int(rng.integers(1, 14))
+        conn = (rng.random((n, n)) < rng.random() * 0.3).astype(float)
+        names = [f'Actor{i}' for i in range(n)]
+        assert get_circuits(conn, names) == get_circuits_pairwise(conn, names)
+
+def test_circuits_of_connected_buses():
+    names = ['Battery', 'Bus', 'Load', 'PV']
+    conn = [[0, 1, 0, 0],
+            [1, 0, 1, 0],
+            [0, 0, 0, 0],
+            [0, 1, 0, 0]]
+    assert get_circuits(conn, names) == get_circuits_pairwise(conn, names)